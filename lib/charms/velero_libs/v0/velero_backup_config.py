@@ -51,16 +51,24 @@ class SomeCharm(CharmBase):
     )
     # ...
 ```
+
+The library also provides `compute_spec_overlaps` to find which objects would be backed up more
+than once by a set of specifications, e.g. the ones returned by
+`VeleroBackupRequier.get_backup_spec_overlaps`, and `coalesce_specs` to merge the specifications
+that a single Velero backup can cover, see `VeleroBackupRequier.get_coalesced_backup_specs`.
 """
 
 import logging
 import re
-from typing import Dict, List, Optional, Union
+from dataclasses import dataclass
+from functools import cached_property
+from itertools import combinations
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple, Union
 
 from ops import BoundEvent, EventBase
 from ops.charm import CharmBase
 from ops.framework import Object
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
 # The unique Charmhub library identifier, never change it
 LIBID = "3fcd828c77024b0f9a7ea3544805456b"
@@ -70,15 +78,25 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 1
+LIBPATCH = 10
 
 # Regex to check if the provided TTL is a correct duration
 DURATION_REGEX = r"^(?=.*\d)(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$"
+_DURATION_PATTERN = re.compile(DURATION_REGEX)
 
 SPEC_FIELD = "spec"
 APP_FIELD = "app"
 RELATION_FIELD = "relation_name"
 MODEL_FIELD = "model"
+# Requirer app databag field advertising the LIBPATCH of the library it runs
+LIBPATCH_FIELD = "libpatch"
+
+# First LIBPATCH whose requirer applies VeleroBackupSpec.exclude_labels, older requirers drop the
+# field when they parse the spec and back up the objects it was meant to leave out
+EXCLUDE_LABELS_LIBPATCH = 8
+
+# Velero wildcard meaning "everything" in include/exclude lists
+WILDCARD = "*"
 
 logger = logging.getLogger(__name__)
 
@@ -86,12 +104,16 @@ logger = logging.getLogger(__name__)
 class VeleroBackupSpec(BaseModel):
     """Dataclass representing the Velero backup configuration.
 
+    The validation, including the TTL format, is compiled once with the model.
+
     Args:
         include_namespaces (Optional[List[str]]): Namespaces to include in the backup.
         include_resources (Optional[List[str]]): Resources to include in the backup.
         exclude_namespaces (Optional[List[str]]): Namespaces to exclude from the backup.
         exclude_resources (Optional[List[str]]): Resources to exclude from the backup.
         label_selector (Optional[Dict[str, str]]): Label selector for filtering resources.
+        exclude_labels (Optional[List[str]]): Label keys whose objects are left out of the
+            backup, as "DoesNotExist" requirements of the label selector.
         include_cluster_resources (Optional[bool]):
             Whether to include cluster-wide resources in the backup.
             Defaults to None (auto detect based on resources).
@@ -103,15 +125,353 @@ class VeleroBackupSpec(BaseModel):
     exclude_namespaces: Optional[List[str]] = None
     exclude_resources: Optional[List[str]] = None
     label_selector: Optional[Dict[str, str]] = None
+    exclude_labels: Optional[List[str]] = None
     ttl: Optional[str] = None
     include_cluster_resources: Optional[bool] = None
 
-    def __post_init__(self):
-        """Validate the specification."""
-        if self.ttl and not re.match(DURATION_REGEX, self.ttl):
+    @field_validator("ttl")
+    @classmethod
+    def validate_ttl(cls, ttl: Optional[str]) -> Optional[str]:
+        """Validate the TTL duration."""
+        if ttl and not _DURATION_PATTERN.match(ttl):
             raise ValueError(
-                f"Invalid TTL format: {self.ttl}. Expected format: '24h', '10h10m10s', etc."
+                f"Invalid TTL format: {ttl}. Expected format: '24h', '10h10m10s', etc."
             )
+        return ttl
+
+
+@dataclass(frozen=True)
+class ScopeSet:
+    """Set of names that can also represent "everything except some names".
+
+    Velero treats a missing include list, or one containing "*", as "everything", so the sets
+    selected by a spec are either finite or co-finite. Both are stored as a frozenset of names
+    plus a complement flag, which keeps every set operation linear in the number of names.
+
+    Args:
+        names (FrozenSet[str]): The names in the set, or the names excluded if complement.
+        complement (bool): Whether the set is everything except `names`.
+    """
+
+    names: FrozenSet[str] = frozenset()
+    complement: bool = False
+
+    @classmethod
+    def from_spec(
+        cls, include: Optional[Iterable[str]], exclude: Optional[Iterable[str]]
+    ) -> "ScopeSet":
+        """Build the set selected by a pair of Velero include/exclude lists.
+
+        Args:
+            include (Optional[Iterable[str]]): Names to include. None or "*" means everything.
+            exclude (Optional[Iterable[str]]): Names to exclude.
+
+        Returns:
+            ScopeSet: The selected set.
+        """
+        excluded = frozenset(name.lower() for name in exclude or [])
+        included = frozenset(name.lower() for name in include or [WILDCARD])
+        if WILDCARD in excluded:
+            return cls()
+        if WILDCARD in included:
+            return cls(excluded, complement=True)
+        return cls(included - excluded)
+
+    def __bool__(self) -> bool:
+        """Whether the set is not empty."""
+        return self.complement or bool(self.names)
+
+    def __contains__(self, name: object) -> bool:
+        """Whether a name belongs to the set."""
+        return isinstance(name, str) and ((name.lower() in self.names) != self.complement)
+
+    def __le__(self, other: "ScopeSet") -> bool:
+        """Whether the set is a subset of another one."""
+        if self.complement:
+            return other.complement and other.names <= self.names
+        if other.complement:
+            return not self.names & other.names
+        return self.names <= other.names
+
+    def __or__(self, other: "ScopeSet") -> "ScopeSet":
+        """Union of two sets."""
+        if self.complement and other.complement:
+            return ScopeSet(self.names & other.names, complement=True)
+        if self.complement:
+            return ScopeSet(self.names - other.names, complement=True)
+        if other.complement:
+            return ScopeSet(other.names - self.names, complement=True)
+        return ScopeSet(self.names | other.names)
+
+    def __and__(self, other: "ScopeSet") -> "ScopeSet":
+        """Intersection of two sets."""
+        if self.complement and other.complement:
+            return ScopeSet(self.names | other.names, complement=True)
+        if self.complement:
+            return ScopeSet(other.names - self.names)
+        if other.complement:
+            return ScopeSet(self.names - other.names)
+        return ScopeSet(self.names & other.names)
+
+    def to_spec(self) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+        """Build the Velero include/exclude lists selecting the set.
+
+        Returns:
+            Tuple[Optional[List[str]], Optional[List[str]]]: The include and exclude lists.
+
+        Raises:
+            ValueError: If the set is empty, a missing include list means everything for Velero
+                and it rejects the wildcard in exclude lists.
+        """
+        if self.complement:
+            return [WILDCARD], sorted(self.names) or None
+        if not self.names:
+            raise ValueError("Velero cannot select an empty set")
+        return sorted(self.names), None
+
+    def __str__(self) -> str:
+        """Human readable representation of the set."""
+        names = ", ".join(sorted(self.names))
+        if self.complement:
+            return f"* except [{names}]" if names else "*"
+        return f"[{names}]"
+
+
+@dataclass(frozen=True)
+class SpecScope:
+    """The objects selected by a VeleroBackupSpec.
+
+    Args:
+        namespaces (ScopeSet): Namespaces whose resources are backed up.
+        resources (ScopeSet): Resources that are backed up.
+        cluster_resources (bool): Whether cluster-scoped resources are backed up.
+        label_selector (Dict[str, str]): Labels the backed up objects must match.
+        exclude_labels (FrozenSet[str]): Label keys the backed up objects must not have.
+    """
+
+    namespaces: ScopeSet
+    resources: ScopeSet
+    cluster_resources: bool
+    label_selector: Dict[str, str]
+    exclude_labels: FrozenSet[str] = frozenset()
+
+    @classmethod
+    def from_spec(cls, spec: VeleroBackupSpec) -> "SpecScope":
+        """Build the scope of a spec following the Velero selection rules.
+
+        When include_cluster_resources is not set, Velero only backs up all the cluster-scoped
+        resources if the backup covers all namespaces.
+
+        Args:
+            spec (VeleroBackupSpec): The backup specification.
+
+        Returns:
+            SpecScope: The objects selected by the spec.
+        """
+        namespaces = ScopeSet.from_spec(spec.include_namespaces, spec.exclude_namespaces)
+        cluster_resources = spec.include_cluster_resources
+        if cluster_resources is None:
+            cluster_resources = namespaces == ScopeSet(complement=True)
+        return cls(
+            namespaces=namespaces,
+            resources=ScopeSet.from_spec(spec.include_resources, spec.exclude_resources),
+            cluster_resources=cluster_resources,
+            label_selector=spec.label_selector or {},
+            exclude_labels=frozenset(spec.exclude_labels or []),
+        )
+
+    def mergeable(self, other: "SpecScope") -> bool:
+        """Whether the objects of both scopes are exactly the objects of a single scope.
+
+        A backup selects every resource of `resources` in every namespace of `namespaces`, so
+        the union of two scopes is a scope when they share their namespaces or their
+        resources, or when one contains the other. The cluster-scoped resources and the label
+        selectors must be the same. The scopes without namespaces are never merged, since
+        Velero cannot select no namespace.
+        """
+        if (self.cluster_resources, self.label_selector, self.exclude_labels) != (
+            other.cluster_resources,
+            other.label_selector,
+            other.exclude_labels,
+        ):
+            return False
+        if not self.namespaces or not other.namespaces:
+            return False
+        return (
+            self.namespaces == other.namespaces
+            or self.resources == other.resources
+            or (self.namespaces <= other.namespaces and self.resources <= other.resources)
+            or (other.namespaces <= self.namespaces and other.resources <= self.resources)
+        )
+
+    def __or__(self, other: "SpecScope") -> "SpecScope":
+        """Union of two mergeable scopes."""
+        return SpecScope(
+            namespaces=self.namespaces | other.namespaces,
+            resources=self.resources | other.resources,
+            cluster_resources=self.cluster_resources,
+            label_selector=self.label_selector,
+            exclude_labels=self.exclude_labels,
+        )
+
+    def to_spec(self, ttl: Optional[str]) -> VeleroBackupSpec:
+        """Build a spec selecting the objects of the scope.
+
+        include_cluster_resources is always set, since the Velero default depends on the
+        namespaces, which can change when scopes are merged.
+        """
+        include_namespaces, exclude_namespaces = self.namespaces.to_spec()
+        include_resources, exclude_resources = self.resources.to_spec()
+        return VeleroBackupSpec(
+            include_namespaces=include_namespaces,
+            exclude_namespaces=exclude_namespaces,
+            include_resources=include_resources,
+            exclude_resources=exclude_resources,
+            label_selector=self.label_selector or None,
+            exclude_labels=sorted(self.exclude_labels) or None,
+            include_cluster_resources=self.cluster_resources,
+            ttl=ttl,
+        )
+
+    @property
+    def empty(self) -> bool:
+        """Whether the scope selects no object."""
+        return not self.resources or not (self.namespaces or self.cluster_resources)
+
+    def labels_compatible(self, other: "SpecScope") -> bool:
+        """Whether an object can match the label selectors of both scopes."""
+        if self.label_selector.keys() & other.exclude_labels:
+            return False
+        if other.label_selector.keys() & self.exclude_labels:
+            return False
+        return all(
+            other.label_selector.get(key, value) == value
+            for key, value in self.label_selector.items()
+        )
+
+
+@dataclass(frozen=True)
+class SpecOverlap:
+    """Objects selected by two backup specifications at the same time.
+
+    Args:
+        first (str): Key of the first specification.
+        second (str): Key of the second specification.
+        namespaces (ScopeSet): Namespaces backed up by both specifications.
+        resources (ScopeSet): Resources backed up by both specifications.
+        cluster_resources (bool): Whether cluster-scoped resources of `resources` are
+            backed up by both specifications.
+    """
+
+    first: str
+    second: str
+    namespaces: ScopeSet
+    resources: ScopeSet
+    cluster_resources: bool
+
+    def __str__(self) -> str:
+        """Human readable representation of the overlap."""
+        scope = f"resources {self.resources} in namespaces {self.namespaces}"
+        if self.cluster_resources:
+            scope += " and cluster-scoped"
+        return f"'{self.first}' and '{self.second}' both back up {scope}"
+
+
+def compute_spec_overlaps(specs: Mapping[str, VeleroBackupSpec]) -> List[SpecOverlap]:
+    """Compute the pairwise overlap of a set of backup specifications.
+
+    Two specifications overlap when some objects are backed up by both, which means that the
+    same bytes are stored twice. Label selectors are only used to rule out overlaps, when both
+    specifications require a different value for the same label.
+
+    Args:
+        specs (Mapping[str, VeleroBackupSpec]): The specifications indexed by a key that
+            identifies them, e.g. "<model>/<app>/<endpoint>".
+
+    Returns:
+        List[SpecOverlap]: The overlapping pairs, empty if the specifications are disjoint.
+    """
+    scopes = {key: SpecScope.from_spec(spec) for key, spec in specs.items()}
+    overlaps = []
+    for (first, first_scope), (second, second_scope) in combinations(scopes.items(), 2):
+        resources = first_scope.resources & second_scope.resources
+        if not resources or not first_scope.labels_compatible(second_scope):
+            continue
+        namespaces = first_scope.namespaces & second_scope.namespaces
+        cluster_resources = first_scope.cluster_resources and second_scope.cluster_resources
+        if namespaces or cluster_resources:
+            overlaps.append(SpecOverlap(first, second, namespaces, resources, cluster_resources))
+    return overlaps
+
+
+@dataclass(frozen=True)
+class CoalescedSpec:
+    """A backup specification standing for one or more merged specifications.
+
+    Args:
+        spec (VeleroBackupSpec): The specification to back up.
+        keys (List[str]): Keys of the specifications it stands for.
+    """
+
+    spec: VeleroBackupSpec
+    keys: List[str]
+
+
+@dataclass
+class _SpecGroup:
+    """Specifications being merged, spec is None once merged into a new specification."""
+
+    ttl: Optional[str]
+    scope: SpecScope
+    keys: List[str]
+    spec: Optional[VeleroBackupSpec]
+
+
+def coalesce_specs(specs: Mapping[str, VeleroBackupSpec]) -> List[CoalescedSpec]:
+    """Merge the specifications that can be backed up by a single Velero backup.
+
+    Every backup enumerates the objects of the cluster, so merging specifications saves
+    enumeration passes. Specifications are only merged if they have the same TTL and if the
+    merged specification backs up exactly their objects, see SpecScope.mergeable. Schedules are
+    not part of the specifications, so only specifications sharing a schedule must be passed.
+
+    Args:
+        specs (Mapping[str, VeleroBackupSpec]): The specifications indexed by a key that
+            identifies them, e.g. "<model>/<app>/<endpoint>".
+
+    Returns:
+        List[CoalescedSpec]: The specifications to back up, with the keys they stand for. The
+            specifications that are not merged are returned unchanged, and the ones selecting
+            no object are left out, since they need no backup.
+    """
+    groups = []
+    for key, spec in specs.items():
+        scope = SpecScope.from_spec(spec)
+        if scope.empty:
+            logger.info("Skipping the backup of '%s', its spec selects no object", key)
+            continue
+        groups.append(_SpecGroup(spec.ttl, scope, [key], spec))
+    merged = True
+    while merged:
+        merged = False
+        for first, second in combinations(groups, 2):
+            if first.ttl == second.ttl and first.scope.mergeable(second.scope):
+                scope = first.scope | second.scope
+                if scope == second.scope:
+                    # the specification covering the other one is kept as is
+                    first.spec = second.spec
+                elif scope != first.scope:
+                    first.spec = None
+                first.scope = scope
+                first.keys += second.keys
+                groups.remove(second)
+                merged = True
+                break
+
+    return [
+        CoalescedSpec(spec=group.spec or group.scope.to_spec(group.ttl), keys=group.keys)
+        for group in groups
+    ]
 
 
 class VeleroBackupRequier(Object):
@@ -127,6 +487,44 @@ class VeleroBackupRequier(Object):
         super().__init__(charm, relation_name)
         self._charm = charm
         self._relation_name = relation_name
+        # Specs already validated during this dispatch, indexed by their JSON
+        self._specs: Dict[str, VeleroBackupSpec] = {}
+        # Remote app databags read during this dispatch, indexed by relation id
+        self._databags: Optional[Dict[int, Dict[str, str]]] = None
+
+        self.framework.observe(self._charm.on.leader_elected, self._advertise_libpatch)
+        self.framework.observe(
+            self._charm.on[self._relation_name].relation_created, self._advertise_libpatch
+        )
+        self.framework.observe(self._charm.on.upgrade_charm, self._advertise_libpatch)
+
+    def _advertise_libpatch(self, event: EventBase) -> None:
+        """Tell the providers which LIBPATCH of the library this requirer runs."""
+        if not self._charm.model.unit.is_leader():
+            return
+        for relation in self.model.relations[self._relation_name]:
+            databag = relation.data[self._charm.app]
+            if databag.get(LIBPATCH_FIELD) != str(LIBPATCH):
+                databag[LIBPATCH_FIELD] = str(LIBPATCH)
+
+    def _remote_databags(self) -> Dict[int, Dict[str, str]]:
+        """Read the databag of every related app once per dispatch.
+
+        Each databag is read with a single relation-get, and every field is then served from a
+        plain dict, without going through the relation data access checks again.
+        """
+        if self._databags is None:
+            self._databags = {
+                relation.id: dict(relation.data[relation.app]) if relation.app else {}
+                for relation in self.model.relations[self._relation_name]
+            }
+        return self._databags
+
+    def _parse_spec(self, json_data: str) -> VeleroBackupSpec:
+        """Validate a spec once per dispatch, the returned spec must not be modified."""
+        if json_data not in self._specs:
+            self._specs[json_data] = VeleroBackupSpec.model_validate_json(json_data)
+        return self._specs[json_data]
 
     def get_backup_spec(
         self, app_name: str, endpoint: str, model: str
@@ -141,17 +539,13 @@ class VeleroBackupRequier(Object):
         Returns:
             Optional[VeleroBackupSpec]: The backup specification if available, otherwise None.
         """
-        relations = self.model.relations[self._relation_name]
-
-        for relation in relations:
-            data = relation.data.get(relation.app, {})
+        for data in self._remote_databags().values():
             if (
                 data.get(APP_FIELD) == app_name
                 and data.get(MODEL_FIELD) == model
                 and data.get(RELATION_FIELD) == endpoint
             ):
-                json_data = data.get(SPEC_FIELD, "{}")
-                return VeleroBackupSpec.model_validate_json(json_data)
+                return self._parse_spec(data.get(SPEC_FIELD, "{}"))
 
         logger.warning("No backup spec found for app '%s' and endpoint '%s'", app_name, endpoint)
         return None
@@ -162,14 +556,39 @@ class VeleroBackupRequier(Object):
         Returns:
             List[VeleroBackupSpec]: A list of all active backup specifications.
         """
-        specs = []
-        relations = self.model.relations[self._relation_name]
+        return [
+            self._parse_spec(data.get(SPEC_FIELD, "{}"))
+            for data in self._remote_databags().values()
+        ]
+
+    def _keyed_specs(self) -> Dict[str, VeleroBackupSpec]:
+        """Get the specifications indexed by "<model>/<app>/<endpoint>"."""
+        specs = {}
+        for data in self._remote_databags().values():
+            key = f"{data.get(MODEL_FIELD)}/{data.get(APP_FIELD)}/{data.get(RELATION_FIELD)}"
+            specs[key] = self._parse_spec(data.get(SPEC_FIELD, "{}"))
+        return specs
 
-        for relation in relations:
-            json_data = relation.data[relation.app].get(SPEC_FIELD, "{}")
-            specs.append(VeleroBackupSpec.model_validate_json(json_data))
+    def get_coalesced_backup_specs(self) -> List[CoalescedSpec]:
+        """Get the specifications merged into as few backups as possible, see coalesce_specs.
 
-        return specs
+        Returns:
+            List[CoalescedSpec]: The specifications to back up, with the "<model>/<app>/<endpoint>"
+                of the related applications they stand for.
+        """
+        return coalesce_specs(self._keyed_specs())
+
+    def get_backup_spec_overlaps(self) -> List[SpecOverlap]:
+        """Get the objects that are backed up by more than one related application.
+
+        Returns:
+            List[SpecOverlap]: The overlapping pairs of specifications, where each specification
+                is identified by "<model>/<app>/<endpoint>".
+        """
+        overlaps = compute_spec_overlaps(self._keyed_specs())
+        for overlap in overlaps:
+            logger.warning("Overlapping backup specs: %s", overlap)
+        return overlaps
 
 
 class VeleroBackupProvider(Object):
@@ -197,6 +616,9 @@ class VeleroBackupProvider(Object):
         self._model = self._charm.model.name
         self._relation_name = relation_name
         self._spec = spec
+        # Number of relation databag updates performed or skipped because the data was unchanged
+        self.writes_performed = 0
+        self.writes_skipped = 0
 
         self.framework.observe(self._charm.on.leader_elected, self._send_data)
         self.framework.observe(
@@ -210,8 +632,35 @@ class VeleroBackupProvider(Object):
             for event in refresh_event:
                 self.framework.observe(event, self._send_data)
 
-    def _send_data(self, event: EventBase):
+    @property
+    def spec(self) -> VeleroBackupSpec:
+        """The backup specification sent to the relation."""
+        return self._spec
+
+    @cached_property
+    def spec_json(self) -> str:
+        """The backup specification serialized once and shared by every relation."""
+        return self._spec.model_dump_json()
+
+    def requirers_libpatch(self) -> Optional[int]:
+        """Get the oldest LIBPATCH advertised by the related requirers.
+
+        Returns:
+            Optional[int]: The oldest LIBPATCH, 0 for requirers that do not advertise it, or None
+                if there is no relation.
+        """
+        libpatches = []
+        for relation in self._charm.model.relations.get(self._relation_name, []):
+            libpatch = relation.data[relation.app].get(LIBPATCH_FIELD) if relation.app else None
+            libpatches.append(int(libpatch) if libpatch and libpatch.isdigit() else 0)
+        return min(libpatches, default=None)
+
+    def _send_data(self, event: EventBase) -> None:
         """Handle any event where we should send data to the relation."""
+        self.publish()
+
+    def publish(self) -> None:
+        """Send the backup specification to every relation, unless it is already there."""
         if not self._charm.model.unit.is_leader():
             logger.warning(
                 "VeleroBackupProvider handled send_data event when it is not a leader. "
@@ -228,12 +677,17 @@ class VeleroBackupProvider(Object):
                 self._relation_name,
             )
             return
+        data = {
+            MODEL_FIELD: self._model,
+            APP_FIELD: self._app_name,
+            RELATION_FIELD: self._relation_name,
+            SPEC_FIELD: self.spec_json,
+        }
         for relation in relations:
-            relation.data[self._charm.app].update(
-                {
-                    MODEL_FIELD: self._model,
-                    APP_FIELD: self._app_name,
-                    RELATION_FIELD: self._relation_name,
-                    SPEC_FIELD: self._spec.model_dump_json(),
-                }
-            )
+            databag = relation.data[self._charm.app]
+            if all(databag.get(key) == value for key, value in data.items()):
+                # Every relation-set is a hook tool call and a relation-changed on the requirer
+                self.writes_skipped += 1
+                continue
+            databag.update(data)
+            self.writes_performed += 1
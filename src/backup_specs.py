@@ -0,0 +1,229 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Backup specifications published by the Infra Backup charm."""
+
+import logging
+from collections.abc import Collection
+from fnmatch import fnmatchcase
+from typing import Optional
+
+from charms.velero_libs.v0.velero_backup_config import VeleroBackupSpec
+
+from deduplication import EXCLUDE_LABELS
+from k8s_utils import NamespaceInfo
+from literals import (
+    CLUSTER_INFRA_BACKUP,
+    NAMESPACED_INFRA_BACKUP,
+    RESOURCES_BACKUP,
+    STABLE_RESOURCES_BACKUP,
+    TTL_TIER_ENDPOINTS,
+    VOLATILE_INFRA_BACKUP,
+    VOLATILE_RESOURCES_BACKUP,
+    InfraBackupConfig,
+)
+from namespace_selection import match_namespaces
+
+logger = logging.getLogger(__name__)
+
+
+def cluster_infra_backup_excluded_resources(config: InfraBackupConfig) -> list[str]:
+    """Resources left out of cluster-infra-backup.
+
+    Persistent Volumes are not backed up because it is workload related and applications
+    should be responsible for configuring the backup.
+
+    Pods are not part of the backup because they ephemeral and should be controlled by a
+    higher-level such as Deployments, StatefulSets, and DaemonSets.
+
+    RESOURCES_BACKUP are ignored to avoid duplication of resources with the
+    namespaced-infra-backup endpoint.
+
+    The cluster-scoped resources of the cluster-resources-profile and cluster-resources-exclude
+    configs are ignored, as they are regenerated by their controllers.
+
+    Args:
+        config (InfraBackupConfig): The charm config.
+
+    Returns:
+        list[str]: The excluded resources, without duplicates.
+    """
+    return list(
+        dict.fromkeys(
+            RESOURCES_BACKUP + ["persistentvolumes", "pods"] + config.excluded_cluster_resources
+        )
+    )
+
+
+def cluster_infra_backup_spec(
+    cluster_namespaces: set[str], config: InfraBackupConfig
+) -> VeleroBackupSpec:
+    """Build the spec of cluster-infra-backup.
+
+    See cluster_infra_backup_excluded_resources for the resources left out of the backup.
+
+    Args:
+        cluster_namespaces (set[str]): Namespaces available in the K8s cluster.
+        config (InfraBackupConfig): The charm config.
+
+    Returns:
+        VeleroBackupSpec: The backup specification.
+    """
+    return VeleroBackupSpec(
+        include_namespaces=sorted(cluster_namespaces & config.backup_namespaces),
+        exclude_resources=cluster_infra_backup_excluded_resources(config),
+        include_cluster_resources=True,
+        ttl=config.cluster_infra_backup_ttl or None,
+    )
+
+
+def cluster_infra_backup_specs(
+    cluster_namespaces: set[str], config: InfraBackupConfig, related_tiers: Collection[str] = ()
+) -> dict[str, VeleroBackupSpec]:
+    """Split the cluster-infra-backup namespaces between their TTL tiers.
+
+    Every namespace goes to the first tier of namespace-ttl-tiers matching it, and is published
+    on the endpoint of the tier with its TTL instead of cluster-infra-backup. The namespaces of
+    a tier whose endpoint is not related stay in cluster-infra-backup, so they are backed up
+    whatever the relations. An empty include_namespaces means every namespace for Velero, so a
+    tier is not published without namespaces, and cluster-infra-backup keeps the namespaces of
+    the tier that would leave it without any.
+
+    Args:
+        cluster_namespaces (set[str]): Namespaces available in the K8s cluster.
+        config (InfraBackupConfig): The charm config.
+        related_tiers (Collection[str]): The related TTL tier endpoints.
+
+    Returns:
+        dict[str, VeleroBackupSpec]: The backup specifications indexed by endpoint.
+    """
+    remaining = cluster_namespaces & config.backup_namespaces
+    tier_specs = {}
+    for endpoint, (patterns, ttl) in zip(TTL_TIER_ENDPOINTS, config.ttl_tiers):
+        if endpoint not in related_tiers:
+            continue
+        tiered = {
+            namespace
+            for namespace in remaining
+            if any(fnmatchcase(namespace, pattern) for pattern in patterns)
+        }
+        if not tiered:
+            continue
+        if tiered == remaining:
+            logger.warning(
+                "%s would take every namespace of %s, they are kept with its TTL instead of %s",
+                endpoint,
+                CLUSTER_INFRA_BACKUP,
+                ttl,
+            )
+            continue
+        remaining -= tiered
+        tier_specs[endpoint] = VeleroBackupSpec(
+            include_namespaces=sorted(tiered),
+            exclude_resources=cluster_infra_backup_excluded_resources(config),
+            include_cluster_resources=False,
+            ttl=ttl,
+        )
+    return {CLUSTER_INFRA_BACKUP: cluster_infra_backup_spec(remaining, config), **tier_specs}
+
+
+def excluded_namespaces(
+    cluster_namespaces: list[NamespaceInfo], config: InfraBackupConfig
+) -> Optional[list[str]]:
+    """Resolve the namespaces excluded from the all-namespaces specs.
+
+    Args:
+        cluster_namespaces (list[NamespaceInfo]): Namespaces available in the K8s cluster.
+        config (InfraBackupConfig): The charm config.
+
+    Returns:
+        Optional[list[str]]: The excluded namespaces, None if there are none.
+    """
+    excluded = match_namespaces(
+        cluster_namespaces, config.exclude_namespace_patterns, config.exclude_namespace_selector
+    )
+    return excluded or None
+
+
+def replica_labels(config: InfraBackupConfig) -> Optional[list[str]]:
+    """Labels of the replicated objects left out of the namespaced specs.
+
+    See the deduplication module for how the replicas are found.
+
+    Args:
+        config (InfraBackupConfig): The charm config.
+
+    Returns:
+        Optional[list[str]]: The label keys, None if deduplicate-replicas is disabled.
+    """
+    return EXCLUDE_LABELS if config.deduplicate_replicas else None
+
+
+def namespaced_infra_backup_spec(
+    config: InfraBackupConfig, volatile_split: bool, exclude_namespaces: Optional[list[str]] = None
+) -> VeleroBackupSpec:
+    """Build the spec of namespaced-infra-backup.
+
+    Args:
+        config (InfraBackupConfig): The charm config.
+        volatile_split (bool): Whether VOLATILE_RESOURCES_BACKUP are published on
+            volatile-infra-backup instead.
+        exclude_namespaces (Optional[list[str]]): Namespaces excluded from the backup.
+
+    Returns:
+        VeleroBackupSpec: The backup specification.
+    """
+    return VeleroBackupSpec(
+        include_resources=STABLE_RESOURCES_BACKUP if volatile_split else RESOURCES_BACKUP,
+        exclude_namespaces=exclude_namespaces,
+        exclude_labels=replica_labels(config),
+        ttl=config.namespaced_infra_backup_ttl or None,
+    )
+
+
+def volatile_infra_backup_spec(
+    config: InfraBackupConfig, exclude_namespaces: Optional[list[str]] = None
+) -> VeleroBackupSpec:
+    """Build the spec of volatile-infra-backup.
+
+    Args:
+        config (InfraBackupConfig): The charm config.
+        exclude_namespaces (Optional[list[str]]): Namespaces excluded from the backup.
+
+    Returns:
+        VeleroBackupSpec: The backup specification.
+    """
+    return VeleroBackupSpec(
+        include_resources=VOLATILE_RESOURCES_BACKUP,
+        exclude_namespaces=exclude_namespaces,
+        exclude_labels=replica_labels(config),
+        ttl=config.volatile_infra_backup_ttl or None,
+    )
+
+
+def render_specs(
+    cluster_namespaces: list[NamespaceInfo],
+    config: InfraBackupConfig,
+    volatile_split: bool = False,
+    related_tiers: Collection[str] = (),
+) -> dict[str, VeleroBackupSpec]:
+    """Build the specs published on every endpoint.
+
+    Args:
+        cluster_namespaces (list[NamespaceInfo]): Namespaces available in the K8s cluster.
+        config (InfraBackupConfig): The charm config.
+        volatile_split (bool): Whether volatile-infra-backup is related.
+        related_tiers (Collection[str]): The related TTL tier endpoints.
+
+    Returns:
+        dict[str, VeleroBackupSpec]: The backup specifications indexed by endpoint.
+    """
+    names = {namespace.name for namespace in cluster_namespaces}
+    excluded = excluded_namespaces(cluster_namespaces, config)
+    specs = {
+        **cluster_infra_backup_specs(names, config, related_tiers),
+        NAMESPACED_INFRA_BACKUP: namespaced_infra_backup_spec(config, volatile_split, excluded),
+    }
+    if volatile_split:
+        specs[VOLATILE_INFRA_BACKUP] = volatile_infra_backup_spec(config, excluded)
+    return specs
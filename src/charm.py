@@ -4,33 +4,125 @@
 
 """The Infra Backup Charm."""
 
+import contextlib
+import dataclasses
+import functools
+import json
 import logging
-from typing import Optional
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator, MutableMapping, Optional
 
 import ops
-from charms.velero_libs.v0.velero_backup_config import VeleroBackupProvider, VeleroBackupSpec
+from charms.velero_libs.v0.velero_backup_config import (
+    EXCLUDE_LABELS_LIBPATCH,
+    VeleroBackupProvider,
+    VeleroBackupSpec,
+)
+from lightkube.core.resource import NamespacedResource, api_info
+from lightkube.resources.core_v1 import ConfigMap, Secret
+from lightkube.resources.flowcontrol_apiserver_v1 import FlowSchema, PriorityLevelConfiguration
 
-from k8s_utils import K8sUtils, K8sUtilsError
+from backup_specs import (
+    cluster_infra_backup_excluded_resources,
+    cluster_infra_backup_specs,
+    excluded_namespaces,
+    namespaced_infra_backup_spec,
+    volatile_infra_backup_spec,
+)
+from deduplication import Deduplicator
+from flow_control import API_GROUP_VERSION, flow_control_name, flow_schema, priority_level
+from k8s_utils import K8sUtils, K8sUtilsError, NamespaceInfo
+from leader_snapshot import LeaderSnapshot, digest, to_plain
 from literals import (
     CLUSTER_INFRA_BACKUP,
+    ESTIMATED_OBJECT_BYTES,
+    LEADER_SNAPSHOT_MAX_AGE,
     NAMESPACED_INFRA_BACKUP,
-    RESOURCES_BACKUP,
+    PEERS,
+    TTL_TIER_ENDPOINTS,
+    VOLATILE_INFRA_BACKUP,
     InfraBackupConfig,
+    parse_duration,
+)
+from metrics import CharmMetrics
+from namespace_selection import (
+    ExclusionDebouncer,
+    NamespaceContentCache,
+    NamespaceSelector,
+    cap_namespaces,
 )
+from profiling import HOOK_TOOL_CALL, K8S_API_CALL, call_stats, hot_functions, profile
 
 logger = logging.getLogger(__name__)
 
 
+def _config_digest(config: InfraBackupConfig) -> str:
+    """Digest of the charm config, to tell if a leader snapshot was taken with it."""
+    return digest(json.dumps(dataclasses.asdict(config), sort_keys=True))
+
+
+def _dispatched_hook() -> str:
+    """Name of the hook or action being dispatched, e.g. "update-status"."""
+    return os.environ.get("JUJU_DISPATCH_PATH", "unknown").rsplit("/", 1)[-1]
+
+
+def _excluded_group_resources(discovered: list[str], exclude_resources: list[str]) -> set[str]:
+    """Resolve the exclude_resources of a spec against the discovered group resources.
+
+    A bare plural, e.g. "nodes", is resolved to the first group resource in discovery order
+    with that plural, the core group first, as Velero does. A group resource, e.g.
+    "certificates.cert-manager.io", only matches itself.
+
+    Args:
+        discovered (list[str]): The group resources in discovery order.
+        exclude_resources (list[str]): The excluded resources of the spec.
+
+    Returns:
+        set[str]: The excluded group resources.
+    """
+    resolved: dict[str, str] = {}
+    for name in discovered:
+        resolved.setdefault(name.split(".", 1)[0], name)
+    return {
+        resolved.get(resource, resource) if "." not in resource else resource
+        for resource in exclude_resources
+    }
+
+
 class InfraBackupOperatorCharm(ops.CharmBase):
     """A charm for managing a K8s cluster infrastructure backup."""
 
+    _stored = ops.StoredState()
+
     def __init__(self, framework: ops.Framework) -> None:
         """Initialise the Infra Backup charm."""
         super().__init__(framework)
+        self._dispatch_start = time.monotonic()
+        self._stored.set_default(
+            metrics={},
+            namespace_selection={},
+            namespace_exclusion={},
+            namespace_objects={},
+            deduplicated_at=0.0,
+            deduplicating=False,
+        )
+        self.metrics = CharmMetrics(self._stored.metrics)
         self.k8s_utils = K8sUtils(self.unit.app.name)
         self.setup_failure: Optional[ops.StatusBase] = None
+        self.budget_status: Optional[ops.StatusBase] = None
         self.cluster_infra_backup: Optional[VeleroBackupProvider] = None
         self.namespaced_infra_backup: Optional[VeleroBackupProvider] = None
+        self.volatile_infra_backup: Optional[VeleroBackupProvider] = None
+        self.ttl_tier_backups: dict[str, VeleroBackupProvider] = {}
+        self.infra_config: Optional[InfraBackupConfig] = None
+        self.cluster_namespaces: Optional[list[NamespaceInfo]] = None
+        self.exclude_namespaces: Optional[list[str]] = None
+        self.selected_namespaces: list[str] = []
+        self.leader_snapshot: Optional[LeaderSnapshot] = None
+        self._scratch_state: Optional[dict[str, Any]] = None
 
         self.framework.observe(self.on.install, self._assess_cluster_backup_state)
         self.framework.observe(self.on.config_changed, self._assess_cluster_backup_state)
@@ -44,6 +136,28 @@ class InfraBackupOperatorCharm(ops.CharmBase):
                 self.on[relation].relation_broken, self._assess_cluster_backup_state
             )
 
+        for event in [self.on.upgrade_charm, self.on.config_changed, self.on.update_status]:
+            self.framework.observe(event, self._unpublish_ttl_tiers)
+        self.framework.observe(self.on.config_changed, self._deduplicate_replicas)
+        self.framework.observe(self.on.update_status, self._deduplicate_replicas)
+        for event in [
+            self.on.config_changed,
+            self.on.upgrade_charm,
+            self.on.leader_elected,
+            self.on.remove,
+        ]:
+            self.framework.observe(event, self._configure_flow_control)
+        self.framework.observe(
+            self.on.count_cluster_resources_action, self._on_count_cluster_resources
+        )
+        self.framework.observe(self.on.profile_reconcile_action, self._on_profile_reconcile)
+        self.framework.observe(self.framework.on.pre_commit, self._share_leader_snapshot)
+        self.framework.observe(self.framework.on.pre_commit, self._export_metrics)
+
+        self._load_infra_config()
+        self._adopt_leader_snapshot()
+        if not self.leader_snapshot:
+            self._list_cluster_namespaces()
         self._setup_cluster_infra_backup()
         self._set_namespaced_infra_backup()
 
@@ -65,45 +179,294 @@ class InfraBackupOperatorCharm(ops.CharmBase):
             )
 
         else:
-            self.model.unit.status = ops.ActiveStatus("Ready")
+            self.model.unit.status = self.budget_status or ops.ActiveStatus("Ready")
 
-    def _setup_cluster_infra_backup(self) -> None:
-        """Set up the relation for cluster-infra-backup.
+    def _load_infra_config(self) -> None:
+        """Load and validate the charm config."""
+        try:
+            self.infra_config = self.load_config(InfraBackupConfig)
+        except ValueError as e:
+            logger.error("Invalid charm config: %s", e)
+            self.setup_failure = ops.BlockedStatus(str(e))
 
-        Persistent Volumes are not backed up because it is workload related and applications
-        should be responsible for configuring the backup.
+    def _read_leader_snapshot(self) -> Optional[LeaderSnapshot]:
+        """Read the snapshot shared by the leader in the peer relation."""
+        relation = self.model.get_relation(PEERS)
+        raw = relation.data[self.app].get("snapshot") if relation else None
+        if not raw:
+            return None
+        try:
+            return LeaderSnapshot.from_json(raw)
+        except ValueError as e:
+            logger.warning("Ignoring the leader snapshot: %s", e)
+            return None
 
-        Pods are not part of the backup because they ephemeral and should be controlled by a
-        higher-level such as Deployments, StatefulSets, and DaemonSets.
+    def _adopt_leader_snapshot(self) -> None:
+        """Start a new leader from the snapshot of the previous one.
 
-        RESOURCES_BACKUP are ignored to avoid duplication of resources with the
-        namespaced-infra-backup endpoint.
+        The namespace selection and content cache of the previous leader are adopted, so the
+        debounce and grace periods carry over. The namespaces are not listed again if the
+        snapshot is fresh, was taken with the same config and still renders the published specs,
+        e.g. the relations or the charm revision did not change them since.
         """
+        if _dispatched_hook() != "leader-elected" or not self.infra_config:
+            return
+        snapshot = self._read_leader_snapshot()
+        if not snapshot:
+            return
+
+        self._stored.namespace_selection = snapshot.namespace_selection
+        self._stored.namespace_objects = snapshot.namespace_objects
+        if not snapshot.is_fresh(time.time(), LEADER_SNAPSHOT_MAX_AGE):
+            logger.info("The leader snapshot is too old, listing the namespaces")
+            return
+        if snapshot.config_digest != _config_digest(self.infra_config):
+            logger.info("The config changed since the leader snapshot, listing the namespaces")
+            return
+
+        volatile_split = self._relation_exist(VOLATILE_INFRA_BACKUP)
+        specs = {
+            **cluster_infra_backup_specs(
+                set(snapshot.selected_namespaces), self.infra_config, self._related_ttl_tiers()
+            ),
+            NAMESPACED_INFRA_BACKUP: namespaced_infra_backup_spec(
+                self.infra_config, volatile_split, snapshot.excluded_namespaces
+            ),
+            VOLATILE_INFRA_BACKUP: volatile_infra_backup_spec(
+                self.infra_config, snapshot.excluded_namespaces
+            ),
+        }
+        digests = {endpoint: digest(spec.model_dump_json()) for endpoint, spec in specs.items()}
+        if digests != snapshot.spec_digests:
+            logger.info("The specs changed since the leader snapshot, listing the namespaces")
+            return
+
+        logger.info(
+            "Adopted the leader snapshot of the namespaces at resourceVersion %s",
+            snapshot.resource_version,
+        )
+        self.leader_snapshot = snapshot
+
+    def _list_cluster_namespaces(self) -> None:
+        """List the cluster namespaces once for every spec."""
+        start = time.monotonic()
         try:
-            cluster_namespaces = self.k8s_utils.get_namespaces()
+            self.cluster_namespaces = self.k8s_utils.list_namespaces()
         except K8sUtilsError as e:
             logger.error("Failed to get the cluster namespaces: %s", e)
+            self.metrics.inc("infra_backup_k8s_api_errors_total", operation="list_namespaces")
             self.setup_failure = ops.WaitingStatus("Trying to get namespaces...")
             return
+        finally:
+            self.metrics.set(
+                "infra_backup_namespace_list_duration_seconds", time.monotonic() - start
+            )
+        self.metrics.set("infra_backup_cluster_namespaces", len(self.cluster_namespaces))
 
-        try:
-            config = self.load_config(InfraBackupConfig)
-        except ValueError as e:
-            logger.error("Invalid charm namespace config: %s", e)
-            self.setup_failure = ops.BlockedStatus(str(e))
+    def _setup_cluster_infra_backup(self) -> None:
+        """Set up the relations for cluster-infra-backup and the TTL tiers.
+
+        See cluster_infra_backup_spec for the resources that are part of the backup.
+
+        The namespaces of the namespace-ttl-tiers are published on the related endpoint of their
+        tier with its TTL, and left out of cluster-infra-backup, so they are not kept as long as
+        the cluster state. See cluster_infra_backup_specs for how the namespaces are split.
+        """
+        specs = self._cluster_infra_backup_specs()
+        if not specs:
             return
 
-        backup_namespaces = sorted(cluster_namespaces & config.backup_namespaces)
+        self.metrics.set("infra_backup_selected_namespaces", len(self.selected_namespaces))
         self.cluster_infra_backup = VeleroBackupProvider(
             self,
             relation_name=CLUSTER_INFRA_BACKUP,
-            spec=VeleroBackupSpec(
-                include_namespaces=backup_namespaces,
-                exclude_resources=RESOURCES_BACKUP + ["persistentvolumes", "pods"],
-                include_cluster_resources=True,
-            ),
-            refresh_event=[self.on.update_status, self.on.config_changed],
+            spec=specs.pop(CLUSTER_INFRA_BACKUP),
+            refresh_event=[self.on.update_status, self.on.config_changed]
+            + [self.on[endpoint].relation_created for endpoint in TTL_TIER_ENDPOINTS]
+            + [self.on[endpoint].relation_broken for endpoint in TTL_TIER_ENDPOINTS],
+        )
+        self.ttl_tier_backups = {
+            endpoint: VeleroBackupProvider(
+                self,
+                relation_name=endpoint,
+                spec=spec,
+                refresh_event=[
+                    self.on.upgrade_charm,
+                    self.on.config_changed,
+                    self.on.update_status,
+                ],
+            )
+            for endpoint, spec in specs.items()
+        }
+
+    def _unpublish_ttl_tiers(self, _: ops.EventBase) -> None:
+        """Clear the spec of the related TTL tiers that have no namespaces anymore.
+
+        A tier gets no spec when it is removed from namespace-ttl-tiers, its namespaces are
+        gone, or it would take every namespace of cluster-infra-backup. Its namespaces are then
+        back in cluster-infra-backup, so the spec published before would back them up twice.
+        """
+        if not self.cluster_infra_backup or not self.unit.is_leader():
+            return
+        for endpoint in TTL_TIER_ENDPOINTS:
+            if endpoint in self.ttl_tier_backups:
+                continue
+            for relation in self.model.relations[endpoint]:
+                databag = relation.data[self.app]
+                if databag:
+                    logger.info("Clearing the spec of %s, the tier has no namespaces", endpoint)
+                    databag.clear()
+
+    def _cluster_infra_backup_specs(self) -> Optional[dict[str, VeleroBackupSpec]]:
+        """Build the cluster-infra-backup and TTL tier specs.
+
+        Returns:
+            Optional[dict[str, VeleroBackupSpec]]: The specs indexed by endpoint, None if they
+                cannot or must not be published.
+        """
+        if not self.infra_config:
+            return None
+
+        if self.leader_snapshot:
+            backup_namespaces: Optional[set[str]] = set(self.leader_snapshot.selected_namespaces)
+        elif self.cluster_namespaces is not None:
+            backup_namespaces = self._select_namespaces(self.cluster_namespaces)
+        else:
+            return None
+        if backup_namespaces is None:
+            return None
+        self.selected_namespaces = sorted(backup_namespaces & self.infra_config.backup_namespaces)
+        return cluster_infra_backup_specs(
+            backup_namespaces, self.infra_config, self._related_ttl_tiers()
+        )
+
+    def _select_namespaces(self, cluster_namespaces: list[NamespaceInfo]) -> Optional[set[str]]:
+        """Select the cluster-infra-backup namespaces among the cluster namespaces.
+
+        Returns:
+            Optional[set[str]]: The selected namespaces, None if they are over the backup budget
+                and the spec must not be published.
+        """
+        if not self.infra_config:
+            return set()
+
+        selector = NamespaceSelector(
+            self._state("namespace_selection"),
+            min_age=parse_duration(self.infra_config.namespace_min_age),
+            removal_grace=parse_duration(self.infra_config.namespace_removal_grace),
+            debounce=parse_duration(self.infra_config.spec_debounce),
         )
+        backup_namespaces = selector.select(
+            cluster_namespaces,
+            self.infra_config.backup_namespaces,
+            datetime.now(timezone.utc),
+        )
+        budget = self.infra_config.backup_budget
+        if not self.infra_config.prune_empty_namespaces and budget is None:
+            return backup_namespaces
+
+        # the namespaces are kept if they cannot be counted
+        counts = self._count_namespace_objects(backup_namespaces)
+        if counts is None:
+            return backup_namespaces
+        if self.infra_config.prune_empty_namespaces:
+            empty = {namespace for namespace, objects in counts.items() if not objects}
+            if empty and empty == backup_namespaces:
+                # an empty include_namespaces would back up every namespace
+                logger.warning("Every selected namespace is empty, none is left out")
+                empty = set()
+            if empty:
+                logger.info("Namespaces without content left out: %s", ", ".join(sorted(empty)))
+            counts = {namespace: counts[namespace] for namespace in backup_namespaces - empty}
+        if budget is None:
+            return set(counts)
+        return self._apply_backup_budget(counts, budget)
+
+    def _count_namespace_objects(self, namespaces: set[str]) -> Optional[dict[str, int]]:
+        """Count the objects covered by cluster-infra-backup in every namespace.
+
+        Velero enumerates every resource of every included namespace on every backup, even if
+        the namespace has nothing to back up. The counts are cached for namespace-content-cache.
+
+        Returns:
+            Optional[dict[str, int]]: The number of objects by namespace, None on failure.
+        """
+        if not self.infra_config:
+            return None
+
+        excluded = set(cluster_infra_backup_excluded_resources(self.infra_config))
+
+        @functools.cache
+        def covered_resources() -> list[type[NamespacedResource]]:
+            # discovered only if a namespace is not in the cache
+            return [
+                resource
+                for plural, resource in self.k8s_utils.get_namespaced_resources().items()
+                if plural not in excluded
+            ]
+
+        def count(namespace: str) -> int:
+            return sum(
+                self.k8s_utils.count_objects(resource, namespace)
+                for resource in covered_resources()
+            )
+
+        cache = NamespaceContentCache(
+            self._state("namespace_objects"),
+            count,
+            max_age=parse_duration(self.infra_config.namespace_content_cache),
+        )
+        try:
+            return cache.counts(namespaces, datetime.now(timezone.utc))
+        except K8sUtilsError as e:
+            logger.error("Failed to count the namespace objects: %s", e)
+            self.metrics.inc("infra_backup_k8s_api_errors_total", operation="count_namespaces")
+            return None
+
+    def _apply_backup_budget(self, counts: dict[str, int], budget: int) -> Optional[set[str]]:
+        """Check the estimated size of cluster-infra-backup against the backup-budget-* config.
+
+        The estimate is a rough floor: only the namespaced objects of the selected namespaces
+        are counted, while the backup also holds the cluster-scoped ones, and the size assumes
+        a mean of ESTIMATED_OBJECT_BYTES per object instead of reading the objects.
+
+        Args:
+            counts (dict[str, int]): The number of objects of the selected namespaces.
+            budget (int): The maximum number of objects.
+
+        Returns:
+            Optional[set[str]]: The namespaces to publish, capped if backup-budget-action is
+                "cap", or None to keep the spec published before if it is "block" or if no
+                namespace fits in the budget.
+        """
+        if not self.infra_config:
+            return None
+
+        objects = sum(counts.values())
+        self.metrics.set("infra_backup_estimated_min_objects", objects)
+        self.metrics.set("infra_backup_estimated_min_bytes", objects * ESTIMATED_OBJECT_BYTES)
+        if objects <= budget:
+            return set(counts)
+
+        over_budget = (
+            f"{CLUSTER_INFRA_BACKUP} over budget: at least {objects} namespaced objects, "
+            f"{budget} allowed"
+        )
+        if self.infra_config.backup_budget_action == "block":
+            logger.error("%s, the spec is not updated", over_budget)
+            self.setup_failure = ops.BlockedStatus(over_budget)
+            return None
+
+        capped = cap_namespaces(counts, budget)
+        if not capped:
+            # an empty include_namespaces would back up every namespace
+            logger.error("%s, no namespace fits, the spec is not updated", over_budget)
+            self.setup_failure = ops.BlockedStatus(f"{over_budget}, no namespace fits")
+            return None
+        left_out = ", ".join(sorted(set(counts) - capped))
+        logger.warning("%s, namespaces left out: %s", over_budget, left_out)
+        self.budget_status = ops.ActiveStatus(f"Over backup budget, left out: {left_out}")
+        return capped
 
     def _set_namespaced_infra_backup(self) -> None:
         """Set up the relation for namespaced-infra-backup.
@@ -112,14 +475,381 @@ class InfraBackupOperatorCharm(ops.CharmBase):
         Roles, RoleBindings, NetworkPolicies, Secrets) are included in the backup across all
         namespaces. This is essential for preserving cluster functionality and security
         configurations.
+
+        When volatile-infra-backup is related, the high-churn VOLATILE_RESOURCES_BACKUP are
+        published on that endpoint instead, so the stable resources are not backed up as often
+        as the ones that change all the time.
+
+        The namespaces matching the namespaced-exclude-* config are excluded from both specs.
+        They are resolved against the cluster namespaces, so the specs are not updated when the
+        namespaces cannot be listed. Like the cluster-infra-backup namespaces, the exclusions
+        change at most once per spec-debounce, see ExclusionDebouncer.
         """
+        specs = self._namespaced_infra_backup_specs()
+        if not specs:
+            return
+
+        namespaced_spec, volatile_spec = specs
         self.namespaced_infra_backup = VeleroBackupProvider(
             self,
             relation_name=NAMESPACED_INFRA_BACKUP,
-            spec=VeleroBackupSpec(include_resources=RESOURCES_BACKUP),
-            refresh_event=[self.on.upgrade_charm],
+            spec=namespaced_spec,
+            refresh_event=[
+                self.on.upgrade_charm,
+                self.on.config_changed,
+                self.on.update_status,
+                self.on[VOLATILE_INFRA_BACKUP].relation_created,
+                self.on[VOLATILE_INFRA_BACKUP].relation_broken,
+            ],
+        )
+        self.volatile_infra_backup = VeleroBackupProvider(
+            self,
+            relation_name=VOLATILE_INFRA_BACKUP,
+            spec=volatile_spec,
+            refresh_event=[self.on.upgrade_charm, self.on.config_changed, self.on.update_status],
+        )
+
+    def _namespaced_infra_backup_specs(
+        self,
+    ) -> Optional[tuple[VeleroBackupSpec, VeleroBackupSpec]]:
+        """Build the namespaced-infra-backup and volatile-infra-backup specs.
+
+        Returns:
+            Optional[tuple[VeleroBackupSpec, VeleroBackupSpec]]: The specs, None if the excluded
+                namespaces cannot be resolved.
+        """
+        if not self.infra_config:
+            return None
+
+        exclude_namespaces = None
+        if self.leader_snapshot:
+            exclude_namespaces = self.leader_snapshot.excluded_namespaces
+        elif self.infra_config.excludes_namespaces:
+            if self.cluster_namespaces is None:
+                return None
+            exclude_namespaces = self._debounce_exclusions(
+                excluded_namespaces(self.cluster_namespaces, self.infra_config) or []
+            )
+        self.exclude_namespaces = exclude_namespaces
+
+        volatile_split = self._relation_exist(VOLATILE_INFRA_BACKUP)
+        return (
+            namespaced_infra_backup_spec(self.infra_config, volatile_split, exclude_namespaces),
+            volatile_infra_backup_spec(self.infra_config, exclude_namespaces),
+        )
+
+    def _debounce_exclusions(self, matched: list[str]) -> Optional[list[str]]:
+        """Hold back the changes of the excluded namespaces within the spec-debounce window."""
+        if not self.infra_config:
+            return matched or None
+        debouncer = ExclusionDebouncer(
+            self._state("namespace_exclusion"),
+            debounce=parse_duration(self.infra_config.spec_debounce),
+        )
+        config_key = json.dumps(
+            [
+                sorted(self.infra_config.exclude_namespace_patterns),
+                sorted(self.infra_config.exclude_namespace_selector.items()),
+            ]
+        )
+        return debouncer.resolve(matched, config_key, datetime.now(timezone.utc)) or None
+
+    def _deduplicate_replicas(self, _: ops.EventBase) -> None:
+        """Exclude the replicated Secrets and ConfigMaps from the charm backups.
+
+        Every Secret and ConfigMap is listed, so the search runs at most once per
+        deduplicate-interval. The labels set by the charm are removed when it is disabled, or
+        when a related requirer would not leave the labelled replicas out of the backups.
+        """
+        if not self.infra_config or not self.unit.is_leader():
+            return
+
+        deduplicator = Deduplicator(self.k8s_utils)
+        enabled = self.infra_config.deduplicate_replicas
+        if enabled and not self._exclude_labels_applied():
+            logger.warning(
+                "Not deduplicating the replicas, a requirer of %s does not apply the "
+                "exclude_labels of the specs, so the replicas are still backed up",
+                NAMESPACED_INFRA_BACKUP,
+            )
+            enabled = False
+        elapsed = time.time() - self._stored.deduplicated_at
+        if enabled and elapsed < parse_duration(self.infra_config.deduplicate_interval):
+            return
+        if not enabled and not self._stored.deduplicating:
+            return
+
+        try:
+            for resource in [Secret, ConfigMap]:
+                plural = api_info(resource).plural
+                if not enabled:
+                    restored = deduplicator.restore(resource)
+                    logger.info("Replicated %s backed up again: %d", plural, restored)
+                    continue
+                report = deduplicator.deduplicate(resource, self.exclude_namespaces or [])
+                logger.info(
+                    "Replicated %s excluded from the backups: %d (%d bytes saved), "
+                    "newly excluded: %d, backed up again: %d",
+                    plural,
+                    report.replicas,
+                    report.bytes_saved,
+                    report.excluded,
+                    report.restored,
+                )
+                self.metrics.set(
+                    "infra_backup_replicated_objects", report.replicas, resource=plural
+                )
+                self.metrics.set(
+                    "infra_backup_deduplicated_bytes", report.bytes_saved, resource=plural
+                )
+        except K8sUtilsError as e:
+            logger.error("Failed to deduplicate the replicated objects: %s", e)
+            self.metrics.inc("infra_backup_k8s_api_errors_total", operation="deduplicate")
+            return
+
+        if not enabled:
+            self.metrics.clear("infra_backup_replicated_objects")
+            self.metrics.clear("infra_backup_deduplicated_bytes")
+        self._stored.deduplicating = enabled
+        self._stored.deduplicated_at = time.time() if enabled else 0.0
+
+    def _exclude_labels_applied(self) -> bool:
+        """Check if every requirer of the namespaced specs leaves out their exclude_labels.
+
+        Older requirers drop the field when they parse the spec, so the replicas are only
+        deduplicated, and their size reported as saved, once every requirer advertises a
+        library that applies it.
+        """
+        libpatches = [
+            provider.requirers_libpatch()
+            for provider in (self.namespaced_infra_backup, self.volatile_infra_backup)
+            if provider
+        ]
+        related = [libpatch for libpatch in libpatches if libpatch is not None]
+        return bool(related) and min(related) >= EXCLUDE_LABELS_LIBPATCH
+
+    def _configure_flow_control(self, event: ops.EventBase) -> None:
+        """Apply or delete the API Priority and Fairness objects of the backup requests.
+
+        The requests of the charm are matched by its service account, named after the
+        application in the namespace of the model. Whether to delete the objects is decided from
+        the cluster, so a new leader also deletes the ones applied by the previous one.
+        """
+        if not self.infra_config or not self.unit.is_leader():
+            return
+
+        name = flow_control_name(self.app.name, self.model.name)
+        enabled = self.infra_config.flow_control and not isinstance(event, ops.RemoveEvent)
+        try:
+            if enabled and not self.k8s_utils.has_api(API_GROUP_VERSION):
+                logger.warning(
+                    "Not applying flow-control, the cluster does not serve %s", API_GROUP_VERSION
+                )
+            elif enabled:
+                subjects = [(self.model.name, self.app.name)]
+                subjects += self.infra_config.flow_control_subjects
+                self.k8s_utils.apply(
+                    priority_level(name, self.infra_config.flow_control_concurrency_shares)
+                )
+                self.k8s_utils.apply(flow_schema(name, subjects))
+            elif any(
+                self.k8s_utils.exists(resource, name)
+                for resource in (FlowSchema, PriorityLevelConfiguration)
+            ):
+                self.k8s_utils.delete(FlowSchema, name)
+                self.k8s_utils.delete(PriorityLevelConfiguration, name)
+        except K8sUtilsError as e:
+            logger.error("Failed to configure the API priority and fairness: %s", e)
+            self.metrics.inc("infra_backup_k8s_api_errors_total", operation="flow_control")
+
+    def _on_count_cluster_resources(self, event: ops.ActionEvent) -> None:
+        """Count the objects of every cluster-scoped resource and if they are backed up."""
+        if not self.infra_config:
+            event.fail("Invalid charm config")
+            return
+
+        try:
+            resources = self.k8s_utils.get_cluster_scoped_resources()
+            counts = {
+                name: self.k8s_utils.count_objects(resource)
+                for name, resource in sorted(resources.items())
+            }
+        except K8sUtilsError as e:
+            logger.error("Failed to count the cluster-scoped resources: %s", e)
+            self.metrics.inc(
+                "infra_backup_k8s_api_errors_total", operation="count_cluster_resources"
+            )
+            event.fail(str(e))
+            return
+
+        excluded = _excluded_group_resources(
+            list(resources), cluster_infra_backup_excluded_resources(self.infra_config)
+        )
+        results: dict[str, dict[str, int | bool]] = {}
+        self.metrics.clear("infra_backup_cluster_resource_objects")
+        for name, count in counts.items():
+            backed_up = name not in excluded
+            results[name] = {"objects": count, "backed-up": backed_up}
+            self.metrics.set(
+                "infra_backup_cluster_resource_objects",
+                count,
+                resource=name,
+                backed_up=str(backed_up).lower(),
+            )
+        event.set_results(
+            {
+                "resources": results,
+                "backed-up-objects": sum(
+                    count for name, count in counts.items() if name not in excluded
+                ),
+                "excluded-objects": sum(
+                    count for name, count in counts.items() if name in excluded
+                ),
+            }
         )
 
+    def _state(self, key: str) -> MutableMapping[str, Any]:
+        """Get a mapping of the stored state, or a copy of it during a dry run."""
+        if self._scratch_state is None:
+            return getattr(self._stored, key)
+        return self._scratch_state.setdefault(key, to_plain(getattr(self._stored, key)))
+
+    @contextlib.contextmanager
+    def _dry_run(self) -> Iterator[None]:
+        """Run the reconcile on copies of the stored state and metrics, restored on exit."""
+        attributes = {
+            name: getattr(self, name)
+            for name in [
+                "metrics",
+                "setup_failure",
+                "budget_status",
+                "cluster_namespaces",
+                "exclude_namespaces",
+                "selected_namespaces",
+            ]
+        }
+        self._scratch_state = {}
+        self.metrics = CharmMetrics(to_plain(self._stored.metrics))
+        try:
+            yield
+        finally:
+            self._scratch_state = None
+            for name, value in attributes.items():
+                setattr(self, name, value)
+
+    def _on_profile_reconcile(self, event: ops.ActionEvent) -> None:
+        """Profile the work done on every hook: list the namespaces and render the specs.
+
+        The action is read-only: the reconcile runs on copies of the stored state, and the
+        specs are compared with the relation data instead of being sent.
+        """
+        if not self.infra_config:
+            event.fail("Invalid charm config")
+            return
+
+        def reconcile() -> None:
+            self._list_cluster_namespaces()
+            specs = dict(self._cluster_infra_backup_specs() or {})
+            namespaced_specs = self._namespaced_infra_backup_specs()
+            if namespaced_specs:
+                specs[NAMESPACED_INFRA_BACKUP], specs[VOLATILE_INFRA_BACKUP] = namespaced_specs
+            for endpoint, spec in specs.items():
+                spec_json = spec.model_dump_json()
+                for relation in self.model.relations[endpoint]:
+                    if relation.data[self.app].get("spec") != spec_json:
+                        logger.info("The spec published on %s would be updated", endpoint)
+
+        with self._dry_run():
+            stats = profile(reconcile)
+        results: dict[str, Any] = {}
+        pstats_file = event.params.get("pstats-file")
+        if pstats_file:
+            try:
+                stats.dump_stats(pstats_file)
+            except OSError as e:
+                event.fail(f"Failed to save the profile: {e}")
+                return
+            results["pstats-file"] = pstats_file
+        results["k8s-api-calls"] = call_stats(stats, K8S_API_CALL).as_results()
+        results["hook-tool-calls"] = call_stats(stats, HOOK_TOOL_CALL).as_results()
+        results["hot-functions"] = hot_functions(stats, event.params.get("top", 20))
+        event.set_results(results)
+
+    def _share_leader_snapshot(self, _: ops.EventBase) -> None:
+        """Share the cluster state and the published specs with the peers.
+
+        The snapshot is only written when the state changed, or to keep it fresh, since every
+        write triggers a relation-changed hook on the peers.
+        """
+        relation = self.model.get_relation(PEERS)
+        if not relation or not self.unit.is_leader():
+            return
+        if not self.infra_config or not self.cluster_infra_backup:
+            return
+
+        now = time.time()
+        snapshot = LeaderSnapshot(
+            taken_at=self.leader_snapshot.taken_at if self.leader_snapshot else now,
+            resource_version=(
+                self.leader_snapshot.resource_version
+                if self.leader_snapshot
+                else self.k8s_utils.namespaces_resource_version
+            ),
+            config_digest=_config_digest(self.infra_config),
+            selected_namespaces=self.selected_namespaces,
+            excluded_namespaces=self.exclude_namespaces,
+            spec_digests={
+                endpoint: digest(provider.spec_json)
+                for endpoint, provider in self._providers().items()
+            },
+            namespace_selection=to_plain(self._stored.namespace_selection),
+            namespace_objects=to_plain(self._stored.namespace_objects),
+        )
+        previous = self._read_leader_snapshot()
+        if previous and (
+            snapshot == previous
+            or (
+                snapshot.same_state(previous)
+                and previous.is_fresh(now, LEADER_SNAPSHOT_MAX_AGE // 2)
+            )
+        ):
+            return
+        relation.data[self.app]["snapshot"] = snapshot.to_json()
+
+    def _export_metrics(self, _: ops.EventBase) -> None:
+        """Record the metrics of the hook and write them to the metrics textfile."""
+        for endpoint, provider in self._providers().items():
+            self.metrics.set("infra_backup_spec_bytes", len(provider.spec_json), endpoint=endpoint)
+            for result, writes in [
+                ("written", provider.writes_performed),
+                ("skipped", provider.writes_skipped),
+            ]:
+                self.metrics.inc(
+                    "infra_backup_relation_writes_total", writes, endpoint=endpoint, result=result
+                )
+
+        self.metrics.observe(
+            "infra_backup_hook_duration_seconds",
+            time.monotonic() - self._dispatch_start,
+            event=_dispatched_hook(),
+        )
+        if self.infra_config and self.infra_config.metrics_textfile:
+            self.metrics.write(Path(self.infra_config.metrics_textfile))
+
+    def _providers(self) -> dict[str, VeleroBackupProvider]:
+        """Get the providers of the specs set up in this hook, indexed by endpoint."""
+        providers = {
+            CLUSTER_INFRA_BACKUP: self.cluster_infra_backup,
+            NAMESPACED_INFRA_BACKUP: self.namespaced_infra_backup,
+            VOLATILE_INFRA_BACKUP: self.volatile_infra_backup,
+            **self.ttl_tier_backups,
+        }
+        return {endpoint: provider for endpoint, provider in providers.items() if provider}
+
+    def _related_ttl_tiers(self) -> list[str]:
+        """Get the endpoints of the TTL tiers that are related."""
+        return [endpoint for endpoint in TTL_TIER_ENDPOINTS if self._relation_exist(endpoint)]
+
     def _relation_exist(self, relation: str) -> bool:
         """Check if a relation exists."""
         return bool(self.model.relations.get(relation))
@@ -0,0 +1,237 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Deduplication of the Secrets and ConfigMaps replicated across namespaces.
+
+Tools such as reflector, kubernetes-replicator or trust-manager copy the same CA bundle or TLS
+secret into many namespaces, and every copy is part of namespaced-infra-backup. Only the objects
+marked by a replicator are replicas, an object with the same content as another one is not:
+
+* the copies made by reflector and kubernetes-replicator name their source in an annotation.
+  They are replicas when their source has the same content and is backed up, and the charm
+  labels them with REPLICA_LABEL.
+* the targets of trust-manager are labelled with their Bundle, which is backed up with the
+  cluster-scoped resources.
+
+The objects with these labels are left out through the exclude_labels of the charm specs only,
+so the backups of other applications are not affected. The replicators recreate the copies
+after a restore.
+"""
+
+import hashlib
+import json
+import logging
+from collections.abc import Collection, Iterable
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from lightkube.core.resource import NamespacedResource
+
+from k8s_utils import K8sUtils
+
+logger = logging.getLogger(__name__)
+
+REPLICA_LABEL = "infra-backup-operator.charm.canonical.com/replica"
+REPLICA_ANNOTATION = "infra-backup-operator.charm.canonical.com/replica-of"
+TRUST_MANAGER_LABEL = "trust.cert-manager.io/bundle"
+# Labels of the replicas, left out of the charm specs
+EXCLUDE_LABELS = [REPLICA_LABEL, TRUST_MANAGER_LABEL]
+# Annotations naming the "namespace/name" source of a copy
+SOURCE_ANNOTATIONS = (
+    "reflector.v1.k8s.emberstack.com/reflected-from",
+    "replicator.v1.mittwald.de/replicate-from",
+)
+# Secrets bound to a single consumer, which are never replicas
+SKIPPED_SECRET_TYPES = {"kubernetes.io/service-account-token", "helm.sh/release.v1"}
+
+
+@dataclass(frozen=True)
+class ObjectRef:
+    """The metadata kept for every marked object while streaming, instead of its data."""
+
+    namespace: str
+    name: str
+    size: int
+    source: Optional[str]
+    replica_of: Optional[str]
+    labelled: bool = False
+
+    @property
+    def key(self) -> str:
+        """Reference of the object, e.g. "namespace/name"."""
+        return f"{self.namespace}/{self.name}"
+
+
+@dataclass
+class DeduplicationReport:
+    """Result of the deduplication of a resource."""
+
+    replicas: int = 0
+    bytes_saved: int = 0
+    excluded: int = 0
+    restored: int = 0
+
+
+def content_hash(obj: Any) -> Optional[tuple[str, int]]:
+    """Hash the content of a Secret or ConfigMap.
+
+    Args:
+        obj (Any): The Secret or ConfigMap.
+
+    Returns:
+        Optional[tuple[str, int]]: The content hash and size in bytes, None for the objects that
+            are not deduplicated, e.g. empty ones.
+    """
+    if getattr(obj, "type", None) in SKIPPED_SECRET_TYPES:
+        return None
+    content = {
+        "type": getattr(obj, "type", None),
+        "data": obj.data or {},
+        "binaryData": getattr(obj, "binaryData", None) or {},
+    }
+    if not content["data"] and not content["binaryData"]:
+        return None
+    encoded = json.dumps(content, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest(), len(encoded)
+
+
+def replica_source(obj: Any) -> Optional[str]:
+    """Find the source named by the replicator of a copy.
+
+    Args:
+        obj (Any): The Secret or ConfigMap.
+
+    Returns:
+        Optional[str]: The "namespace/name" source, None if no replicator marked the object.
+    """
+    annotations = obj.metadata.annotations or {}
+    for annotation in SOURCE_ANNOTATIONS:
+        source = annotations.get(annotation, "").strip()
+        if source.count("/") == 1:
+            return source
+    return None
+
+
+def find_replicas(
+    objects: Iterable[Any], excluded_namespaces: Collection[str] = ()
+) -> tuple[dict[str, ObjectRef], list[ObjectRef], list[ObjectRef]]:
+    """Find the objects that are copies of another one.
+
+    Only a short hash of every object and the metadata of the marked ones are kept, so the
+    objects can be streamed from a paginated list.
+
+    Args:
+        objects (Iterable[Any]): The Secrets or ConfigMaps of every namespace.
+        excluded_namespaces (Collection[str]): Namespaces left out of the backups, whose
+            objects cannot be the source of a replica.
+
+    Returns:
+        tuple[dict[str, ObjectRef], list[ObjectRef], list[ObjectRef]]: The replicas to label
+            indexed by their reference, the objects already labelled by the charm, and the
+            trust-manager targets.
+    """
+    hashes: dict[str, bytes] = {}
+    marked, labelled, bundle_targets = [], [], []
+    for obj in objects:
+        metadata = obj.metadata
+        if not metadata or not metadata.name or not metadata.namespace:
+            continue
+        labels = metadata.labels or {}
+        annotations = metadata.annotations or {}
+        hashed = content_hash(obj)
+        ref = ObjectRef(
+            namespace=metadata.namespace,
+            name=metadata.name,
+            size=hashed[1] if hashed else 0,
+            source=replica_source(obj),
+            replica_of=annotations.get(REPLICA_ANNOTATION),
+            labelled=labels.get(REPLICA_LABEL) == "true",
+        )
+        if ref.replica_of:
+            labelled.append(ref)
+        if TRUST_MANAGER_LABEL in labels:
+            # left out by the label of its Bundle
+            bundle_targets.append(ref)
+            continue
+        if hashed:
+            hashes[ref.key] = bytes.fromhex(hashed[0])[:16]
+        if ref.source and hashed:
+            marked.append(ref)
+
+    replicas = {
+        ref.key: ref
+        for ref in marked
+        if ref.source
+        and ref.source.split("/", 1)[0] not in excluded_namespaces
+        and hashes.get(ref.source) == hashes[ref.key]
+    }
+    return replicas, labelled, bundle_targets
+
+
+class Deduplicator:
+    """Label the replicated objects so the charm specs only back up their source."""
+
+    def __init__(self, k8s_utils: K8sUtils) -> None:
+        self.k8s_utils = k8s_utils
+
+    def deduplicate(
+        self, resource: type[NamespacedResource], excluded_namespaces: Collection[str] = ()
+    ) -> DeduplicationReport:
+        """Exclude the replicas of a resource from the charm backups.
+
+        Args:
+            resource (type[NamespacedResource]): Secret or ConfigMap.
+            excluded_namespaces (Collection[str]): Namespaces left out of the backups.
+
+        Returns:
+            DeduplicationReport: The replicas found and the labels changed.
+        """
+        replicas, labelled, bundle_targets = find_replicas(
+            self.k8s_utils.iter_all_objects(resource), excluded_namespaces
+        )
+        left_out = list(replicas.values()) + bundle_targets
+        report = DeduplicationReport(
+            replicas=len(left_out), bytes_saved=sum(ref.size for ref in left_out)
+        )
+        for ref in labelled:
+            if ref.key not in replicas:
+                # no longer a copy, e.g. its content changed or its source was deleted
+                self._unlabel(resource, ref)
+                report.restored += 1
+        up_to_date = {ref.key for ref in labelled if ref.labelled}
+        for key, replica in replicas.items():
+            if key in up_to_date and replica.replica_of == replica.source:
+                continue
+            self.k8s_utils.patch_metadata(
+                resource,
+                replica.name,
+                replica.namespace,
+                labels={REPLICA_LABEL: "true"},
+                annotations={REPLICA_ANNOTATION: replica.source},
+            )
+            report.excluded += 1
+        return report
+
+    def restore(self, resource: type[NamespacedResource]) -> int:
+        """Remove the labels set by the charm, so every object is backed up again.
+
+        Args:
+            resource (type[NamespacedResource]): Secret or ConfigMap.
+
+        Returns:
+            int: The number of objects backed up again.
+        """
+        _, labelled, _ = find_replicas(self.k8s_utils.iter_all_objects(resource))
+        for ref in labelled:
+            self._unlabel(resource, ref)
+        return len(labelled)
+
+    def _unlabel(self, resource: type[NamespacedResource], ref: ObjectRef) -> None:
+        """Remove the labels and annotation set by the charm from an object."""
+        self.k8s_utils.patch_metadata(
+            resource,
+            ref.name,
+            ref.namespace,
+            labels={REPLICA_LABEL: None},
+            annotations={REPLICA_ANNOTATION: None},
+        )
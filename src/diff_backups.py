@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Compare two Velero backups of the same spec to measure how much state changes between them.
+
+Both tarballs are streamed at once, without being extracted. Every object is reduced to a
+digest of its content, without the metadata that changes on every write or when an object is
+recreated as is (uid, resourceVersion, generation, creationTimestamp, managedFields and the
+last-applied-configuration of kubectl) and without its status. The digest is matched against the
+object with the same name in the other backup as soon as both were read. Velero writes the
+objects of a backup in the same order on every run, so only the objects added, removed or
+read out of order are held, as a few dozen bytes each::
+
+    PYTHONPATH=lib:src python3 src/diff_backups.py old.tar.gz new.tar.gz
+
+The changes are reported by kind and by namespace.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import tarfile
+from collections import defaultdict
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass, field
+from itertools import zip_longest
+from typing import IO, Optional
+
+from verify_backup import CLUSTER_SCOPE, iter_backup_items
+
+# Metadata updated by the apiserver on every write, or set anew when an object is deleted and
+# created again with the same content, e.g. by a redeployment
+VOLATILE_METADATA = ("uid", "resourceVersion", "generation", "creationTimestamp", "managedFields")
+# Annotations that copy the object content, changed along with it
+VOLATILE_ANNOTATIONS = ("kubectl.kubernetes.io/last-applied-configuration",)
+# Size of the object digests, collisions are negligible for a few million objects
+DIGEST_SIZE = 8
+KEY_SIZE = 16
+
+
+@dataclass
+class Changes:
+    """Number of objects of a breakdown entry by kind of change."""
+
+    added: int = 0
+    removed: int = 0
+    modified: int = 0
+    unchanged: int = 0
+
+    @property
+    def changed(self) -> int:
+        """Number of objects added, removed or modified."""
+        return self.added + self.removed + self.modified
+
+    def __iadd__(self, other: "Changes") -> "Changes":
+        """Add the changes of another entry."""
+        self.added += other.added
+        self.removed += other.removed
+        self.modified += other.modified
+        self.unchanged += other.unchanged
+        return self
+
+
+@dataclass
+class BackupDiff:
+    """Changes between two backups.
+
+    Args:
+        kinds (dict[str, Changes]): Changes by group resource.
+        namespaces (dict[str, Changes]): Changes by namespace, CLUSTER_SCOPE for cluster-scoped
+            objects.
+    """
+
+    kinds: dict[str, Changes] = field(default_factory=dict)
+    namespaces: dict[str, Changes] = field(default_factory=dict)
+
+    @property
+    def total(self) -> Changes:
+        """Changes of the whole backup."""
+        total = Changes()
+        for changes in self.kinds.values():
+            total += changes
+        return total
+
+
+def object_digest(content: bytes) -> bytes:
+    """Digest the content of an object, without its volatile metadata and status.
+
+    Args:
+        content (bytes): The object JSON.
+
+    Returns:
+        bytes: The digest.
+    """
+    obj = json.loads(content)
+    obj.pop("status", None)
+    metadata = obj.get("metadata") or {}
+    for key in VOLATILE_METADATA:
+        metadata.pop(key, None)
+    annotations = metadata.get("annotations") or {}
+    for key in VOLATILE_ANNOTATIONS:
+        annotations.pop(key, None)
+    if not annotations:
+        metadata.pop("annotations", None)
+    normalized = json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(normalized, digest_size=DIGEST_SIZE).digest()
+
+
+def _digested_objects(fileobj: IO[bytes]) -> Iterator[tuple[tuple[str, str], bytes, bytes]]:
+    """Stream the (resource, namespace), key digest and content digest of every object."""
+    for item, content in iter_backup_items(fileobj):
+        if item.versioned:
+            continue
+        key = f"{item.resource}/{item.namespace or ''}/{item.name}".encode()
+        yield (
+            (item.resource, item.namespace or CLUSTER_SCOPE),
+            hashlib.blake2b(key, digest_size=KEY_SIZE).digest(),
+            object_digest(content),
+        )
+
+
+def diff_backups(old: IO[bytes], new: IO[bytes]) -> BackupDiff:
+    """Stream two backup tarballs at once and count the changed objects.
+
+    Args:
+        old (IO[bytes]): The older tarball, gzip-compressed or not.
+        new (IO[bytes]): The newer tarball, gzip-compressed or not.
+
+    Returns:
+        BackupDiff: The changes by kind and namespace.
+    """
+    # (resource, namespace) of every group id, and the changes of every group
+    groups: dict[tuple[str, str], int] = {}
+    changes: defaultdict[int, Changes] = defaultdict(Changes)
+    # objects of each backup not found yet in the other one, as key digest -> group + digest
+    pending: tuple[dict[bytes, bytes], dict[bytes, bytes]] = ({}, {})
+
+    for entries in zip_longest(_digested_objects(old), _digested_objects(new)):
+        for side, entry in enumerate(entries):
+            if entry is None:
+                continue
+            group_key, key, digest = entry
+            group = groups.setdefault(group_key, len(groups))
+            value = group.to_bytes(4, "big") + digest
+
+            other = pending[1 - side].pop(key, None)
+            if other is None:
+                pending[side][key] = value
+            elif other == value:
+                changes[group].unchanged += 1
+            else:
+                changes[group].modified += 1
+
+    for value in pending[0].values():
+        changes[int.from_bytes(value[:4], "big")].removed += 1
+    for value in pending[1].values():
+        changes[int.from_bytes(value[:4], "big")].added += 1
+
+    diff = BackupDiff()
+    for (resource, namespace), group in groups.items():
+        for breakdown, name in ((diff.kinds, resource), (diff.namespaces, namespace)):
+            breakdown.setdefault(name, Changes())
+            breakdown[name] += changes[group]
+    return diff
+
+
+def format_changes(title: str, breakdown: dict[str, Changes]) -> str:
+    """Format a breakdown as a table, most changed entries first.
+
+    Args:
+        title (str): The header of the first column.
+        breakdown (dict[str, Changes]): The changes by entry.
+
+    Returns:
+        str: The table.
+    """
+    rows = sorted(breakdown.items(), key=lambda entry: (-entry[1].changed, entry[0]))
+    width = max([len(title)] + [len(key) for key in breakdown])
+    columns = ("ADDED", "REMOVED", "MODIFIED", "UNCHANGED", "CHANGED")
+    lines = [f"{title:<{width}}" + "".join(f"  {column:>10}" for column in columns)]
+    for key, changes in rows:
+        total = changes.changed + changes.unchanged
+        rate = changes.changed / total if total else 0.0
+        counts = (changes.added, changes.removed, changes.modified, changes.unchanged)
+        lines.append(
+            f"{key:<{width}}" + "".join(f"  {count:>10}" for count in counts) + f"  {rate:>10.1%}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Entry point of the comparison.
+
+    Args:
+        argv (Optional[list[str]]): Command line arguments, defaults to sys.argv.
+
+    Returns:
+        int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old", help="older Velero backup tarball")
+    parser.add_argument("new", help="newer Velero backup tarball")
+    parser.add_argument("--json", action="store_true", help="print the changes as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.old, "rb") as old, open(args.new, "rb") as new:
+            diff = diff_backups(old, new)
+    except (OSError, EOFError, tarfile.TarError, ValueError) as e:
+        print(f"Failed to read the backups: {e}", file=sys.stderr)
+        return 2
+
+    if args.json:
+        print(json.dumps(asdict(diff), indent=2))
+    else:
+        total = diff.total
+        print(
+            f"{total.added} added, {total.removed} removed, {total.modified} modified, "
+            f"{total.unchanged} unchanged objects\n\n"
+            f"{format_changes('KIND', diff.kinds)}\n\n"
+            f"{format_changes('NAMESPACE', diff.namespaces)}"
+        )
+    return 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""API Priority and Fairness objects bounding the load of the backups on the apiserver.
+
+Velero lists every resource of the cluster at backup time, and the charm lists namespaces and
+objects on its hooks. A FlowSchema puts the requests of these service accounts into a
+PriorityLevelConfiguration of their own, whose concurrency is bounded and cannot borrow from the
+other priority levels, so the workloads keep their share of the apiserver.
+"""
+
+from lightkube.models.flowcontrol_v1 import (
+    FlowDistinguisherMethod,
+    FlowSchemaSpec,
+    LimitedPriorityLevelConfiguration,
+    LimitResponse,
+    PolicyRulesWithSubjects,
+    PriorityLevelConfigurationReference,
+    PriorityLevelConfigurationSpec,
+    QueuingConfiguration,
+    ResourcePolicyRule,
+    ServiceAccountSubject,
+    Subject,
+)
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.flowcontrol_apiserver_v1 import FlowSchema, PriorityLevelConfiguration
+
+# Served from Kubernetes 1.29, the older clusters only have the beta versions
+API_GROUP_VERSION = "flowcontrol.apiserver.k8s.io/v1"
+# Flow schemas are matched by increasing precedence. The built-in "kube-system-service-accounts"
+# (900) would match the backup requests first when the charm or Velero run in kube-system, and
+# "service-accounts" (9000) in any other namespace. The built-in schemas below 900 only match the
+# system components, e.g. the nodes, the controller manager and the scheduler.
+MATCHING_PRECEDENCE = 850
+# Queuing defaults of the apiserver, requests beyond them are rejected with 429 and retried
+QUEUES = 64
+HAND_SIZE = 6
+QUEUE_LENGTH_LIMIT = 50
+
+
+def flow_control_name(app: str, model: str) -> str:
+    """Name of the cluster-scoped objects of an application, unique across Juju models."""
+    return f"{model}-{app}-infra-backup"
+
+
+def priority_level(name: str, concurrency_shares: int) -> PriorityLevelConfiguration:
+    """Build the priority level of the backup requests.
+
+    Args:
+        name (str): The object name.
+        concurrency_shares (int): The nominal concurrency shares of the priority level.
+
+    Returns:
+        PriorityLevelConfiguration: A Limited priority level that does not borrow concurrency.
+    """
+    return PriorityLevelConfiguration(
+        metadata=ObjectMeta(name=name),
+        spec=PriorityLevelConfigurationSpec(
+            type="Limited",
+            limited=LimitedPriorityLevelConfiguration(
+                nominalConcurrencyShares=concurrency_shares,
+                borrowingLimitPercent=0,
+                limitResponse=LimitResponse(
+                    type="Queue",
+                    queuing=QueuingConfiguration(
+                        queues=QUEUES, handSize=HAND_SIZE, queueLengthLimit=QUEUE_LENGTH_LIMIT
+                    ),
+                ),
+            ),
+        ),
+    )
+
+
+def flow_schema(name: str, service_accounts: list[tuple[str, str]]) -> FlowSchema:
+    """Build the flow schema matching every request of the backup service accounts.
+
+    Args:
+        name (str): The object name, also the name of the priority level.
+        service_accounts (list[tuple[str, str]]): The namespace and name of every service account.
+
+    Returns:
+        FlowSchema: The flow schema.
+    """
+    return FlowSchema(
+        metadata=ObjectMeta(name=name),
+        spec=FlowSchemaSpec(
+            priorityLevelConfiguration=PriorityLevelConfigurationReference(name=name),
+            matchingPrecedence=MATCHING_PRECEDENCE,
+            distinguisherMethod=FlowDistinguisherMethod(type="ByUser"),
+            rules=[
+                PolicyRulesWithSubjects(
+                    subjects=[
+                        Subject(
+                            kind="ServiceAccount",
+                            serviceAccount=ServiceAccountSubject(namespace=namespace, name=sa),
+                        )
+                        for namespace, sa in service_accounts
+                    ],
+                    resourceRules=[
+                        ResourcePolicyRule(
+                            apiGroups=["*"],
+                            resources=["*"],
+                            verbs=["*"],
+                            clusterScope=True,
+                            namespaces=["*"],
+                        )
+                    ],
+                )
+            ],
+        ),
+    )
@@ -4,23 +4,85 @@
 """Utility functions for Backup Infra."""
 
 import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import cached_property
+from typing import Any, Iterator, Optional, Union
 
 import httpx
 from lightkube import ApiError, Client
-from lightkube.resources.core_v1 import Namespace
+from lightkube.config import client_adapter
+from lightkube.core.exceptions import LoadResourceError
+from lightkube.core.resource import GlobalResource, NamespacedResource, api_info
+from lightkube.core.resource_registry import resource_registry
+from lightkube.generic_resource import create_global_resource, create_namespaced_resource
+from lightkube.resources.apiextensions_v1 import CustomResourceDefinition
+from lightkube.resources.apps_v1 import DaemonSet, Deployment, StatefulSet
+from lightkube.resources.core_v1 import Namespace, PersistentVolumeClaim, Service
+from lightkube.resources.policy_v1 import PodDisruptionBudget
 
 logger = logging.getLogger(__name__)
 
+# Built-in namespaced resources that tell if a namespace has content worth backing up. Objects
+# owned by them (e.g. ReplicaSets, Endpoints) or ephemeral (e.g. Pods, Events) are left out.
+NAMESPACED_RESOURCES: list[type[NamespacedResource]] = [
+    DaemonSet,
+    Deployment,
+    PersistentVolumeClaim,
+    PodDisruptionBudget,
+    Service,
+    StatefulSet,
+]
+# Objects per page when counting, to keep the memory bounded on large clusters
+LIST_CHUNK_SIZE = 500
+# Timeout of the API discovery requests
+DISCOVERY_TIMEOUT = httpx.Timeout(10)
+# Lists the objects with their metadata only, falling back to full objects for the APIs serving
+# JSON only, e.g. some aggregated APIs
+PARTIAL_METADATA_LIST = (
+    "application/json;as=PartialObjectMetadataList;v=v1;g=meta.k8s.io,application/json"
+)
+
 
 class K8sUtilsError(Exception):
     """Custom exception for K8sUtils errors."""
 
 
+def _get_discovery(client: httpx.Client, path: str) -> dict[str, Any]:
+    """Get a discovery document of the apiserver, e.g. "/apis".
+
+    lightkube has no discovery API, so the document is read with an HTTP client built from the
+    same config as the lightkube client.
+    """
+    try:
+        response = client.get(path)
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        raise K8sUtilsError(f"Failed to discover {path}") from e
+
+
+@dataclass(frozen=True)
+class NamespaceInfo:
+    """Namespace information used to select the namespaces to backup."""
+
+    name: str
+    created: datetime
+    labels: dict[str, str] = field(default_factory=dict, compare=False, hash=False)
+
+
 class K8sUtils:
     """K8s utils information using lightkube."""
 
     def __init__(self, field_manage: str) -> None:
         self.client = Client(field_manager=field_manage)
+        # resourceVersion of the last namespace list
+        self.namespaces_resource_version = ""
+
+    @cached_property
+    def _http_client(self) -> httpx.Client:
+        """HTTP client sharing the config of the lightkube client, for the raw list requests."""
+        return client_adapter.Client(self.client.config, DISCOVERY_TIMEOUT)
 
     def get_namespaces(self) -> set[str]:
         """Get the namespaces available in the K8s cluster.
@@ -28,7 +90,277 @@ class K8sUtils:
         Returns:
             set[str]: Set of strings with the namespaces names.
         """
+        return {namespace.name for namespace in self.list_namespaces()}
+
+    def list_namespaces(self) -> list[NamespaceInfo]:
+        """List the namespaces available in the K8s cluster.
+
+        Returns:
+            list[NamespaceInfo]: The namespaces with their creation time and labels.
+        """
         try:
-            return {namespace.metadata.name for namespace in self.client.list(Namespace)}
+            namespaces = self.client.list(Namespace)
+            infos = [
+                NamespaceInfo(
+                    name=namespace.metadata.name,
+                    created=namespace.metadata.creationTimestamp or datetime.now(timezone.utc),
+                    labels=namespace.metadata.labels or {},
+                )
+                for namespace in namespaces
+                if namespace.metadata and namespace.metadata.name
+            ]
         except (ApiError, httpx.HTTPError) as e:
             raise K8sUtilsError("Failed to list namespaces") from e
+        self.namespaces_resource_version = namespaces.resourceVersion
+        return infos
+
+    def get_cluster_scoped_resources(self) -> dict[str, type[GlobalResource]]:
+        """Discover the cluster-scoped resources served by the apiserver.
+
+        Every API group is discovered at its preferred version, including the custom resources
+        and the aggregated APIs, e.g. APIServices or FlowSchemas. The resources that cannot be
+        listed and the subresources are left out. A group whose discovery fails, e.g. an
+        unavailable aggregated API, is skipped as Velero does.
+
+        Returns:
+            dict[str, type[GlobalResource]]: The resources indexed by their group resource, e.g.
+                "clusterroles.rbac.authorization.k8s.io" or "nodes" for the core group, in
+                discovery order.
+        """
+        resources: dict[str, type[GlobalResource]] = {}
+        for group, version, kind, plural in self._discover_resources(namespaced=False):
+            api_version = f"{group}/{version}" if group else version
+            try:
+                resource = resource_registry.load(api_version, kind)
+            except LoadResourceError:
+                resource = None
+            if resource is None or not issubclass(resource, GlobalResource):
+                resource = create_global_resource(group, version, kind, plural)
+            resources[f"{plural}.{group}" if group else plural] = resource
+        return resources
+
+    def _discover_resources(self, namespaced: bool) -> list[tuple[str, str, str, str]]:
+        """Discover the listable resources of a scope in every API group.
+
+        Args:
+            namespaced (bool): Whether to discover the namespaced or the cluster-scoped ones.
+
+        Returns:
+            list[tuple[str, str, str, str]]: The group, preferred version, kind and plural name
+                of every resource.
+        """
+        discovered = []
+        with client_adapter.Client(self.client.config, DISCOVERY_TIMEOUT) as client:
+            groups = _get_discovery(client, "/apis").get("groups") or []
+            paths = ["/api/v1"] + [
+                f"/apis/{group['preferredVersion']['groupVersion']}" for group in groups
+            ]
+            for path in paths:
+                try:
+                    resource_list = _get_discovery(client, path)
+                except K8sUtilsError as e:
+                    logger.warning("Skipping an API group: %s", e)
+                    continue
+                group, _, version = resource_list["groupVersion"].rpartition("/")
+                for resource in resource_list.get("resources") or []:
+                    if (
+                        "/" not in resource["name"]
+                        and resource.get("namespaced") == namespaced
+                        and "list" in resource.get("verbs", [])
+                    ):
+                        discovered.append((group, version, resource["kind"], resource["name"]))
+        return discovered
+
+    def get_namespaced_resources(self) -> dict[str, type[NamespacedResource]]:
+        """Discover the namespaced resources that hold content, including the custom ones.
+
+        Returns:
+            dict[str, type[NamespacedResource]]: The resources indexed by their plural name.
+        """
+        resources = {api_info(res).plural: res for res in NAMESPACED_RESOURCES}
+        for group, version, kind, plural in self._list_custom_resources("Namespaced"):
+            resources[plural] = create_namespaced_resource(group, version, kind, plural)
+        return resources
+
+    def _list_custom_resources(self, scope: str) -> list[tuple[str, str, str, str]]:
+        """List the custom resources of a scope.
+
+        Args:
+            scope (str): "Cluster" or "Namespaced".
+
+        Returns:
+            list[tuple[str, str, str, str]]: The group, storage version, kind and plural name of
+                every custom resource.
+        """
+        custom_resources = []
+        try:
+            for crd in self.client.list(CustomResourceDefinition, chunk_size=LIST_CHUNK_SIZE):
+                if crd.spec.scope != scope:
+                    continue
+                version = next((v.name for v in crd.spec.versions if v.storage), None)
+                if version:
+                    custom_resources.append(
+                        (crd.spec.group, version, crd.spec.names.kind, crd.spec.names.plural)
+                    )
+        except (ApiError, httpx.HTTPError) as e:
+            raise K8sUtilsError("Failed to list the custom resource definitions") from e
+        return custom_resources
+
+    def count_objects(
+        self,
+        resource: Union[type[GlobalResource], type[NamespacedResource]],
+        namespace: Optional[str] = None,
+    ) -> int:
+        """Count the objects of a resource.
+
+        A single object is listed, with its metadata only, and the others are counted from the
+        remainingItemCount of the list. lightkube does not expose the metadata of a list page,
+        so the request is made with the raw HTTP client. If the apiserver does not tell the
+        remaining count, the objects are listed in chunks, so only a page of objects is in
+        memory at once.
+
+        Args:
+            resource (Union[type[GlobalResource], type[NamespacedResource]]): The resource.
+            namespace (Optional[str]): The namespace of a namespaced resource.
+
+        Returns:
+            int: The number of objects.
+        """
+        info = api_info(resource)
+        group, version = info.resource.group, info.resource.version
+        path = f"/apis/{group}/{version}" if group else f"/api/{version}"
+        if namespace:
+            path += f"/namespaces/{namespace}"
+        try:
+            response = self._http_client.get(
+                f"{path}/{info.plural}",
+                params={"limit": 1},
+                headers={"Accept": PARTIAL_METADATA_LIST},
+            )
+            response.raise_for_status()
+            page = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise K8sUtilsError(f"Failed to list {info.plural}") from e
+        metadata = page.get("metadata") or {}
+        listed = len(page.get("items") or [])
+        if not metadata.get("continue"):
+            return listed
+        if metadata.get("remainingItemCount") is not None:
+            return listed + int(metadata["remainingItemCount"])
+
+        kwargs: dict[str, Any] = {"chunk_size": LIST_CHUNK_SIZE}
+        if namespace:
+            kwargs["namespace"] = namespace
+        try:
+            return sum(1 for _ in self.client.list(resource, **kwargs))
+        except (ApiError, httpx.HTTPError) as e:
+            raise K8sUtilsError(f"Failed to list {api_info(resource).plural}") from e
+
+    def iter_all_objects(self, resource: type[NamespacedResource]) -> Iterator[Any]:
+        """Stream the objects of a namespaced resource in every namespace.
+
+        The objects are listed in chunks, so only a page of objects is in memory at once.
+
+        Args:
+            resource (type[NamespacedResource]): The resource.
+
+        Yields:
+            Any: The objects of the resource.
+        """
+        try:
+            yield from self.client.list(resource, namespace="*", chunk_size=LIST_CHUNK_SIZE)
+        except (ApiError, httpx.HTTPError) as e:
+            raise K8sUtilsError(f"Failed to list {api_info(resource).plural}") from e
+
+    def patch_metadata(
+        self,
+        resource: type[NamespacedResource],
+        name: str,
+        namespace: str,
+        labels: dict[str, Optional[str]],
+        annotations: dict[str, Optional[str]],
+    ) -> None:
+        """Set or remove labels and annotations of an object.
+
+        Args:
+            resource (type[NamespacedResource]): The resource of the object.
+            name (str): The object name.
+            namespace (str): The object namespace.
+            labels (dict[str, Optional[str]]): The labels to set, None removes a label.
+            annotations (dict[str, Optional[str]]): The annotations to set, None removes one.
+        """
+        patch = {"metadata": {"labels": labels, "annotations": annotations}}
+        try:
+            self.client.patch(resource, name, patch, namespace=namespace)
+        except (ApiError, httpx.HTTPError) as e:
+            raise K8sUtilsError(
+                f"Failed to patch {api_info(resource).plural} {namespace}/{name}"
+            ) from e
+
+    def apply(self, obj: Any) -> None:
+        """Create or update an object with server-side apply, as the charm field manager.
+
+        Args:
+            obj (Any): The object to apply, e.g. a FlowSchema.
+        """
+        try:
+            self.client.apply(obj, force=True)
+        except (ApiError, httpx.HTTPError) as e:
+            raise K8sUtilsError(
+                f"Failed to apply {api_info(type(obj)).plural} {obj.metadata.name}"
+            ) from e
+
+    def has_api(self, group_version: str) -> bool:
+        """Check if the apiserver serves an API group version.
+
+        Args:
+            group_version (str): The group version, e.g. "flowcontrol.apiserver.k8s.io/v1".
+
+        Returns:
+            bool: False if the group version is unknown, e.g. added by a later Kubernetes.
+        """
+        path = f"/apis/{group_version}"
+        with client_adapter.Client(self.client.config, DISCOVERY_TIMEOUT) as client:
+            try:
+                response = client.get(path)
+                if response.status_code == 404:
+                    return False
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                raise K8sUtilsError(f"Failed to discover {path}") from e
+        return True
+
+    def exists(self, resource: type[GlobalResource], name: str) -> bool:
+        """Check if a cluster-scoped object exists.
+
+        The object does not exist either when the apiserver does not serve its resource, which
+        is answered with a 404 that is not a Status.
+
+        Args:
+            resource (type[GlobalResource]): The resource of the object.
+            name (str): The object name.
+        """
+        try:
+            self.client.get(resource, name)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return False
+            raise K8sUtilsError(f"Failed to get {api_info(resource).plural} {name}") from e
+        except httpx.HTTPError as e:
+            raise K8sUtilsError(f"Failed to get {api_info(resource).plural} {name}") from e
+        return True
+
+    def delete(self, resource: type[GlobalResource], name: str) -> None:
+        """Delete a cluster-scoped object if it exists.
+
+        Args:
+            resource (type[GlobalResource]): The resource of the object.
+            name (str): The object name.
+        """
+        try:
+            self.client.delete(resource, name)
+        except ApiError as e:
+            if e.status.code != 404:
+                raise K8sUtilsError(f"Failed to delete {api_info(resource).plural} {name}") from e
+        except httpx.HTTPError as e:
+            raise K8sUtilsError(f"Failed to delete {api_info(resource).plural} {name}") from e
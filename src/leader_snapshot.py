@@ -0,0 +1,99 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Snapshot of the cluster state shared by the leader with its peers.
+
+The leader keeps the namespace selection and counts in its StoredState, which is local to the
+unit. The snapshot is kept in the peer relation, so a new leader starts from the state of the
+previous one instead of listing the cluster again and publishing specs that did not change.
+"""
+
+import hashlib
+import json
+from collections.abc import Mapping, Sequence
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+
+
+def digest(content: str) -> str:
+    """Compact digest of a published backup spec or of the charm config."""
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+def to_plain(value: Any) -> Any:
+    """Convert the mappings and lists of a StoredState value to JSON-serializable types."""
+    if isinstance(value, Mapping):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, Sequence) and not isinstance(value, str):
+        return [to_plain(item) for item in value]
+    return value
+
+
+@dataclass(frozen=True, kw_only=True)
+class LeaderSnapshot:
+    """Cluster state read by the leader and the specs it published from it."""
+
+    taken_at: float
+    """When the namespaces were listed, as a UNIX timestamp."""
+
+    resource_version: str
+    """The resourceVersion of the namespace list."""
+
+    config_digest: str
+    """The digest of the charm config the namespaces were selected with."""
+
+    selected_namespaces: list[str]
+    """The namespaces published in cluster-infra-backup."""
+
+    excluded_namespaces: Optional[list[str]]
+    """The namespaces excluded from the all-namespaces specs."""
+
+    spec_digests: dict[str, str]
+    """The digest of the spec published on every endpoint."""
+
+    namespace_selection: dict[str, Any] = field(default_factory=dict)
+    """The state of the NamespaceSelector."""
+
+    namespace_objects: dict[str, Any] = field(default_factory=dict)
+    """The state of the NamespaceContentCache."""
+
+    def to_json(self) -> str:
+        """Serialize the snapshot for the peer relation databag."""
+        return json.dumps(asdict(self), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "LeaderSnapshot":
+        """Parse a snapshot of the peer relation databag.
+
+        Raises:
+            ValueError: If the snapshot is invalid, e.g. written by another charm revision.
+        """
+        try:
+            return cls(**json.loads(raw))
+        except TypeError as e:
+            raise ValueError(f"Invalid leader snapshot: {e}") from e
+
+    def is_fresh(self, now: float, max_age: int) -> bool:
+        """Whether the snapshot is recent enough to be trusted instead of listing the cluster."""
+        return 0 <= now - self.taken_at < max_age
+
+    def same_state(self, other: Optional["LeaderSnapshot"]) -> bool:
+        """Whether another snapshot holds the same state, whenever it was taken."""
+        if other is None:
+            return False
+        return self._stable_state() == other._stable_state()
+
+    def _stable_state(self) -> dict[str, Any]:
+        """Get the state without the timestamps that change on every hook.
+
+        The namespaces are counted again once their count is older than
+        namespace-content-cache, so the time they were checked at is left out. It is still
+        shared when the snapshot is refreshed.
+        """
+        state = asdict(self)
+        del state["taken_at"], state["resource_version"]
+        state["namespace_objects"] = {
+            namespace: {key: value for key, value in entry.items() if key != "checked_at"}
+            for namespace, entry in self.namespace_objects.items()
+        }
+        return state
@@ -4,9 +4,16 @@
 
 import re
 from dataclasses import dataclass
+from typing import Optional
 
+from charms.velero_libs.v0.velero_backup_config import DURATION_REGEX as VELERO_DURATION_REGEX
+
+PEERS = "infra-backup-peers"
 CLUSTER_INFRA_BACKUP = "cluster-infra-backup"
 NAMESPACED_INFRA_BACKUP = "namespaced-infra-backup"
+VOLATILE_INFRA_BACKUP = "volatile-infra-backup"
+# Endpoints of the namespace-ttl-tiers, in the order of the config
+TTL_TIER_ENDPOINTS = ["infra-backup-tier-1", "infra-backup-tier-2", "infra-backup-tier-3"]
 RESOURCES_BACKUP = [
     "roles",
     "rolebindings",
@@ -27,9 +34,72 @@ RESOURCES_BACKUP = [
     "verticalpodautoscalers",
     "ciliumnetworkpolicies",
 ]
+# High-churn resources that are split from RESOURCES_BACKUP into the volatile-infra-backup
+# endpoint when it is related, so they can be backed up with a different TTL and schedule.
+VOLATILE_RESOURCES_BACKUP = [
+    "configmaps",
+    "secrets",
+    "jobs",
+]
+STABLE_RESOURCES_BACKUP = [
+    resource for resource in RESOURCES_BACKUP if resource not in VOLATILE_RESOURCES_BACKUP
+]
+# Cluster-scoped resources left out of cluster-infra-backup by the "default" profile. They are
+# numerous on large clusters and are regenerated by their controllers.
+CLUSTER_RESOURCES_PROFILES = {
+    "default": [
+        "nodes",
+        "csinodes",
+        "volumeattachments",
+        "certificatesigningrequests",
+        "ciliumidentities",
+        "ciliumnodes",
+        "ciliumendpointslices",
+    ],
+    "all": [],
+}
+# Age until which a new leader trusts the snapshot of the previous one instead of listing the
+# namespaces. The leader refreshes an unchanged snapshot after half of it.
+LEADER_SNAPSHOT_MAX_AGE = 600
 
 
 NAMESPACE_REGEX = re.compile(r"^[a-z0-9]([-a-z0-9]*[a-z0-9])?$")
+NAMESPACE_GLOB_REGEX = re.compile(r"^[-a-z0-9*?\[\]!]+$")
+RESOURCE_REGEX = re.compile(r"^[a-z0-9]([-a-z0-9.]*[a-z0-9])?$")
+LABEL_SELECTOR_REGEX = re.compile(r"^([-a-zA-Z0-9_./]+)=([-a-zA-Z0-9_.]*)$")
+SERVICE_ACCOUNT_REGEX = re.compile(
+    r"^[a-z0-9]([-a-z0-9]*[a-z0-9])?/[a-z0-9]([-a-z0-9.]*[a-z0-9])?$"
+)
+DURATION_REGEX = re.compile(VELERO_DURATION_REGEX)
+SIZE_REGEX = re.compile(r"^([0-9]+)(Ki|Mi|Gi|Ti)?$")
+SIZE_UNITS = {"": 1, "Ki": 1 << 10, "Mi": 1 << 20, "Gi": 1 << 30, "Ti": 1 << 40}
+# Rough mean size of an object in a Velero backup, to estimate the backup size from object counts.
+# The objects are not read, so the estimated size is not their serialized size.
+ESTIMATED_OBJECT_BYTES = 4096
+BUDGET_ACTIONS = ("block", "cap")
+
+
+def parse_duration(duration: str) -> int:
+    """Convert a duration such as "1h30m" to seconds, an empty duration is 0."""
+    match = DURATION_REGEX.match(duration)
+    if not duration or not match:
+        return 0
+    hours, minutes, seconds = (int(value or 0) for value in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_size(size: str) -> int:
+    """Convert a size such as "2Gi" to bytes, an empty size is 0."""
+    match = SIZE_REGEX.match(size)
+    if not size or not match:
+        return 0
+    value, unit = match.groups()
+    return int(value) * SIZE_UNITS[unit or ""]
+
+
+def _split(values: str) -> list[str]:
+    """Split a comma-separated config option."""
+    return [value.strip() for value in values.split(",") if value.strip()]
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -39,8 +109,83 @@ class InfraBackupConfig:
     namespaces: str = "kube-system, kube-public, metallb-system"
     """Comma-separated list of namespaces from the charm config."""
 
+    cluster_infra_backup_ttl: str = ""
+    """TTL of the cluster-infra-backup backups. Empty uses the velero-operator default."""
+
+    namespace_ttl_tiers: str = ""
+    """Semicolon-separated groups of namespaces with the TTL of their tier, e.g. "a,b=72h"."""
+
+    namespaced_infra_backup_ttl: str = ""
+    """TTL of the namespaced-infra-backup backups. Empty uses the velero-operator default."""
+
+    volatile_infra_backup_ttl: str = ""
+    """TTL of the volatile-infra-backup backups. Empty uses the velero-operator default."""
+
+    namespace_min_age: str = ""
+    """Minimum age of a new namespace before it is added to cluster-infra-backup."""
+
+    namespace_removal_grace: str = ""
+    """Time a deleted namespace stays in cluster-infra-backup."""
+
+    spec_debounce: str = ""
+    """Minimum time between two changes of the cluster-infra-backup namespaces."""
+
+    namespaced_exclude_namespaces: str = ""
+    """Comma-separated names or globs of namespaces excluded from the all-namespaces specs."""
+
+    namespaced_exclude_selector: str = ""
+    """Comma-separated key=value labels of namespaces excluded from the all-namespaces specs."""
+
+    prune_empty_namespaces: bool = False
+    """Leave the namespaces without backup-eligible objects out of cluster-infra-backup."""
+
+    namespace_content_cache: str = "1h"
+    """How long the object count of a namespace is reused."""
+
+    backup_budget_objects: int = 0
+    """Maximum estimated number of namespaced objects in cluster-infra-backup, 0 disables it."""
+
+    backup_budget_size: str = ""
+    """Maximum estimated size of the namespaced objects in cluster-infra-backup."""
+
+    backup_budget_action: str = "block"
+    """Whether to block or to cap cluster-infra-backup when it is over budget."""
+
+    deduplicate_replicas: bool = False
+    """Exclude from the backups the Secrets and ConfigMaps that are copies of another one."""
+
+    deduplicate_interval: str = "1h"
+    """Minimum time between two searches of the replicated Secrets and ConfigMaps."""
+
+    cluster_resources_profile: str = "default"
+    """Built-in list of cluster-scoped resources left out of cluster-infra-backup."""
+
+    cluster_resources_exclude: str = ""
+    """Comma-separated resources left out of cluster-infra-backup, on top of the profile."""
+
+    flow_control: bool = False
+    """Manage a FlowSchema bounding the concurrency of the backup requests on the apiserver."""
+
+    flow_control_concurrency_shares: int = 5
+    """Nominal concurrency shares of the priority level of the backup requests."""
+
+    flow_control_service_accounts: str = ""
+    """Comma-separated namespace/name of the service accounts whose requests are bounded."""
+
+    metrics_textfile: str = ""
+    """Path of the Prometheus textfile where the charm writes its metrics. Empty disables it."""
+
     def __post_init__(self) -> None:
         """Post init of InfraBackupConfig."""
+        self._validate_namespaces()
+        self._validate_durations()
+        self._validate_exclusions()
+        self._validate_flow_control()
+        self._validate_backup_budget()
+        self._validate_ttl_tiers()
+
+    def _validate_namespaces(self) -> None:
+        """Validate the namespaces config."""
         if not self.namespaces:
             raise ValueError("The namespaces config cannot be empty")
 
@@ -49,7 +194,138 @@ class InfraBackupConfig:
             if not NAMESPACE_REGEX.match(ns):
                 raise ValueError(f"Invalid namespace name: '{ns}'")
 
+    def _validate_durations(self) -> None:
+        """Validate the TTL and duration configs."""
+        for option, duration in [
+            ("cluster-infra-backup-ttl", self.cluster_infra_backup_ttl),
+            ("namespaced-infra-backup-ttl", self.namespaced_infra_backup_ttl),
+            ("volatile-infra-backup-ttl", self.volatile_infra_backup_ttl),
+            ("namespace-min-age", self.namespace_min_age),
+            ("namespace-removal-grace", self.namespace_removal_grace),
+            ("spec-debounce", self.spec_debounce),
+            ("namespace-content-cache", self.namespace_content_cache),
+            ("deduplicate-interval", self.deduplicate_interval),
+        ]:
+            if duration and not DURATION_REGEX.match(duration):
+                raise ValueError(f"Invalid {option}: '{duration}'")
+
+    def _validate_exclusions(self) -> None:
+        """Validate the configs that leave namespaces or resources out of the backups."""
+        for pattern in self.exclude_namespace_patterns:
+            if not NAMESPACE_GLOB_REGEX.match(pattern):
+                raise ValueError(f"Invalid namespaced-exclude-namespaces: '{pattern}'")
+
+        for requirement in _split(self.namespaced_exclude_selector):
+            if not LABEL_SELECTOR_REGEX.match(requirement):
+                raise ValueError(f"Invalid namespaced-exclude-selector: '{requirement}'")
+
+        if self.cluster_resources_profile not in CLUSTER_RESOURCES_PROFILES:
+            raise ValueError(
+                f"Invalid cluster-resources-profile: '{self.cluster_resources_profile}'"
+            )
+
+        for resource in _split(self.cluster_resources_exclude):
+            if not RESOURCE_REGEX.match(resource):
+                raise ValueError(f"Invalid cluster-resources-exclude: '{resource}'")
+
+    def _validate_flow_control(self) -> None:
+        """Validate the API Priority and Fairness configs."""
+        if self.flow_control_concurrency_shares < 1:
+            raise ValueError(
+                "Invalid flow-control-concurrency-shares: "
+                f"'{self.flow_control_concurrency_shares}'"
+            )
+
+        service_accounts = _split(self.flow_control_service_accounts)
+        for service_account in service_accounts:
+            if not SERVICE_ACCOUNT_REGEX.match(service_account):
+                raise ValueError(f"Invalid flow-control-service-accounts: '{service_account}'")
+        if self.flow_control and not service_accounts:
+            # the charm requests alone are a small part of the backup load
+            raise ValueError(
+                "Missing flow-control-service-accounts, e.g. Velero's 'velero/velero'"
+            )
+
+    def _validate_backup_budget(self) -> None:
+        """Validate the backup budget configs."""
+        if self.backup_budget_objects < 0:
+            raise ValueError(f"Invalid backup-budget-objects: '{self.backup_budget_objects}'")
+
+        if self.backup_budget_size and not SIZE_REGEX.match(self.backup_budget_size):
+            raise ValueError(f"Invalid backup-budget-size: '{self.backup_budget_size}'")
+
+        if self.backup_budget_action not in BUDGET_ACTIONS:
+            raise ValueError(f"Invalid backup-budget-action: '{self.backup_budget_action}'")
+
+    def _validate_ttl_tiers(self) -> None:
+        """Validate the namespace-ttl-tiers config."""
+        tiers = [tier.strip() for tier in self.namespace_ttl_tiers.split(";") if tier.strip()]
+        if len(tiers) > len(TTL_TIER_ENDPOINTS):
+            raise ValueError(
+                f"Invalid namespace-ttl-tiers: at most {len(TTL_TIER_ENDPOINTS)} tiers"
+            )
+
+        for tier in tiers:
+            patterns, _, ttl = tier.rpartition("=")
+            if not _split(patterns) or not DURATION_REGEX.match(ttl.strip()):
+                raise ValueError(f"Invalid namespace-ttl-tiers: '{tier}'")
+            for pattern in _split(patterns):
+                if not NAMESPACE_GLOB_REGEX.match(pattern):
+                    raise ValueError(f"Invalid namespace-ttl-tiers: '{pattern}'")
+
     @property
     def backup_namespaces(self) -> set[str]:
         """Namespaces for backup the cluster infrastructure."""
         return {ns.strip() for ns in self.namespaces.split(",") if ns.strip()}
+
+    @property
+    def excluded_cluster_resources(self) -> list[str]:
+        """Cluster-scoped resources left out of cluster-infra-backup."""
+        resources = CLUSTER_RESOURCES_PROFILES[self.cluster_resources_profile]
+        return list(dict.fromkeys(resources + _split(self.cluster_resources_exclude)))
+
+    @property
+    def exclude_namespace_patterns(self) -> set[str]:
+        """Names or globs of the namespaces excluded from the all-namespaces specs."""
+        return set(_split(self.namespaced_exclude_namespaces))
+
+    @property
+    def exclude_namespace_selector(self) -> dict[str, str]:
+        """Labels of the namespaces excluded from the all-namespaces specs."""
+        return dict(
+            requirement.split("=", 1) for requirement in _split(self.namespaced_exclude_selector)
+        )
+
+    @property
+    def flow_control_subjects(self) -> list[tuple[str, str]]:
+        """Namespace and name of the service accounts in the flow-control-service-accounts."""
+        subjects = []
+        for service_account in _split(self.flow_control_service_accounts):
+            namespace, name = service_account.split("/", 1)
+            subjects.append((namespace, name))
+        return subjects
+
+    @property
+    def backup_budget(self) -> Optional[int]:
+        """Maximum estimated objects of the cluster-infra-backup namespaces, None if unbounded."""
+        limits = []
+        if self.backup_budget_objects:
+            limits.append(self.backup_budget_objects)
+        if self.backup_budget_size:
+            limits.append(parse_size(self.backup_budget_size) // ESTIMATED_OBJECT_BYTES)
+        return min(limits) if limits else None
+
+    @property
+    def ttl_tiers(self) -> list[tuple[list[str], str]]:
+        """Names or globs of the namespaces and TTL of every tier of namespace-ttl-tiers."""
+        tiers = []
+        for tier in self.namespace_ttl_tiers.split(";"):
+            if tier.strip():
+                patterns, _, ttl = tier.rpartition("=")
+                tiers.append((_split(patterns), ttl.strip()))
+        return tiers
+
+    @property
+    def excludes_namespaces(self) -> bool:
+        """Whether namespaces are excluded from the all-namespaces specs."""
+        return bool(self.exclude_namespace_patterns or self.exclude_namespace_selector)
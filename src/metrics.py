@@ -0,0 +1,138 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Metrics of the backup configuration in the Prometheus text format."""
+
+import logging
+import os
+import tempfile
+from collections.abc import MutableMapping
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+METRICS = {
+    "infra_backup_hook_duration_seconds": (
+        "summary",
+        "Time spent handling a Juju hook, by event.",
+    ),
+    "infra_backup_namespace_list_duration_seconds": (
+        "gauge",
+        "Time spent listing the cluster namespaces in the last hook.",
+    ),
+    "infra_backup_cluster_namespaces": (
+        "gauge",
+        "Number of namespaces in the cluster.",
+    ),
+    "infra_backup_selected_namespaces": (
+        "gauge",
+        "Number of namespaces selected for cluster-infra-backup.",
+    ),
+    "infra_backup_estimated_min_objects": (
+        "gauge",
+        "Rough floor of the objects of cluster-infra-backup, when a backup budget is set: "
+        "the namespaced objects, without the cluster-scoped ones.",
+    ),
+    "infra_backup_estimated_min_bytes": (
+        "gauge",
+        "Rough floor of the size of cluster-infra-backup: the estimated minimum objects at a "
+        "mean of 4Ki, not their serialized size.",
+    ),
+    "infra_backup_spec_bytes": (
+        "gauge",
+        "Size of the published backup spec, by endpoint.",
+    ),
+    "infra_backup_relation_writes_total": (
+        "counter",
+        "Backup spec writes to the relation databag, by endpoint and result.",
+    ),
+    "infra_backup_cluster_resource_objects": (
+        "gauge",
+        "Objects of a cluster-scoped resource when last counted, by resource and backed_up.",
+    ),
+    "infra_backup_replicated_objects": (
+        "gauge",
+        "Replicated objects excluded from the backups when last deduplicated, by resource.",
+    ),
+    "infra_backup_deduplicated_bytes": (
+        "gauge",
+        "Size of the replicated objects excluded from the backups, by resource.",
+    ),
+    "infra_backup_k8s_api_errors_total": (
+        "counter",
+        "Failed K8s API calls, by operation.",
+    ),
+}
+
+
+def _sample_key(name: str, labels: dict[str, str]) -> str:
+    """Build the Prometheus sample key of a metric, e.g. 'name{label="value"}'."""
+    if not labels:
+        return name
+    label_pairs = ",".join(f'{label}="{value}"' for label, value in sorted(labels.items()))
+    return f"{name}{{{label_pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value without losing precision, e.g. on large byte counts."""
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class CharmMetrics:
+    """Metrics of the charm, kept across hooks in a mapping such as StoredState."""
+
+    def __init__(self, samples: MutableMapping[str, float]) -> None:
+        self.samples = samples
+
+    def clear(self, name: str) -> None:
+        """Remove every sample of a metric, e.g. before setting gauges with new labels."""
+        for key in [key for key in self.samples if key.split("{", 1)[0] == name]:
+            del self.samples[key]
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Set the value of a gauge."""
+        self.samples[_sample_key(name, labels)] = value
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increase a counter."""
+        key = _sample_key(name, labels)
+        self.samples[key] = self.samples.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record an observation of a summary."""
+        self.inc(f"{name}_sum", value, **labels)
+        self.inc(f"{name}_count", 1, **labels)
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text format."""
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            samples = sorted(
+                (key, value)
+                for key, value in self.samples.items()
+                if key.split("{", 1)[0] in (name, f"{name}_sum", f"{name}_count")
+            )
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{key} {_format_value(value)}" for key, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        """Atomically write the metrics to a textfile.
+
+        Args:
+            path (Path): The textfile, e.g. in the directory of a textfile collector.
+        """
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+            ) as f:
+                f.write(self.render())
+            os.replace(f.name, path)
+        except OSError as e:
+            logger.error("Failed to write the metrics to %s: %s", path, e)
@@ -0,0 +1,232 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Selection of the namespaces published in the cluster-infra-backup spec."""
+
+import fnmatch
+import logging
+import re
+from collections.abc import Callable, Iterable, Mapping, MutableMapping
+from datetime import datetime
+from typing import Any
+
+from k8s_utils import NamespaceInfo
+
+logger = logging.getLogger(__name__)
+
+
+def match_namespaces(
+    namespaces: Iterable[NamespaceInfo], patterns: set[str], selector: dict[str, str]
+) -> list[str]:
+    """Find the namespaces matching any name or glob, or all the labels of a selector.
+
+    The globs are compiled into a single regex, so matching is linear in the number of
+    namespaces whatever the number of patterns.
+
+    Args:
+        namespaces (Iterable[NamespaceInfo]): Namespaces available in the cluster.
+        patterns (set[str]): Names or globs, e.g. "ci-*".
+        selector (dict[str, str]): Labels that a namespace must all have, empty matches nothing.
+
+    Returns:
+        list[str]: The sorted names of the matching namespaces.
+    """
+    names = {pattern for pattern in patterns if not any(c in pattern for c in "*?[")}
+    globs = patterns - names
+    glob_regex = re.compile("|".join(fnmatch.translate(glob) for glob in globs)) if globs else None
+    selector_items = selector.items()
+
+    return sorted(
+        ns.name
+        for ns in namespaces
+        if ns.name in names
+        or (glob_regex and glob_regex.match(ns.name))
+        or (selector_items and selector_items <= ns.labels.items())
+    )
+
+
+class NamespaceSelector:
+    """Bound how often the selected namespaces change when namespaces churn quickly.
+
+    Every change of the selected namespaces is published to velero-operator, which then
+    reconciles its schedules. The selector keeps the published namespaces stable:
+
+    * a new namespace is only selected once it is older than `min_age`.
+    * a deleted namespace stays selected for `removal_grace`, so a namespace that is quickly
+      recreated does not change the spec twice.
+    * the selection changes at most once per `debounce`.
+
+    Changes of the namespaces config are applied at once. The state is kept in a mapping such
+    as StoredState, so it lasts across hooks.
+    """
+
+    def __init__(
+        self,
+        state: MutableMapping[str, Any],
+        min_age: int = 0,
+        removal_grace: int = 0,
+        debounce: int = 0,
+    ) -> None:
+        self.state = state
+        self.min_age = min_age
+        self.removal_grace = removal_grace
+        self.debounce = debounce
+
+    def select(
+        self, cluster_namespaces: Iterable[NamespaceInfo], configured: set[str], now: datetime
+    ) -> set[str]:
+        """Select the namespaces to backup.
+
+        Args:
+            cluster_namespaces (Iterable[NamespaceInfo]): Namespaces available in the cluster.
+            configured (set[str]): Namespaces in the charm config.
+            now (datetime): The current time, timezone aware.
+
+        Returns:
+            set[str]: The namespaces to publish.
+        """
+        timestamp = now.timestamp()
+        existing = {ns.name: ns for ns in cluster_namespaces if ns.name in configured}
+        published = set(self.state.get("published", [])) & configured
+        config_changed = sorted(configured) != self.state.get("configured")
+
+        missing_since = {
+            name: since
+            for name, since in self.state.get("missing_since", {}).items()
+            if name in published and name not in existing
+        }
+        for name in published - existing.keys():
+            missing_since.setdefault(name, timestamp)
+
+        selected = {
+            name
+            for name, ns in existing.items()
+            if name in published or (now - ns.created).total_seconds() >= self.min_age
+        }
+        selected |= {
+            name for name, since in missing_since.items() if timestamp - since < self.removal_grace
+        }
+
+        debounced = timestamp - self.state.get("published_at", 0) < self.debounce
+        if selected != published and debounced and not config_changed:
+            logger.info("Namespaces selection changed, waiting for the debounce window")
+            selected = published
+        elif selected != published or config_changed:
+            self.state["published_at"] = timestamp
+
+        self.state["published"] = sorted(selected)
+        self.state["configured"] = sorted(configured)
+        self.state["missing_since"] = {
+            name: since for name, since in missing_since.items() if name in selected
+        }
+        return selected
+
+
+class ExclusionDebouncer:
+    """Bound how often the excluded namespaces change when matching namespaces churn quickly.
+
+    The excluded namespaces are resolved from globs and labels against the cluster namespaces,
+    so every CI or preview namespace created or deleted would change the published exclude
+    list. The list changes at most once per `debounce`: a namespace matched in the meantime is
+    still backed up until the next change, and a deleted one stays listed, which has no effect
+    on Velero. The list never holds more than the namespaces matched at its last change.
+
+    Changes of the exclusion config are applied at once. The state is kept in a mapping such as
+    StoredState, so it lasts across hooks.
+    """
+
+    def __init__(self, state: MutableMapping[str, Any], debounce: int = 0) -> None:
+        self.state = state
+        self.debounce = debounce
+
+    def resolve(self, matched: list[str], config_key: str, now: datetime) -> list[str]:
+        """Resolve the namespaces to exclude.
+
+        Args:
+            matched (list[str]): The sorted namespaces matching the exclusion config now.
+            config_key (str): Key of the exclusion config, a change is applied at once.
+            now (datetime): The current time, timezone aware.
+
+        Returns:
+            list[str]: The sorted namespaces to publish.
+        """
+        timestamp = now.timestamp()
+        published = list(self.state.get("published", []))
+        config_changed = config_key != self.state.get("config_key")
+        debounced = timestamp - self.state.get("published_at", 0) < self.debounce
+
+        if matched != published and debounced and not config_changed:
+            logger.info("Excluded namespaces changed, waiting for the debounce window")
+            return published
+        if matched != published or config_changed:
+            self.state["published_at"] = timestamp
+        self.state["published"] = matched
+        self.state["config_key"] = config_key
+        return matched
+
+
+class NamespaceContentCache:
+    """Cached number of backup-eligible objects per namespace.
+
+    Counting a namespace takes a list call per covered resource, so the counts are kept in a
+    mapping such as StoredState and reused for `max_age`. An empty namespace is also cached, so
+    it is backed up at most `max_age` after it gains content.
+    """
+
+    def __init__(
+        self, state: MutableMapping[str, Any], counter: Callable[[str], int], max_age: int
+    ) -> None:
+        self.state = state
+        self.counter = counter
+        self.max_age = max_age
+
+    def counts(self, namespaces: Iterable[str], now: datetime) -> dict[str, int]:
+        """Get the number of objects of the namespaces.
+
+        Args:
+            namespaces (Iterable[str]): The namespaces to count.
+            now (datetime): The current time, timezone aware.
+
+        Returns:
+            dict[str, int]: The number of objects indexed by namespace.
+        """
+        timestamp = now.timestamp()
+        cached = dict(self.state)
+        counts = {}
+        for namespace in namespaces:
+            entry = cached.get(namespace)
+            if entry and timestamp - entry["checked_at"] < self.max_age:
+                counts[namespace] = entry["count"]
+                continue
+            counts[namespace] = self.counter(namespace)
+            cached[namespace] = {"count": counts[namespace], "checked_at": timestamp}
+
+        # only keep the namespaces that are still selected
+        for namespace in list(self.state):
+            if namespace not in counts:
+                del self.state[namespace]
+        for namespace in counts:
+            self.state[namespace] = cached[namespace]
+        return counts
+
+
+def cap_namespaces(counts: Mapping[str, int], max_objects: int) -> set[str]:
+    """Select the namespaces that fit in an object budget.
+
+    The smallest namespaces are taken first, so as many namespaces as possible are backed up,
+    and the selection does not depend on the order of the namespaces config.
+
+    Args:
+        counts (Mapping[str, int]): The number of objects indexed by namespace.
+        max_objects (int): The maximum number of objects of the selected namespaces.
+
+    Returns:
+        set[str]: The selected namespaces.
+    """
+    selected, total = set(), 0
+    for namespace, count in sorted(counts.items(), key=lambda entry: (entry[1], entry[0])):
+        if total + count > max_objects:
+            break
+        selected.add(namespace)
+        total += count
+    return selected
@@ -0,0 +1,92 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Profiling of the charm reconcile with cProfile.
+
+The K8s API and Juju hook tool calls are read from the profile itself, as the calls of the
+functions every request goes through, so the profiled code needs no instrumentation.
+"""
+
+import cProfile
+import io
+import pstats
+from collections.abc import Callable
+from dataclasses import dataclass
+
+# Function that every K8s API request of lightkube goes through
+K8S_API_CALL = ("httpx/_client.py", "send")
+# Function that runs every Juju hook tool, e.g. relation-get or relation-set, as a subprocess.
+# ops runs them with ops.hookcmds in the recent releases and with _ModelBackend._run before,
+# both through subprocess.run, which the charm does not call otherwise.
+HOOK_TOOL_CALL = ("subprocess.py", "run")
+
+
+@dataclass(frozen=True)
+class CallStats:
+    """Number and duration of the calls of a function."""
+
+    calls: int = 0
+    seconds: float = 0.0
+
+    def as_results(self) -> dict[str, str]:
+        """Format the stats as Juju action results."""
+        mean = self.seconds / self.calls if self.calls else 0.0
+        return {
+            "calls": str(self.calls),
+            "total-seconds": f"{self.seconds:.6f}",
+            "mean-seconds": f"{mean:.6f}",
+        }
+
+
+def profile(func: Callable[[], object]) -> pstats.Stats:
+    """Run a function under cProfile.
+
+    Args:
+        func (Callable[[], object]): The function to profile.
+
+    Returns:
+        pstats.Stats: The profile of the function.
+    """
+    profiler = cProfile.Profile()
+    profiler.runcall(func)
+    return pstats.Stats(profiler)
+
+
+def call_stats(stats: pstats.Stats, function: tuple[str, str]) -> CallStats:
+    """Sum the calls of a function in a profile.
+
+    Args:
+        stats (pstats.Stats): The profile.
+        function (tuple[str, str]): The end of the file path and the name of the function.
+
+    Returns:
+        CallStats: The number of calls and their cumulative time.
+    """
+    path, name = function
+    calls, seconds = 0, 0.0
+    # maps (file, line, function) to (primitive calls, calls, own time, cumulative time, callers)
+    entries = stats.stats  # type: ignore[attr-defined]
+    for (filename, _, funcname), (_, ncalls, _, cumtime, _) in entries.items():
+        if funcname == name and filename.endswith(path):
+            calls += ncalls
+            seconds += cumtime
+    return CallStats(calls, seconds)
+
+
+def hot_functions(stats: pstats.Stats, top: int) -> str:
+    """Format the functions with the most own time, as printed by pstats.
+
+    The directories are stripped from the file paths of the profile, so it must be dumped or
+    searched for calls before.
+
+    Args:
+        stats (pstats.Stats): The profile.
+        top (int): The number of functions.
+
+    Returns:
+        str: The pstats table of the hot functions.
+    """
+    output = io.StringIO()
+    stats.stream = output  # type: ignore[attr-defined]
+    stats.strip_dirs().sort_stats(pstats.SortKey.TIME).print_stats(top)
+    return output.getvalue().strip()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Render offline the backup specs the charm would publish on a fleet of clusters.
+
+Every cluster is described by a snapshot of its namespaces:
+
+* a ``.json`` file with the output of ``kubectl get namespaces -o json``. The cluster name is the
+  file name without extension.
+* a ``.ndjson`` file with one cluster per line, as a NamespaceList with an extra ``cluster`` key.
+
+The specs are rendered in a process pool and streamed to stdout as NDJSON, one cluster per line,
+in the same order as the input::
+
+    PYTHONPATH=lib:src python3 src/render_specs.py --config config.json snapshots/*.ndjson
+
+The config is a JSON object of charm config options. The options depending on the history of the
+cluster or on the content of its namespaces, see UNSUPPORTED_OPTIONS, cannot be rendered from a
+snapshot and are rejected.
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from typing import Any, Collection, Iterator, Optional, TextIO
+
+from backup_specs import render_specs
+from k8s_utils import NamespaceInfo
+from literals import TTL_TIER_ENDPOINTS, InfraBackupConfig
+
+# Number of clusters sent at once to a worker process
+CHUNK_SIZE = 64
+# Options resolved from the past namespace lists or the objects of the namespaces
+UNSUPPORTED_OPTIONS = [
+    "namespace-min-age",
+    "namespace-removal-grace",
+    "spec-debounce",
+    "prune-empty-namespaces",
+    "backup-budget-objects",
+    "backup-budget-size",
+]
+
+
+def load_config(path: Optional[Path]) -> InfraBackupConfig:
+    """Load the charm config from a JSON file of Juju config options.
+
+    Args:
+        path (Optional[Path]): The config file, None for the charm defaults.
+
+    Returns:
+        InfraBackupConfig: The validated charm config.
+
+    Raises:
+        ValueError: If an option is unknown or cannot be rendered from a namespace snapshot.
+    """
+    options = json.loads(path.read_text()) if path else {}
+    defaults = {
+        field.name.replace("_", "-"): field.default
+        for field in dataclasses.fields(InfraBackupConfig)
+    }
+    for option, value in options.items():
+        if option not in defaults:
+            raise ValueError(f"Unknown option: '{option}'")
+        if option in UNSUPPORTED_OPTIONS and value != defaults[option]:
+            raise ValueError(f"Unsupported option: '{option}' cannot be rendered from a snapshot")
+    return InfraBackupConfig(**{key.replace("-", "_"): value for key, value in options.items()})
+
+
+def read_snapshots(paths: list[Path]) -> Iterator[tuple[str, str]]:
+    """Read the namespace snapshots lazily.
+
+    The snapshots are not parsed here, so the JSON decoding also happens in the workers.
+
+    Args:
+        paths (list[Path]): The snapshot files.
+
+    Yields:
+        tuple[str, str]: The default cluster name and the raw NamespaceList JSON.
+    """
+    for path in paths:
+        if path.suffix == ".ndjson":
+            with path.open() as f:
+                for index, line in enumerate(f):
+                    if line.strip():
+                        yield f"{path.stem}:{index}", line
+        else:
+            yield path.stem, path.read_text()
+
+
+def parse_namespace(item: dict[str, Any]) -> NamespaceInfo:
+    """Parse a Namespace of a snapshot.
+
+    Args:
+        item (dict[str, Any]): The Namespace object.
+
+    Returns:
+        NamespaceInfo: The namespace information used to render the specs.
+    """
+    metadata = item["metadata"]
+    created = metadata.get("creationTimestamp")
+    return NamespaceInfo(
+        name=metadata["name"],
+        created=datetime.fromisoformat(created) if created else datetime.now(timezone.utc),
+        labels=metadata.get("labels") or {},
+    )
+
+
+def render_cluster(
+    snapshot: tuple[str, str],
+    config: InfraBackupConfig,
+    volatile_split: bool,
+    related_tiers: Collection[str] = (),
+) -> tuple[str, bool]:
+    """Render the specs of a single cluster.
+
+    Args:
+        snapshot (tuple[str, str]): The default cluster name and the raw NamespaceList JSON.
+        config (InfraBackupConfig): The charm config.
+        volatile_split (bool): Whether volatile-infra-backup is related.
+        related_tiers (Collection[str]): The related TTL tier endpoints.
+
+    Returns:
+        tuple[str, bool]: A JSON line with the cluster name and either its specs or the
+            rendering error, and whether the rendering succeeded.
+    """
+    cluster, raw = snapshot
+    result: dict[str, Any] = {"cluster": cluster}
+    try:
+        namespace_list = json.loads(raw)
+        result["cluster"] = namespace_list.get("cluster", cluster)
+        namespaces = [parse_namespace(item) for item in namespace_list["items"]]
+        specs = render_specs(namespaces, config, volatile_split, related_tiers)
+    except (ValueError, KeyError, TypeError) as e:
+        result["error"] = f"Invalid namespace snapshot: {e!r}"
+        return json.dumps(result), False
+
+    result["specs"] = {
+        endpoint: spec.model_dump(exclude_none=True) for endpoint, spec in specs.items()
+    }
+    return json.dumps(result), True
+
+
+def render_fleet(
+    paths: list[Path],
+    config: InfraBackupConfig,
+    volatile_split: bool,
+    output: TextIO,
+    workers: Optional[int] = None,
+    related_tiers: Collection[str] = (),
+) -> int:
+    """Render the specs of every cluster and stream them as NDJSON.
+
+    Args:
+        paths (list[Path]): The snapshot files.
+        config (InfraBackupConfig): The charm config.
+        volatile_split (bool): Whether volatile-infra-backup is related.
+        output (TextIO): Where the results are written.
+        workers (Optional[int]): Number of worker processes, defaults to the CPU count.
+        related_tiers (Collection[str]): The related TTL tier endpoints.
+
+    Returns:
+        int: Number of clusters that could not be rendered.
+    """
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        render = partial(
+            render_cluster,
+            config=config,
+            volatile_split=volatile_split,
+            related_tiers=related_tiers,
+        )
+        for line, rendered in executor.map(render, read_snapshots(paths), chunksize=CHUNK_SIZE):
+            failures += not rendered
+            output.write(line + "\n")
+    return failures
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Entry point of the renderer.
+
+    Args:
+        argv (Optional[list[str]]): Command line arguments, defaults to sys.argv.
+
+    Returns:
+        int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("snapshots", nargs="+", type=Path, help="JSON/NDJSON namespace lists")
+    parser.add_argument("--config", type=Path, help="JSON file with the charm config options")
+    parser.add_argument(
+        "--volatile-split",
+        action="store_true",
+        help="render the specs as if volatile-infra-backup was related",
+    )
+    parser.add_argument(
+        "--related-tier",
+        action="append",
+        default=[],
+        choices=TTL_TIER_ENDPOINTS,
+        help="render the specs as if this TTL tier endpoint was related, can be repeated",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(f"invalid config: {e}")
+
+    failures = render_fleet(
+        args.snapshots,
+        config,
+        args.volatile_split,
+        sys.stdout,
+        args.workers,
+        related_tiers=args.related_tier,
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
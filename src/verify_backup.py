@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Verify a Velero backup tarball against the backup spec it was made from.
+
+The tarball is streamed, never extracted, so a multi-GB backup is verified in bounded memory:
+only one object is held at a time, and the report grows with the number of kinds and namespaces,
+not with the number of objects. Velero stores every object as::
+
+    resources/<resource>.<group>/namespaces/<namespace>/<name>.json
+    resources/<resource>.<group>/cluster/<name>.json
+
+plus a copy under a ``<version>-preferredversion`` directory, which is only counted in bytes.
+
+The spec is a JSON VeleroBackupSpec, as published on the relation or rendered by
+render_specs.py::
+
+    PYTHONPATH=lib:src python3 src/verify_backup.py --spec spec.json backup.tar.gz
+
+``-`` reads the tarball from stdin, e.g. to decompress it in parallel with ``pigz -dc``.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import sys
+import tarfile
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, Optional
+
+from charms.velero_libs.v0.velero_backup_config import ScopeSet, SpecScope, VeleroBackupSpec
+from pydantic import ValidationError
+
+BLOCK_SIZE = 512
+GZIP_MAGIC = b"\x1f\x8b"
+# Read buffer of the decompressed stream, most objects fit in it with their tar header
+READ_BUFFER_SIZE = 1 << 16
+# Key of the cluster-scoped objects in the per-namespace breakdown
+CLUSTER_SCOPE = "<cluster>"
+# Number of out-of-spec object paths kept as examples
+MAX_SAMPLES = 20
+NAMESPACES = "namespaces"
+# Velero adds the CRDs of the backed up custom resources when include_cluster_resources is unset
+CRDS = "customresourcedefinitions.apiextensions.k8s.io"
+
+
+@dataclass(frozen=True)
+class BackupItem:
+    """An object stored in a backup tarball.
+
+    Args:
+        path (str): The path of the object in the tarball.
+        resource (str): The group resource, e.g. "deployments.apps", or "pods" for the core group.
+        namespace (Optional[str]): The namespace, None for cluster-scoped objects.
+        name (str): The object name.
+        size (int): The size of the object JSON.
+        versioned (bool): Whether this is the copy stored under an API version directory.
+    """
+
+    path: str
+    resource: str
+    namespace: Optional[str]
+    name: str
+    size: int
+    versioned: bool = False
+
+
+@dataclass
+class Usage:
+    """Number and size of the objects of a breakdown entry."""
+
+    objects: int = 0
+    bytes: int = 0
+
+
+@dataclass
+class BackupReport:
+    """Content of a backup and the objects that its spec does not select.
+
+    Args:
+        kinds (dict[str, Usage]): Usage by group resource.
+        namespaces (dict[str, Usage]): Usage by namespace, CLUSTER_SCOPE for cluster-scoped ones.
+        violations (dict[str, Usage]): Out-of-spec objects by reason.
+        samples (list[str]): Paths of the first out-of-spec objects.
+        missing (list[str]): Resources explicitly included by the spec without any object.
+    """
+
+    kinds: dict[str, Usage] = field(default_factory=dict)
+    namespaces: dict[str, Usage] = field(default_factory=dict)
+    violations: dict[str, Usage] = field(default_factory=dict)
+    samples: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> Usage:
+        """Usage of the whole backup."""
+        return Usage(
+            objects=sum(usage.objects for usage in self.kinds.values()),
+            bytes=sum(usage.bytes for usage in self.kinds.values()),
+        )
+
+
+def parse_item_path(path: str, size: int = 0) -> Optional[BackupItem]:
+    """Parse the path of an object in a backup tarball.
+
+    Args:
+        path (str): The path of the tar member.
+        size (int): The size of the tar member.
+
+    Returns:
+        Optional[BackupItem]: The object, None if the member is not an object, e.g. metadata.
+    """
+    parts = path.removeprefix("./").split("/")
+    if len(parts) < 4 or parts[0] != "resources" or not parts[-1].endswith(".json"):
+        return None
+    resource, rest = parts[1], parts[2:]
+    versioned = rest[0] not in (NAMESPACES, "cluster")
+    if versioned:
+        rest = rest[1:]
+    name = rest[-1].removesuffix(".json")
+    if rest[0] == NAMESPACES and len(rest) == 3:
+        return BackupItem(path, resource, rest[1], name, size, versioned)
+    if rest[0] == "cluster" and len(rest) == 2:
+        return BackupItem(path, resource, None, name, size, versioned)
+    return None
+
+
+def _decompressed(fileobj: IO[bytes]) -> IO[bytes]:
+    """Decompress a gzip stream on the fly, other streams are read as is."""
+    if isinstance(fileobj, io.BufferedReader):
+        reader = fileobj
+    else:
+        reader = io.BufferedReader(fileobj)  # type: ignore[type-var]
+    if reader.peek(2)[:2] == GZIP_MAGIC:
+        return io.BufferedReader(gzip.GzipFile(fileobj=reader), READ_BUFFER_SIZE)
+    return reader
+
+
+def _number(field: bytes) -> int:
+    """Parse a numeric field of a tar header, octal or base-256 for the large sizes."""
+    if field[0] & 0x80:
+        return int.from_bytes(field[1:], "big")
+    try:
+        return int(field.split(b"\0", 1)[0].strip() or b"0", 8)
+    except ValueError:
+        raise tarfile.ReadError("invalid tar header") from None
+
+
+def _pax_records(data: bytes) -> dict[bytes, bytes]:
+    """Parse the "<length> <key>=<value>" lines of a PAX extended header."""
+    records = {}
+    while data:
+        length, _, rest = data.partition(b" ")
+        end = int(length) - len(length) - 1
+        key, _, value = rest[: end - 1].partition(b"=")
+        records[key] = value
+        data = rest[end:]
+    return records
+
+
+def iter_tar_files(fileobj: IO[bytes]) -> Iterator[tuple[str, bytes]]:
+    """Stream the regular files of a tarball, gzip-compressed or not.
+
+    Reading the ustar headers directly is several times faster than the tarfile module, whose
+    header parsing dominates on backups made of many small objects. The USTAR, PAX and GNU long
+    name formats are supported, which covers the archives written by Velero.
+
+    Args:
+        fileobj (IO[bytes]): The tarball.
+
+    Yields:
+        tuple[str, bytes]: The path and the content of every regular file.
+
+    Raises:
+        tarfile.ReadError: If the stream is not a tarball.
+    """
+    stream = _decompressed(fileobj)
+    long_name: Optional[bytes] = None
+    while True:
+        header = stream.read(BLOCK_SIZE)
+        if not header.strip(b"\0"):
+            return
+        if len(header) < BLOCK_SIZE:
+            raise tarfile.ReadError("unexpected end of the tarball")
+        # the checksum is computed with its own field filled with spaces
+        if sum(header[:148]) + 8 * ord(" ") + sum(header[156:]) != _number(header[148:156]):
+            raise tarfile.ReadError("invalid tar header")
+        size = _number(header[124:136])
+        data = stream.read(size)
+        stream.read(-size % BLOCK_SIZE)
+        if len(data) < size:
+            raise tarfile.ReadError("unexpected end of the tarball")
+
+        typeflag = header[156:157]
+        if typeflag == b"x":
+            long_name = _pax_records(data).get(b"path", long_name)
+            continue
+        if typeflag == b"L":
+            long_name = data.rstrip(b"\0")
+            continue
+        if typeflag not in (b"0", b"\0", b"7"):
+            long_name = None
+            continue
+        name = header[:100].split(b"\0", 1)[0]
+        if header[257:262] == b"ustar" and header[345]:
+            name = header[345:500].split(b"\0", 1)[0] + b"/" + name
+        yield (long_name or name).decode(), data
+        long_name = None
+
+
+def iter_backup_items(fileobj: IO[bytes]) -> Iterator[tuple[BackupItem, bytes]]:
+    """Stream the objects of a backup tarball, one at a time.
+
+    Args:
+        fileobj (IO[bytes]): The tarball, gzip-compressed or not.
+
+    Yields:
+        tuple[BackupItem, bytes]: The object and its JSON content.
+    """
+    for path, data in iter_tar_files(fileobj):
+        item = parse_item_path(path, len(data))
+        if item:
+            yield item, data
+
+
+def resource_selected(resources: ScopeSet, resource: str) -> bool:
+    """Whether a group resource is selected, as Velero matches "jobs" and "jobs.batch" alike.
+
+    Args:
+        resources (ScopeSet): The resources selected by the spec.
+        resource (str): The group resource.
+
+    Returns:
+        bool: Whether the objects of the resource are backed up.
+    """
+    names = {resource.lower(), resource.split(".", 1)[0].lower()}
+    if resources.complement:
+        return not names & resources.names
+    return bool(names & resources.names)
+
+
+def out_of_spec_reason(
+    item: BackupItem, content: bytes, scope: SpecScope, spec: VeleroBackupSpec
+) -> Optional[str]:
+    """Tell why an object should not be in the backup of a spec.
+
+    Args:
+        item (BackupItem): The object.
+        content (bytes): The object JSON, only parsed if the spec selects or excludes labels.
+        scope (SpecScope): The objects selected by the spec.
+        spec (VeleroBackupSpec): The backup specification.
+
+    Returns:
+        Optional[str]: The reason, None if the spec selects the object.
+    """
+    if item.namespace is None and item.resource == NAMESPACES:
+        # the Namespace objects of the included namespaces are always backed up
+        return None if item.name in scope.namespaces else "namespace not selected"
+    if item.namespace is not None and item.namespace not in scope.namespaces:
+        return "namespace not selected"
+    if item.namespace is None and not scope.cluster_resources:
+        if item.resource == CRDS and spec.include_cluster_resources is None:
+            return None
+        return "cluster-scoped resource not selected"
+    if not resource_selected(scope.resources, item.resource):
+        return "resource not selected"
+    if scope.label_selector or scope.exclude_labels:
+        labels = json.loads(content).get("metadata", {}).get("labels") or {}
+        if any(labels.get(key) != value for key, value in scope.label_selector.items()):
+            return "labels not selected"
+        if labels.keys() & scope.exclude_labels:
+            return "label excluded"
+    return None
+
+
+def verify_backup(fileobj: IO[bytes], spec: VeleroBackupSpec) -> BackupReport:
+    """Break down the content of a backup tarball and check it against its spec.
+
+    Args:
+        fileobj (IO[bytes]): The tarball, gzip-compressed or not.
+        spec (VeleroBackupSpec): The spec the backup was made from.
+
+    Returns:
+        BackupReport: The breakdown and the out-of-spec objects.
+    """
+    scope = SpecScope.from_spec(spec)
+    report = BackupReport()
+    for item, content in iter_backup_items(fileobj):
+        counted = not item.versioned
+        namespace = item.namespace or CLUSTER_SCOPE
+        for usage in (
+            report.kinds.setdefault(item.resource, Usage()),
+            report.namespaces.setdefault(namespace, Usage()),
+        ):
+            usage.objects += counted
+            usage.bytes += item.size
+        if not counted:
+            continue
+        reason = out_of_spec_reason(item, content, scope, spec)
+        if reason:
+            violation = report.violations.setdefault(f"{item.resource}: {reason}", Usage())
+            violation.objects += 1
+            violation.bytes += item.size
+            if len(report.samples) < MAX_SAMPLES:
+                report.samples.append(item.path)
+
+    if not scope.resources.complement:
+        found = {name.lower() for kind in report.kinds for name in (kind, kind.split(".")[0])}
+        report.missing = sorted(scope.resources.names - found)
+    return report
+
+
+def format_breakdown(title: str, breakdown: dict[str, Usage], total: Usage) -> str:
+    """Format a breakdown as a table, largest entries first.
+
+    Args:
+        title (str): The header of the first column.
+        breakdown (dict[str, Usage]): The usage by entry.
+        total (Usage): The usage of the whole backup, to compute the share of every entry.
+
+    Returns:
+        str: The table.
+    """
+    rows = sorted(breakdown.items(), key=lambda entry: (-entry[1].bytes, entry[0]))
+    width = max([len(title)] + [len(key) for key in breakdown])
+    lines = [f"{title:<{width}}  {'OBJECTS':>10}  {'BYTES':>14}  {'SHARE':>6}"]
+    for key, usage in rows:
+        share = usage.bytes / total.bytes if total.bytes else 0.0
+        lines.append(f"{key:<{width}}  {usage.objects:>10}  {usage.bytes:>14}  {share:>6.1%}")
+    return "\n".join(lines)
+
+
+def format_report(report: BackupReport) -> str:
+    """Format a report for humans.
+
+    Args:
+        report (BackupReport): The report.
+
+    Returns:
+        str: The breakdowns followed by the out-of-spec objects.
+    """
+    total = report.total
+    sections = [
+        f"{total.objects} objects, {total.bytes} bytes",
+        format_breakdown("KIND", report.kinds, total),
+        format_breakdown("NAMESPACE", report.namespaces, total),
+    ]
+    if report.missing:
+        sections.append("Included resources without objects: " + ", ".join(report.missing))
+    if report.violations:
+        sections.append(format_breakdown("OUT OF SPEC", report.violations, total))
+        sections.append("\n".join(["Examples:"] + [f"  {path}" for path in report.samples]))
+    else:
+        sections.append("All the objects are selected by the spec.")
+    return "\n\n".join(sections)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Entry point of the verifier.
+
+    Args:
+        argv (Optional[list[str]]): Command line arguments, defaults to sys.argv.
+
+    Returns:
+        int: The exit code, 1 if the backup has objects out of its spec.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("backup", help="Velero backup tarball, - for stdin")
+    parser.add_argument("--spec", type=Path, required=True, help="JSON VeleroBackupSpec")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        spec = VeleroBackupSpec.model_validate_json(args.spec.read_text())
+    except (OSError, ValidationError) as e:
+        parser.error(f"invalid spec: {e}")
+
+    try:
+        if args.backup == "-":
+            report = verify_backup(sys.stdin.buffer, spec)
+        else:
+            with open(args.backup, "rb") as f:
+                report = verify_backup(f, spec)
+    except (OSError, EOFError, tarfile.TarError, ValueError) as e:
+        print(f"Failed to read the backup: {e}", file=sys.stderr)
+        return 2
+
+    print(json.dumps(asdict(report), indent=2) if args.json else format_report(report))
+    return 1 if report.violations else 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
@@ -0,0 +1,30 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+from functools import partial
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fake_apiserver import KUBECONFIG, FakeApiServer
+from fake_hook_tools import FakeHookTools
+from lightkube import Client, KubeConfig
+
+
+@pytest.fixture
+def apiserver() -> FakeApiServer:  # type: ignore[misc]
+    server = FakeApiServer()
+    client = partial(
+        Client,
+        config=KubeConfig.from_dict(KUBECONFIG),
+        transport=httpx.MockTransport(server.handle),
+    )
+    with patch("k8s_utils.Client", client):
+        yield server
+
+
+@pytest.fixture
+def hook_tools(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FakeHookTools:
+    tools = FakeHookTools(tmp_path)
+    tools.install(monkeypatch)
+    return tools
@@ -0,0 +1,73 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Fake apiserver serving the lightkube client of K8sUtils, see the apiserver fixture."""
+
+import json
+
+import httpx
+
+KUBECONFIG = {
+    "clusters": [{"name": "fake", "cluster": {"server": "https://apiserver.local"}}],
+    "users": [{"name": "fake", "user": {"token": "token"}}],
+    "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake"}}],
+    "current-context": "fake",
+}
+NAMESPACES_PATH = "/api/v1/namespaces"
+
+
+def status(code: int, reason: str, message: str) -> httpx.Response:
+    return httpx.Response(
+        code, json={"kind": "Status", "code": code, "reason": reason, "message": message}
+    )
+
+
+class FakeApiServer:
+    """Minimal apiserver serving the namespace list and the applied cluster-scoped objects."""
+
+    def __init__(self) -> None:
+        self.namespaces: list[str] = []
+        self.resource_version = 1
+        self.objects: dict[str, dict] = {}
+        self.requests: list[httpx.Request] = []
+        self.forbidden = False
+        # API paths answered like an apiserver that does not serve them, e.g. "/apis/x.io/v1"
+        self.missing_apis: set[str] = set()
+
+    def create_namespace(self, name: str) -> None:
+        self.namespaces.append(name)
+        self.resource_version += 1
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.forbidden:
+            return status(403, "Forbidden", "no")
+        path = request.url.path
+        if any(path.startswith(f"{api}/") for api in self.missing_apis):
+            return httpx.Response(404, text="404 page not found")
+        if request.method == "GET" and path == NAMESPACES_PATH:
+            return self.list_namespaces()
+        if request.method == "PATCH":
+            assert request.headers["content-type"] == "application/apply-patch+yaml"
+            self.objects[path] = json.loads(request.content)
+            return httpx.Response(200, json=self.objects[path])
+        if path not in self.objects:
+            return status(404, "NotFound", path)
+        if request.method == "DELETE":
+            del self.objects[path]
+            return httpx.Response(200, json={"kind": "Status", "code": 200})
+        return httpx.Response(200, json=self.objects[path])
+
+    def list_namespaces(self) -> httpx.Response:
+        items = [
+            {"metadata": {"name": name, "creationTimestamp": "2025-01-01T00:00:00Z"}}
+            for name in self.namespaces
+        ]
+        return httpx.Response(
+            200,
+            json={
+                "kind": "NamespaceList",
+                "apiVersion": "v1",
+                "metadata": {"resourceVersion": str(self.resource_version)},
+                "items": items,
+            },
+        )
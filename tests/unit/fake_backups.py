@@ -0,0 +1,41 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Velero backup tarballs written like Velero does, for verify_backup and diff_backups."""
+
+import io
+import json
+import tarfile
+from pathlib import Path
+from typing import Literal, Optional
+
+
+def velero_object(
+    resource: str, name: str, namespace: Optional[str] = None, labels: Optional[dict] = None
+) -> tuple[str, dict]:
+    scope = f"namespaces/{namespace}" if namespace else "cluster"
+    metadata: dict = {"name": name, "labels": labels or {}}
+    if namespace:
+        metadata["namespace"] = namespace
+    return f"resources/{resource}/{scope}/{name}.json", {"metadata": metadata}
+
+
+def write_backup(
+    path: Path,
+    *objects: tuple[str, dict],
+    preferred_copy: bool = True,
+    mode: Literal["w", "w:gz"] = "w:gz",
+    tar_format: int = tarfile.PAX_FORMAT,
+) -> Path:
+    with tarfile.open(path, mode, format=tar_format) as tar:
+        members = [("metadata/version", b"1.1.0")]
+        for item_path, obj in objects:
+            content = json.dumps(obj).encode()
+            members.append((item_path, content))
+            if preferred_copy:
+                resource, rest = item_path.removeprefix("resources/").split("/", 1)
+                members.append((f"resources/{resource}/v1-preferredversion/{rest}", content))
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return path
@@ -0,0 +1,81 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Stubs of the Juju hook tools reading the relations, run as subprocesses like on a unit.
+
+The stubs serve the relations of a JSON file, so that the code under test runs on the real ops
+model backend and its hook tool calls can be counted at the subprocess.run boundary.
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, TypeVar
+
+import ops
+import pytest
+
+CharmT = TypeVar("CharmT", bound=ops.CharmBase)
+HOOK_TOOLS = ["relation-ids", "relation-list", "relation-get"]
+STUB = """#!{python}
+import json, os, sys
+
+tool, args = os.path.basename(sys.argv[0]), sys.argv[1:]
+with open({relations!r}) as file:
+    relations = json.load(file)
+if tool == "relation-ids":
+    [endpoint] = [arg for arg in args if not arg.startswith("--")]
+    ids = [f"{{endpoint}}:{{id}}" for id, rel in relations.items() if rel["endpoint"] == endpoint]
+    print(json.dumps(ids))
+    sys.exit()
+relation = relations[args[args.index("-r") + 1].split(":")[-1]]
+if tool == "relation-list":
+    print(json.dumps(relation["app"] if "--app" in args else [relation["app"] + "/0"]))
+else:
+    print(json.dumps(relation["data"] if "--app" in args else {{}}))
+"""
+
+
+class FakeHookTools:
+    """Relations served by the hook tool stubs, by relation ID."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.relations: dict[str, dict] = {}
+
+    def add_relation(self, endpoint: str, app: str, data: dict[str, str]) -> int:
+        """Relate an app on an endpoint, with its app databag."""
+        relation_id = len(self.relations)
+        self.relations[str(relation_id)] = {"endpoint": endpoint, "app": app, "data": data}
+        self._write()
+        return relation_id
+
+    def _write(self) -> None:
+        (self.path / "relations.json").write_text(json.dumps(self.relations))
+
+    def install(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Put the stubs first on the PATH, and set the environment of a Juju unit."""
+        self._write()
+        stub = STUB.format(python=sys.executable, relations=str(self.path / "relations.json"))
+        for tool in HOOK_TOOLS:
+            (self.path / tool).write_text(stub)
+            (self.path / tool).chmod(0o755)
+        monkeypatch.setenv("PATH", f"{self.path}{os.pathsep}{os.environ['PATH']}")
+        monkeypatch.setenv("JUJU_VERSION", "3.6.0")
+        monkeypatch.setenv("JUJU_MODEL_NAME", "m")
+
+    def charm(self, charm_type: type[CharmT], meta: dict[str, Any]) -> CharmT:
+        """Instantiate a charm of the given metadata on the real model backend."""
+        charm_meta = ops.CharmMeta(meta)
+        backend = ops.model._ModelBackend(f"{charm_meta.name}/0")
+        framework = ops.Framework(
+            ops.storage.SQLiteStorage(":memory:"),
+            self.path,
+            charm_meta,
+            ops.Model(charm_meta, backend),
+        )
+        # the relation events are defined on the events type of the charm, fresh ones are used
+        # so that the charm type can still be instantiated by the other tests
+        events = type(charm_type.on)
+        charm = type(charm_type.__name__, (charm_type,), {"on": type("Events", (events,), {})()})
+        return charm(framework)
@@ -1,20 +1,53 @@
 # Copyright 2025 Canonical Ltd.
 # See LICENSE file for licensing details.
+import dataclasses
+import json
+import pstats
+from datetime import datetime, timezone
+from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
+from charms.velero_libs.v0.velero_backup_config import EXCLUDE_LABELS_LIBPATCH, LIBPATCH_FIELD
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.core_v1 import ConfigMap
+from lightkube.resources.flowcontrol_apiserver_v1 import FlowSchema, PriorityLevelConfiguration
 from ops import testing
 from pytest_mock import MockerFixture
 from scenario import Relation
 
 from charm import InfraBackupOperatorCharm, K8sUtilsError
-from literals import CLUSTER_INFRA_BACKUP, NAMESPACED_INFRA_BACKUP
+from deduplication import EXCLUDE_LABELS, REPLICA_ANNOTATION, REPLICA_LABEL, SOURCE_ANNOTATIONS
+from k8s_utils import NamespaceInfo
+from leader_snapshot import LeaderSnapshot
+from literals import (
+    CLUSTER_INFRA_BACKUP,
+    LEADER_SNAPSHOT_MAX_AGE,
+    NAMESPACED_INFRA_BACKUP,
+    PEERS,
+    RESOURCES_BACKUP,
+    STABLE_RESOURCES_BACKUP,
+    TTL_TIER_ENDPOINTS,
+    VOLATILE_INFRA_BACKUP,
+    VOLATILE_RESOURCES_BACKUP,
+)
+
+CREATED = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def namespaces(*names: str) -> list[NamespaceInfo]:
+    return [NamespaceInfo(name=name, created=CREATED) for name in names]
+
+
+def app_data(state: testing.State, relation: testing.RelationBase) -> dict[str, str]:
+    return dict(state.get_relation(relation.id).local_app_data)
 
 
 @pytest.fixture(autouse=True)
 def mock_k8s_utils() -> MagicMock:  # type: ignore[misc]
     with patch("charm.K8sUtils") as mock_k8s_utils:
         mock_instance = MagicMock()
+        mock_instance.namespaces_resource_version = "1"
         mock_k8s_utils.return_value = mock_instance
         yield mock_instance
 
@@ -73,7 +106,7 @@ def test_assess_cluster_backup_state_active(
 def test_assess_cluster_backup_state_waiting_fail_ns(
     mock_k8s_utils: MagicMock, charm_state: testing.State
 ) -> None:
-    mock_k8s_utils.get_namespaces.side_effect = K8sUtilsError("wrong permission")
+    mock_k8s_utils.list_namespaces.side_effect = K8sUtilsError("wrong permission")
     ctx = testing.Context(InfraBackupOperatorCharm)
     state_out = ctx.run(ctx.on.update_status(), charm_state)
     assert state_out.unit_status == testing.WaitingStatus("Trying to get namespaces...")
@@ -131,3 +164,907 @@ def test_wrong_namespace_config(namespaces: str, exp_msg: str) -> None:
     state_in = testing.State(config={"namespaces": namespaces})
     state_out = ctx.run(ctx.on.config_changed(), state_in)
     assert state_out.unit_status == testing.BlockedStatus(exp_msg)
+
+
+@pytest.mark.parametrize(
+    "ttl_option, ttl",
+    [
+        ("namespaced-infra-backup-ttl", "1d"),
+        ("volatile-infra-backup-ttl", "h"),
+    ],
+    ids=["invalid namespaced ttl", "invalid volatile ttl"],
+)
+def test_wrong_ttl_config(ttl_option: str, ttl: str) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(config={ttl_option: ttl})
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+    assert state_out.unit_status == testing.BlockedStatus(f"Invalid {ttl_option}: '{ttl}'")
+
+
+@pytest.mark.parametrize(
+    "option, value, exp_msg",
+    [
+        (
+            "namespaced-exclude-namespaces",
+            "ci-*, CI/*",
+            "Invalid namespaced-exclude-namespaces: 'CI/*'",
+        ),
+        ("namespaced-exclude-selector", "env", "Invalid namespaced-exclude-selector: 'env'"),
+        ("cluster-resources-profile", "none", "Invalid cluster-resources-profile: 'none'"),
+        ("cluster-resources-exclude", "Nodes", "Invalid cluster-resources-exclude: 'Nodes'"),
+    ],
+    ids=["invalid glob", "selector without value", "unknown profile", "invalid resource"],
+)
+def test_wrong_exclude_config(option: str, value: str, exp_msg: str) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(config={option: value}))
+    assert state_out.unit_status == testing.BlockedStatus(exp_msg)
+
+
+@pytest.mark.parametrize(
+    "volatile_related, exp_namespaced_resources",
+    [(False, RESOURCES_BACKUP), (True, STABLE_RESOURCES_BACKUP)],
+    ids=["namespaced only", "namespaced and volatile"],
+)
+def test_volatile_split(volatile_related: bool, exp_namespaced_resources: list[str]) -> None:
+    namespaced = Relation(endpoint=NAMESPACED_INFRA_BACKUP)
+    volatile = Relation(endpoint=VOLATILE_INFRA_BACKUP)
+    relations = [namespaced, volatile] if volatile_related else [namespaced]
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=relations,
+        config={"namespaced-infra-backup-ttl": "720h", "volatile-infra-backup-ttl": "24h"},
+    )
+
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    namespaced_spec = json.loads(app_data(state_out, namespaced)["spec"])
+    assert namespaced_spec["include_resources"] == exp_namespaced_resources
+    assert namespaced_spec["ttl"] == "720h"
+    if volatile_related:
+        volatile_spec = json.loads(app_data(state_out, volatile)["spec"])
+        assert volatile_spec["include_resources"] == VOLATILE_RESOURCES_BACKUP
+        assert volatile_spec["ttl"] == "24h"
+
+
+def test_metrics_textfile(mock_k8s_utils: MagicMock, tmp_path: Path) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "default")
+    metrics_file = tmp_path / "metrics.prom"
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True, relations=[cluster], config={"metrics-textfile": str(metrics_file)}
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+    ctx.run(ctx.on.update_status(), state_out)
+
+    metrics = metrics_file.read_text()
+    assert "infra_backup_cluster_namespaces 2\n" in metrics
+    assert "infra_backup_selected_namespaces 1\n" in metrics
+    assert 'infra_backup_hook_duration_seconds_count{event="update-status"} 2\n' in metrics
+    for result in ["written", "skipped"]:
+        assert (
+            "infra_backup_relation_writes_total"
+            f'{{endpoint="{CLUSTER_INFRA_BACKUP}",result="{result}"}} 1\n'
+        ) in metrics
+
+
+def test_metrics_k8s_api_errors(mock_k8s_utils: MagicMock, tmp_path: Path) -> None:
+    mock_k8s_utils.list_namespaces.side_effect = K8sUtilsError("timeout")
+    metrics_file = tmp_path / "metrics.prom"
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(config={"metrics-textfile": str(metrics_file)})
+
+    ctx.run(ctx.on.update_status(), state_in)
+
+    assert (
+        'infra_backup_k8s_api_errors_total{operation="list_namespaces"} 1\n'
+        in metrics_file.read_text()
+    )
+
+
+def test_namespace_min_age(mock_k8s_utils: MagicMock) -> None:
+    young = NamespaceInfo(name="metallb-system", created=datetime.now(timezone.utc))
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system") + [young]
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(leader=True, relations=[cluster], config={"namespace-min-age": "10m"})
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert spec["include_namespaces"] == ["kube-system"]
+
+
+def test_namespaced_exclude_namespaces(mock_k8s_utils: MagicMock) -> None:
+    created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "ci-1", "ci-2") + [
+        NamespaceInfo(name="pr-42", created=created, labels={"env": "preview"})
+    ]
+    namespaced = Relation(endpoint=NAMESPACED_INFRA_BACKUP)
+    volatile = Relation(endpoint=VOLATILE_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[namespaced, volatile],
+        config={
+            "namespaced-exclude-namespaces": "ci-*",
+            "namespaced-exclude-selector": "env=preview",
+        },
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    for relation in [namespaced, volatile]:
+        spec = json.loads(app_data(state_out, relation)["spec"])
+        assert spec["exclude_namespaces"] == ["ci-1", "ci-2", "pr-42"]
+
+
+def test_namespaced_exclude_namespaces_debounced(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "ci-1")
+    namespaced = Relation(endpoint=NAMESPACED_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[namespaced],
+        config={"namespaced-exclude-namespaces": "ci-*", "spec-debounce": "30m"},
+    )
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+    published = app_data(state_out, namespaced)["spec"]
+
+    # a new CI namespace does not republish the spec inside the debounce window
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "ci-1", "ci-2")
+    state_out = ctx.run(ctx.on.update_status(), state_out)
+    assert app_data(state_out, namespaced)["spec"] == published
+
+    # the exclusion config is applied at once
+    state_out = ctx.run(
+        ctx.on.config_changed(),
+        dataclasses.replace(
+            state_out, config={**state_in.config, "namespaced-exclude-namespaces": "ci-2"}
+        ),
+    )
+    spec = json.loads(app_data(state_out, namespaced)["spec"])
+    assert spec["exclude_namespaces"] == ["ci-2"]
+
+
+def test_namespaced_exclude_namespaces_list_failure(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.side_effect = K8sUtilsError("timeout")
+    namespaced = Relation(endpoint=NAMESPACED_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True, relations=[namespaced], config={"namespaced-exclude-namespaces": "ci-*"}
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    assert "spec" not in app_data(state_out, namespaced)
+
+
+@pytest.mark.parametrize(
+    "profile, exp_excluded, exp_included",
+    [
+        ("default", {"nodes", "ciliumidentities", "clusterpolicyreports"}, set()),
+        ("all", {"clusterpolicyreports", "nodes"}, {"csinodes", "ciliumidentities"}),
+    ],
+)
+def test_cluster_resources_exclude(
+    mock_k8s_utils: MagicMock, profile: str, exp_excluded: set[str], exp_included: set[str]
+) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system")
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[cluster],
+        config={
+            "cluster-resources-profile": profile,
+            "cluster-resources-exclude": "clusterpolicyreports, nodes",
+        },
+    )
+
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    excluded = spec["exclude_resources"]
+    assert len(excluded) == len(set(excluded))
+    assert exp_excluded <= set(excluded)
+    assert not exp_included & set(excluded)
+    assert {"pods", "persistentvolumes", *RESOURCES_BACKUP} <= set(excluded)
+
+
+def test_count_cluster_resources_action(mock_k8s_utils: MagicMock) -> None:
+    # in discovery order, the bare "issuers" resolves to the first group serving it
+    mock_k8s_utils.get_cluster_scoped_resources.return_value = {
+        "nodes": MagicMock(),
+        "ciliumidentities.cilium.io": MagicMock(),
+        "clusterroles.rbac.authorization.k8s.io": MagicMock(),
+        "issuers.cert-manager.io": MagicMock(),
+        "issuers.acme.example.com": MagicMock(),
+    }
+    mock_k8s_utils.count_objects.side_effect = [20000, 80, 3, 2, 10]
+    ctx = testing.Context(InfraBackupOperatorCharm)
+
+    ctx.run(
+        ctx.on.action("count-cluster-resources"),
+        testing.State(config={"cluster-resources-exclude": "issuers"}),
+    )
+
+    assert ctx.action_results == {
+        "resources": {
+            "ciliumidentities.cilium.io": {"objects": 20000, "backed-up": False},
+            "clusterroles.rbac.authorization.k8s.io": {"objects": 80, "backed-up": True},
+            "issuers.acme.example.com": {"objects": 3, "backed-up": True},
+            "issuers.cert-manager.io": {"objects": 2, "backed-up": False},
+            "nodes": {"objects": 10, "backed-up": False},
+        },
+        "backed-up-objects": 83,
+        "excluded-objects": 20012,
+    }
+
+
+def test_count_cluster_resources_action_error(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.get_cluster_scoped_resources.side_effect = K8sUtilsError("forbidden")
+    ctx = testing.Context(InfraBackupOperatorCharm)
+
+    with pytest.raises(testing.ActionFailed, match="forbidden"):
+        ctx.run(ctx.on.action("count-cluster-resources"), testing.State())
+
+
+def test_prune_empty_namespaces(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces(
+        "kube-system", "kube-public", "metallb-system"
+    )
+    deployments, roles = MagicMock(), MagicMock()
+    mock_k8s_utils.get_namespaced_resources.return_value = {
+        "deployments": deployments,
+        "roles": roles,
+    }
+    objects = {"kube-system": 4, "kube-public": 0, "metallb-system": 2}
+    mock_k8s_utils.count_objects.side_effect = lambda resource, namespace: objects[namespace]
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True, relations=[cluster], config={"prune-empty-namespaces": True}
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert spec["include_namespaces"] == ["kube-system", "metallb-system"]
+    # roles are backed up by namespaced-infra-backup, so they are not counted
+    assert {call.args[0] for call in mock_k8s_utils.count_objects.call_args_list} == {deployments}
+
+    # the empty namespace is cached too, and is added back once its count expired
+    mock_k8s_utils.count_objects.reset_mock()
+    objects["kube-public"] = 1
+    state_out = ctx.run(ctx.on.update_status(), state_out)
+    mock_k8s_utils.count_objects.assert_not_called()
+
+    state_in = dataclasses.replace(
+        state_out, config={"prune-empty-namespaces": True, "namespace-content-cache": "0s"}
+    )
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert spec["include_namespaces"] == ["kube-public", "kube-system", "metallb-system"]
+
+
+def test_prune_empty_namespaces_all_empty(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "kube-public")
+    mock_k8s_utils.get_namespaced_resources.return_value = {"deployments": MagicMock()}
+    mock_k8s_utils.count_objects.return_value = 0
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True, relations=[cluster], config={"prune-empty-namespaces": True}
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    # an empty include_namespaces would back up every namespace
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert spec["include_namespaces"] == ["kube-public", "kube-system"]
+
+
+def test_prune_empty_namespaces_count_failure(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system")
+    mock_k8s_utils.get_namespaced_resources.side_effect = K8sUtilsError("forbidden")
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True, relations=[cluster], config={"prune-empty-namespaces": True}
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert spec["include_namespaces"] == ["kube-system"]
+
+
+def budget_namespaces(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces(
+        "kube-system", "kube-public", "metallb-system"
+    )
+    mock_k8s_utils.get_namespaced_resources.return_value = {"deployments": MagicMock()}
+    objects = {"kube-system": 4, "kube-public": 0, "metallb-system": 2}
+    mock_k8s_utils.count_objects.side_effect = lambda resource, namespace: objects[namespace]
+
+
+def test_backup_budget_block(mock_k8s_utils: MagicMock, tmp_path: Path) -> None:
+    budget_namespaces(mock_k8s_utils)
+    metrics_file = tmp_path / "metrics.prom"
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[cluster],
+        config={"backup-budget-objects": 6, "metrics-textfile": str(metrics_file)},
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+    published = app_data(state_out, cluster)["spec"]
+    assert json.loads(published)["include_namespaces"] == [
+        "kube-public",
+        "kube-system",
+        "metallb-system",
+    ]
+    assert "infra_backup_estimated_min_objects 6" in metrics_file.read_text()
+    assert f"infra_backup_estimated_min_bytes {6 * 4096}" in metrics_file.read_text()
+
+    # the spec published before is kept
+    state_out = ctx.run(
+        ctx.on.config_changed(),
+        dataclasses.replace(state_out, config={**state_in.config, "backup-budget-size": "16Ki"}),
+    )
+    assert app_data(state_out, cluster)["spec"] == published
+    assert state_out.unit_status == testing.BlockedStatus(
+        f"{CLUSTER_INFRA_BACKUP} over budget: at least 6 namespaced objects, 4 allowed"
+    )
+
+
+def test_backup_budget_cap(mock_k8s_utils: MagicMock) -> None:
+    budget_namespaces(mock_k8s_utils)
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[cluster, Relation(endpoint=NAMESPACED_INFRA_BACKUP)],
+        config={
+            "backup-budget-objects": 5,
+            "backup-budget-action": "cap",
+            "prune-empty-namespaces": True,
+        },
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert spec["include_namespaces"] == ["metallb-system"]
+    assert state_out.unit_status == testing.ActiveStatus(
+        "Over backup budget, left out: kube-system"
+    )
+
+
+def test_backup_budget_cap_nothing_fits(mock_k8s_utils: MagicMock) -> None:
+    budget_namespaces(mock_k8s_utils)
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    config: dict[str, str | int | float | bool] = {
+        "backup-budget-action": "cap",
+        "prune-empty-namespaces": True,
+    }
+    state_out = ctx.run(
+        ctx.on.update_status(), testing.State(leader=True, relations=[cluster], config=config)
+    )
+    published = app_data(state_out, cluster)["spec"]
+
+    state_out = ctx.run(
+        ctx.on.config_changed(),
+        dataclasses.replace(state_out, config={**config, "backup-budget-objects": 1}),
+    )
+
+    # an empty include_namespaces would back up every namespace
+    assert app_data(state_out, cluster)["spec"] == published
+    assert state_out.unit_status == testing.BlockedStatus(
+        f"{CLUSTER_INFRA_BACKUP} over budget: at least 6 namespaced objects, 1 allowed, "
+        "no namespace fits"
+    )
+
+
+@pytest.mark.parametrize(
+    "option, value, exp_msg",
+    [
+        ("backup-budget-objects", -1, "Invalid backup-budget-objects: '-1'"),
+        ("backup-budget-size", "2GB", "Invalid backup-budget-size: '2GB'"),
+        ("backup-budget-action", "drop", "Invalid backup-budget-action: 'drop'"),
+    ],
+    ids=["negative objects", "invalid size unit", "unknown action"],
+)
+def test_wrong_backup_budget_config(option: str, value: str | int, exp_msg: str) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(config={option: value}))
+    assert state_out.unit_status == testing.BlockedStatus(exp_msg)
+
+
+def test_namespace_ttl_tiers(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces(
+        "kube-system", "kube-public", "metallb-system", "team-a", "team-b"
+    )
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    tier_1 = Relation(endpoint=TTL_TIER_ENDPOINTS[0])
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[cluster, tier_1],
+        config={
+            "namespaces": "kube-system, kube-public, metallb-system, team-a, team-b",
+            "cluster-infra-backup-ttl": "2160h",
+            "namespace-ttl-tiers": "kube-public, metallb-*=72h; team-*=168h",
+        },
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    cluster_spec = json.loads(app_data(state_out, cluster)["spec"])
+    tier_spec = json.loads(app_data(state_out, tier_1)["spec"])
+    # the second tier is not related, its namespaces stay in cluster-infra-backup
+    assert cluster_spec["include_namespaces"] == ["kube-system", "team-a", "team-b"]
+    assert cluster_spec["include_cluster_resources"] is True
+    assert cluster_spec["ttl"] == "2160h"
+    assert tier_spec["include_namespaces"] == ["kube-public", "metallb-system"]
+    assert tier_spec["include_cluster_resources"] is False
+    assert tier_spec["exclude_resources"] == cluster_spec["exclude_resources"]
+    assert tier_spec["ttl"] == "72h"
+
+    tier_2 = Relation(endpoint=TTL_TIER_ENDPOINTS[1])
+    state_out = ctx.run(
+        ctx.on.relation_created(tier_2),
+        dataclasses.replace(state_out, relations=state_out.relations | {tier_2}),
+    )
+
+    cluster_spec = json.loads(app_data(state_out, cluster)["spec"])
+    tier_spec = json.loads(app_data(state_out, tier_2)["spec"])
+    assert cluster_spec["include_namespaces"] == ["kube-system"]
+    assert tier_spec["include_namespaces"] == ["team-a", "team-b"]
+    assert tier_spec["ttl"] == "168h"
+
+
+def test_namespace_ttl_tiers_removed(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "kube-public")
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    tier_1 = Relation(endpoint=TTL_TIER_ENDPOINTS[0])
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    config: dict[str, str | int | float | bool] = {"namespaces": "kube-system, kube-public"}
+    state_in = testing.State(
+        leader=True,
+        relations=[cluster, tier_1],
+        config={**config, "namespace-ttl-tiers": "kube-public=72h"},
+    )
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+    tier_data: dict[str, str] = dict(app_data(state_out, tier_1))
+    assert json.loads(tier_data["spec"])["include_namespaces"] == ["kube-public"]
+
+    state_out = ctx.run(ctx.on.config_changed(), dataclasses.replace(state_out, config=config))
+
+    # the namespaces of the tier are back in cluster-infra-backup, and only there
+    cluster_data: dict[str, str] = dict(app_data(state_out, cluster))
+    assert json.loads(cluster_data["spec"])["include_namespaces"] == ["kube-public", "kube-system"]
+    assert not app_data(state_out, tier_1)
+
+
+def test_namespace_ttl_tiers_keep_cluster_namespaces(
+    mock_k8s_utils: MagicMock, caplog: pytest.LogCaptureFixture
+) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system")
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    tier_1 = Relation(endpoint=TTL_TIER_ENDPOINTS[0])
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True, relations=[cluster, tier_1], config={"namespace-ttl-tiers": "*=72h"}
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    # an empty include_namespaces would back up every namespace
+    cluster_spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert cluster_spec["include_namespaces"] == ["kube-system"]
+    assert "spec" not in app_data(state_out, tier_1)
+    assert f"{TTL_TIER_ENDPOINTS[0]} would take every namespace" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "option, value, exp_msg",
+    [
+        ("cluster-infra-backup-ttl", "3d", "Invalid cluster-infra-backup-ttl: '3d'"),
+        ("namespace-ttl-tiers", "team-*", "Invalid namespace-ttl-tiers: 'team-*'"),
+        ("namespace-ttl-tiers", "=72h", "Invalid namespace-ttl-tiers: '=72h'"),
+        ("namespace-ttl-tiers", "team-*=1w", "Invalid namespace-ttl-tiers: 'team-*=1w'"),
+        ("namespace-ttl-tiers", "Team-*=72h", "Invalid namespace-ttl-tiers: 'Team-*'"),
+        (
+            "namespace-ttl-tiers",
+            "a=1h; b=2h; c=3h; d=4h",
+            "Invalid namespace-ttl-tiers: at most 3 tiers",
+        ),
+    ],
+    ids=[
+        "invalid cluster ttl",
+        "tier without ttl",
+        "tier without namespaces",
+        "invalid tier ttl",
+        "invalid tier namespace",
+        "too many tiers",
+    ],
+)
+def test_wrong_ttl_tiers_config(option: str, value: str, exp_msg: str) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(config={option: value}))
+    assert state_out.unit_status == testing.BlockedStatus(exp_msg)
+
+
+def test_deduplicate_replicas(mock_k8s_utils: MagicMock, tmp_path: Path) -> None:
+    ca_bundle = ConfigMap(
+        metadata=ObjectMeta(name="ca", namespace="cert-manager", creationTimestamp=CREATED),
+        data={"ca.crt": "x"},
+    )
+    copy = ConfigMap(
+        metadata=ObjectMeta(
+            name="ca",
+            namespace="team-a",
+            annotations={SOURCE_ANNOTATIONS[0]: "cert-manager/ca"},
+        ),
+        data={"ca.crt": "x"},
+    )
+    mock_k8s_utils.iter_all_objects.side_effect = lambda resource: iter(
+        [ca_bundle, copy] if resource is ConfigMap else []
+    )
+    metrics_file = tmp_path / "metrics.prom"
+    namespaced = Relation(
+        endpoint=NAMESPACED_INFRA_BACKUP,
+        remote_app_data={LIBPATCH_FIELD: str(EXCLUDE_LABELS_LIBPATCH)},
+    )
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[namespaced],
+        config={"deduplicate-replicas": True, "metrics-textfile": str(metrics_file)},
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    mock_k8s_utils.patch_metadata.assert_called_once_with(
+        ConfigMap,
+        "ca",
+        "team-a",
+        labels={REPLICA_LABEL: "true"},
+        annotations={REPLICA_ANNOTATION: "cert-manager/ca"},
+    )
+    assert 'infra_backup_replicated_objects{resource="configmaps"} 1' in metrics_file.read_text()
+    # the replicas are left out of the charm backups only
+    spec = json.loads(app_data(state_out, namespaced)["spec"])
+    assert spec["exclude_labels"] == EXCLUDE_LABELS
+
+    # the replicas are not searched again before deduplicate-interval
+    mock_k8s_utils.iter_all_objects.reset_mock()
+    state_out = ctx.run(ctx.on.update_status(), state_out)
+    mock_k8s_utils.iter_all_objects.assert_not_called()
+
+    # disabling the option backs the replicas up again
+    copy.metadata = ObjectMeta(
+        name="ca",
+        namespace="team-a",
+        labels={REPLICA_LABEL: "true"},
+        annotations={
+            SOURCE_ANNOTATIONS[0]: "cert-manager/ca",
+            REPLICA_ANNOTATION: "cert-manager/ca",
+        },
+    )
+    mock_k8s_utils.patch_metadata.reset_mock()
+    state_in = dataclasses.replace(state_out, config={"metrics-textfile": str(metrics_file)})
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    mock_k8s_utils.patch_metadata.assert_called_once_with(
+        ConfigMap,
+        "ca",
+        "team-a",
+        labels={REPLICA_LABEL: None},
+        annotations={REPLICA_ANNOTATION: None},
+    )
+    assert "infra_backup_replicated_objects" not in metrics_file.read_text()
+    spec = json.loads(app_data(state_out, namespaced)["spec"])
+    assert spec["exclude_labels"] is None
+
+
+@pytest.mark.parametrize(
+    "remote_app_data",
+    [{}, {LIBPATCH_FIELD: str(EXCLUDE_LABELS_LIBPATCH - 1)}],
+    ids=["not advertised", "older library"],
+)
+def test_deduplicate_replicas_unsupported_requirer(
+    mock_k8s_utils: MagicMock, remote_app_data: dict[str, str], caplog: pytest.LogCaptureFixture
+) -> None:
+    namespaced = Relation(endpoint=NAMESPACED_INFRA_BACKUP, remote_app_data=remote_app_data)
+    volatile = Relation(
+        endpoint=VOLATILE_INFRA_BACKUP,
+        remote_app_data={LIBPATCH_FIELD: str(EXCLUDE_LABELS_LIBPATCH)},
+    )
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True, relations=[namespaced, volatile], config={"deduplicate-replicas": True}
+    )
+
+    ctx.run(ctx.on.update_status(), state_in)
+
+    # the replicas would still be backed up by the requirer, so no savings are reported
+    mock_k8s_utils.iter_all_objects.assert_not_called()
+    mock_k8s_utils.patch_metadata.assert_not_called()
+    assert "does not apply the exclude_labels" in caplog.text
+
+
+def test_deduplicate_replicas_not_leader(mock_k8s_utils: MagicMock) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(leader=False, config={"deduplicate-replicas": True})
+
+    ctx.run(ctx.on.update_status(), state_in)
+
+    mock_k8s_utils.iter_all_objects.assert_not_called()
+
+
+def test_leader_snapshot_shared(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "default")
+    peers = testing.PeerRelation(endpoint=PEERS)
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(leader=True, relations=[peers, cluster])
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+
+    raw = app_data(state_out, peers)["snapshot"]
+    snapshot = LeaderSnapshot.from_json(raw)
+    assert snapshot.selected_namespaces == ["kube-system"]
+    assert snapshot.resource_version == "1"
+    assert snapshot.spec_digests.keys() == {
+        CLUSTER_INFRA_BACKUP,
+        NAMESPACED_INFRA_BACKUP,
+        VOLATILE_INFRA_BACKUP,
+    }
+
+    # an unchanged snapshot is not written again until it needs refreshing
+    state_out = ctx.run(ctx.on.update_status(), state_out)
+    assert app_data(state_out, peers)["snapshot"] == raw
+
+
+def test_leader_snapshot_not_rewritten_by_recount(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "kube-public")
+    mock_k8s_utils.get_namespaced_resources.return_value = {"deployments": MagicMock()}
+    mock_k8s_utils.count_objects.side_effect = lambda _, namespace: int(namespace == "kube-system")
+    peers = testing.PeerRelation(endpoint=PEERS)
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        relations=[peers, cluster],
+        config={"prune-empty-namespaces": True, "namespace-content-cache": "0s"},
+    )
+
+    state_out = ctx.run(ctx.on.update_status(), state_in)
+    raw = app_data(state_out, peers)["snapshot"]
+
+    # the expired counts are counted again on every hook, which alone does not rewrite it
+    mock_k8s_utils.count_objects.reset_mock()
+    state_out = ctx.run(ctx.on.update_status(), state_out)
+    assert mock_k8s_utils.count_objects.call_count == 2
+    assert app_data(state_out, peers)["snapshot"] == raw
+
+
+def test_leader_snapshot_adopted(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "default")
+    peers = testing.PeerRelation(endpoint=PEERS)
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_out = ctx.run(
+        ctx.on.update_status(), testing.State(leader=True, relations=[peers, cluster])
+    )
+    published = app_data(state_out, cluster)
+
+    mock_k8s_utils.list_namespaces.reset_mock()
+    state_out = ctx.run(ctx.on.leader_elected(), state_out)
+
+    mock_k8s_utils.list_namespaces.assert_not_called()
+    assert app_data(state_out, cluster) == published
+
+
+@pytest.mark.parametrize(
+    "snapshot_age, config, extra_relations, exp_namespaces",
+    [
+        (LEADER_SNAPSHOT_MAX_AGE, {}, [], ["kube-system"]),
+        (0, {"namespaces": "kube-system, default"}, [], ["default", "kube-system"]),
+        (0, {}, [Relation(endpoint=VOLATILE_INFRA_BACKUP)], ["kube-system"]),
+    ],
+    ids=[
+        "stale snapshot",
+        "config changed since the snapshot",
+        "specs changed since the snapshot",
+    ],
+)
+def test_leader_snapshot_not_adopted(
+    mock_k8s_utils: MagicMock,
+    snapshot_age: int,
+    config: dict[str, str],
+    extra_relations: list[Relation],
+    exp_namespaces: list[str],
+) -> None:
+    mock_k8s_utils.list_namespaces.return_value = namespaces("kube-system", "default")
+    peers = testing.PeerRelation(endpoint=PEERS)
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_out = ctx.run(
+        ctx.on.update_status(), testing.State(leader=True, relations=[peers, cluster])
+    )
+    snapshot = LeaderSnapshot.from_json(app_data(state_out, peers)["snapshot"])
+    aged = dataclasses.replace(snapshot, taken_at=snapshot.taken_at - snapshot_age)
+    peers = dataclasses.replace(peers, local_app_data={"snapshot": aged.to_json()})
+    state_in = dataclasses.replace(
+        state_out,
+        config=config,
+        relations=frozenset([peers, state_out.get_relation(cluster.id), *extra_relations]),
+    )
+
+    mock_k8s_utils.list_namespaces.reset_mock()
+    state_out = ctx.run(ctx.on.leader_elected(), state_in)
+
+    mock_k8s_utils.list_namespaces.assert_called_once()
+    spec = json.loads(app_data(state_out, cluster)["spec"])
+    assert spec["include_namespaces"] == exp_namespaces
+
+
+def test_flow_control(mock_k8s_utils: MagicMock) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    config: dict[str, str | int | float | bool] = {
+        "flow-control": True,
+        "flow-control-concurrency-shares": 3,
+        "flow-control-service-accounts": "velero/velero",
+    }
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(leader=True, config=config))
+
+    mock_k8s_utils.has_api.assert_called_with("flowcontrol.apiserver.k8s.io/v1")
+    level, schema = (call.args[0] for call in mock_k8s_utils.apply.call_args_list)
+    assert level.spec.limited.nominalConcurrencyShares == 3
+    assert [subject.serviceAccount.namespace for subject in schema.spec.rules[0].subjects] == [
+        state_out.model.name,
+        "velero",
+    ]
+    assert level.metadata.name == schema.metadata.name
+
+    # disabling the option deletes the objects
+    ctx.run(ctx.on.config_changed(), dataclasses.replace(state_out, config={}))
+    assert {call.args[0] for call in mock_k8s_utils.delete.call_args_list} == {
+        FlowSchema,
+        PriorityLevelConfiguration,
+    }
+
+
+def test_flow_control_deleted_by_new_leader(mock_k8s_utils: MagicMock) -> None:
+    # the objects were applied by the previous leader, this unit never applied them
+    mock_k8s_utils.exists.side_effect = lambda resource, _: resource is FlowSchema
+    ctx = testing.Context(InfraBackupOperatorCharm)
+
+    ctx.run(ctx.on.leader_elected(), testing.State(leader=True))
+
+    assert {call.args[0] for call in mock_k8s_utils.delete.call_args_list} == {
+        FlowSchema,
+        PriorityLevelConfiguration,
+    }
+
+
+def test_flow_control_never_enabled(mock_k8s_utils: MagicMock) -> None:
+    mock_k8s_utils.exists.return_value = False
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    ctx.run(ctx.on.config_changed(), testing.State(leader=True))
+    config: dict[str, str | bool] = {
+        "flow-control": True,
+        "flow-control-service-accounts": "velero/velero",
+    }
+    ctx.run(ctx.on.config_changed(), testing.State(leader=False, config=config))
+
+    mock_k8s_utils.apply.assert_not_called()
+    mock_k8s_utils.delete.assert_not_called()
+
+
+def test_flow_control_unsupported_cluster(mock_k8s_utils: MagicMock, tmp_path: Path) -> None:
+    mock_k8s_utils.has_api.return_value = False
+    mock_k8s_utils.exists.return_value = False
+    metrics_file = tmp_path / "metrics.prom"
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(
+        leader=True,
+        config={
+            "flow-control": True,
+            "flow-control-service-accounts": "velero/velero",
+            "metrics-textfile": str(metrics_file),
+        },
+    )
+
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+    ctx.run(ctx.on.config_changed(), dataclasses.replace(state_out, config={}))
+
+    mock_k8s_utils.has_api.assert_called_once()
+    mock_k8s_utils.apply.assert_not_called()
+    mock_k8s_utils.delete.assert_not_called()
+    assert 'operation="flow_control"' not in metrics_file.read_text()
+
+
+@pytest.mark.parametrize(
+    "option, value, exp_msg",
+    [
+        (
+            "flow-control-concurrency-shares",
+            0,
+            "Invalid flow-control-concurrency-shares: '0'",
+        ),
+        (
+            "flow-control-service-accounts",
+            "velero/velero, velero",
+            "Invalid flow-control-service-accounts: 'velero'",
+        ),
+        (
+            "flow-control",
+            True,
+            "Missing flow-control-service-accounts, e.g. Velero's 'velero/velero'",
+        ),
+    ],
+    ids=["no concurrency shares", "service account without namespace", "no service account"],
+)
+def test_wrong_flow_control_config(option: str, value: str | int, exp_msg: str) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(config={option: value}))
+    assert state_out.unit_status == testing.BlockedStatus(exp_msg)
+
+
+def test_profile_reconcile(mock_k8s_utils: MagicMock, tmp_path: Path) -> None:
+    # the namespaces listed by the profiled reconcile differ from the ones of the charm setup
+    mock_k8s_utils.list_namespaces.side_effect = [
+        namespaces("kube-system"),
+        namespaces("kube-system", "metallb-system"),
+    ]
+    pstats_file = tmp_path / "reconcile.pstats"
+    cluster = Relation(endpoint=CLUSTER_INFRA_BACKUP)
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    state_in = testing.State(leader=True, relations=[cluster])
+
+    state_out = ctx.run(
+        ctx.on.action("profile-reconcile", params={"pstats-file": str(pstats_file)}), state_in
+    )
+
+    assert ctx.action_results
+    assert ctx.action_results["pstats-file"] == str(pstats_file)
+    assert pstats.Stats(str(pstats_file)).get_stats_profile().func_profiles
+    assert ctx.action_results["k8s-api-calls"].keys() == {
+        "calls",
+        "total-seconds",
+        "mean-seconds",
+    }
+    assert ctx.action_results["hook-tool-calls"].keys() == {
+        "calls",
+        "total-seconds",
+        "mean-seconds",
+    }
+    assert "function calls" in ctx.action_results["hot-functions"]
+    # the reconcile lists the namespaces again, besides the charm setup
+    assert mock_k8s_utils.list_namespaces.call_count == 2
+    # but neither the stored state nor the relation data are changed by it
+    stored = state_out.get_stored_state("_stored", owner_path="InfraBackupOperatorCharm")
+    assert stored.content["namespace_selection"]["published"] == ["kube-system"]
+    assert not app_data(state_out, cluster)
+
+
+def test_profile_reconcile_dump_failure(tmp_path: Path) -> None:
+    ctx = testing.Context(InfraBackupOperatorCharm)
+    action = ctx.on.action(
+        "profile-reconcile", params={"pstats-file": str(tmp_path / "missing" / "profile")}
+    )
+
+    with pytest.raises(testing.ActionFailed, match="Failed to save the profile"):
+        ctx.run(action, testing.State(leader=True))
@@ -0,0 +1,207 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Cost of propagating a cluster or config change to the spec seen by velero-operator.
+
+The charm runs against a fake apiserver, and its relation data is read by a simulated
+velero-operator with VeleroBackupRequier, as after a relation-changed. After each change, Juju
+hooks are dispatched until the requirer sees the updated spec: the config-changed of a config
+change, then hooks drawn at random from BACKGROUND_HOOKS, as Juju runs them on a quiet model.
+
+The hooks and apiserver requests until convergence are counted over RUNS seeded runs, which
+differ by the cluster size, the change and the hooks dispatched. Their p95 must stay within the
+budgets below, so a change that misses a hook or lists the cluster more often fails, whatever the
+speed of the runner. The wall-clock latency on a real deployment is the number of hooks times
+the update-status-hook-interval at worst.
+"""
+
+import dataclasses
+import random
+import statistics
+from collections.abc import Callable
+from typing import Any, NamedTuple, Optional
+
+import ops
+import pytest
+from charms.velero_libs.v0.velero_backup_config import VeleroBackupRequier, VeleroBackupSpec
+from fake_apiserver import FakeApiServer
+from ops import testing
+
+from charm import InfraBackupOperatorCharm
+from literals import CLUSTER_INFRA_BACKUP, NAMESPACED_INFRA_BACKUP, PEERS
+
+RUNS = 20
+# Hooks after which a change that is still not seen fails the run
+MAX_HOOKS = 30
+# Hooks of a quiet model with their weights, update-status being the most frequent one
+BACKGROUND_HOOKS = {
+    "update-status": 3,
+    "leader-elected": 1,
+    "peer-relation-changed": 1,
+    "velero-relation-changed": 1,
+}
+# p95 budgets, a new namespace is seen on the next update-status while a config change is
+# published by its config-changed. Each hook lists the namespaces once, and config-changed and
+# leader-elected also check that the flow control objects of a disabled flow-control are gone
+NAMESPACE_HOOKS_P95_BUDGET = 5
+NAMESPACE_REQUESTS_P95_BUDGET = 7
+CONFIG_HOOKS_P95_BUDGET = 1
+CONFIG_REQUESTS_P95_BUDGET = 3
+VELERO_APP = "velero-operator"
+VELERO_ENDPOINT = "velero-backups"
+VELERO_META = {
+    "name": VELERO_APP,
+    "requires": {VELERO_ENDPOINT: {"interface": "velero_backup_config"}},
+}
+
+
+class VeleroCharm(ops.CharmBase):
+    def __init__(self, framework: ops.Framework) -> None:
+        super().__init__(framework)
+        self.requirer = VeleroBackupRequier(self, VELERO_ENDPOINT)
+
+
+class Convergence(NamedTuple):
+    """Hooks and apiserver requests until the requirer saw a change."""
+
+    hooks: int
+    requests: int
+
+
+class ConvergenceHarness:
+    """Drive the charm and read its specs back as velero-operator would."""
+
+    def __init__(
+        self, apiserver: FakeApiServer, rng: random.Random, config: dict[str, str]
+    ) -> None:
+        self.apiserver = apiserver
+        self.rng = rng
+        self.ctx = testing.Context(InfraBackupOperatorCharm)
+        self.velero_ctx = testing.Context(VeleroCharm, meta=VELERO_META)
+        self.relations = {
+            endpoint: testing.Relation(endpoint, remote_app_name=VELERO_APP)
+            for endpoint in [CLUSTER_INFRA_BACKUP, NAMESPACED_INFRA_BACKUP]
+        }
+        self.peers = testing.PeerRelation(PEERS, peers_data={1: {}})
+        self.state = testing.State(
+            leader=True, config=config, relations=[*self.relations.values(), self.peers]
+        )
+        self.state = self.ctx.run(self.ctx.on.config_changed(), self.state)
+
+    def configure(self, **options: str) -> None:
+        self.state = dataclasses.replace(self.state, config={**self.state.config, **options})
+
+    def background_hook(self) -> Any:
+        """Draw the next hook dispatched by Juju on a quiet model."""
+        [hook] = self.rng.choices(list(BACKGROUND_HOOKS), weights=list(BACKGROUND_HOOKS.values()))
+        if hook == "update-status":
+            return self.ctx.on.update_status()
+        if hook == "leader-elected":
+            return self.ctx.on.leader_elected()
+        if hook == "peer-relation-changed":
+            peers = self.state.get_relation(self.peers.id)
+            return self.ctx.on.relation_changed(peers, remote_unit=1)
+        velero = self.state.get_relation(self.relations[CLUSTER_INFRA_BACKUP].id)
+        return self.ctx.on.relation_changed(velero, remote_unit=0)
+
+    def observed_spec(self, endpoint: str) -> Optional[VeleroBackupSpec]:
+        """Read the spec of an endpoint with the requirer, on its relation-changed."""
+        databag = self.state.get_relation(self.relations[endpoint].id).local_app_data
+        relation = testing.Relation(
+            VELERO_ENDPOINT,
+            remote_app_name=self.ctx.app_name,
+            remote_app_data=dict(databag),
+        )
+        state = testing.State(relations=[relation])
+        with self.velero_ctx(self.velero_ctx.on.relation_changed(relation), state) as manager:
+            manager.run()
+            return manager.charm.requirer.get_backup_spec(
+                self.ctx.app_name, endpoint, self.state.model.name
+            )
+
+    def converge(
+        self,
+        endpoint: str,
+        converged: Callable[[VeleroBackupSpec], bool],
+        first_hook: Optional[Callable[[], Any]] = None,
+    ) -> Convergence:
+        """Dispatch hooks until the requirer sees the expected spec.
+
+        Args:
+            endpoint: The endpoint whose spec is read by the requirer.
+            converged: Whether the spec seen by the requirer includes the change.
+            first_hook: The hook triggered by the change, followed by the background hooks.
+
+        Returns:
+            Convergence: The hooks and apiserver requests until the change was seen.
+        """
+        requests = len(self.apiserver.requests)
+        for hooks in range(1, MAX_HOOKS + 1):
+            event = first_hook() if first_hook and hooks == 1 else self.background_hook()
+            self.state = self.ctx.run(event, self.state)
+            spec = self.observed_spec(endpoint)
+            if spec and converged(spec):
+                return Convergence(hooks, len(self.apiserver.requests) - requests)
+        pytest.fail(f"{endpoint} did not converge after {MAX_HOOKS} hooks: {spec}")
+
+
+def includes_namespace(namespace: str) -> Callable[[VeleroBackupSpec], bool]:
+    return lambda spec: namespace in (spec.include_namespaces or [])
+
+
+def has_ttl(ttl: str) -> Callable[[VeleroBackupSpec], bool]:
+    return lambda spec: spec.ttl == ttl
+
+
+def p95(name: str, samples: list[int]) -> float:
+    """Report the p50 and p95 of the samples, and return the p95."""
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    print(f"\n{name} over {len(samples)} runs: p50={cuts[49]:g} p95={cuts[94]:g}")
+    return cuts[94]
+
+
+def create_cluster(apiserver: FakeApiServer, rng: random.Random) -> None:
+    apiserver.namespaces.clear()
+    for namespace in ["kube-system", "kube-public", "default"]:
+        apiserver.create_namespace(namespace)
+    for index in range(rng.randint(0, 20)):
+        apiserver.create_namespace(f"app-{index}")
+
+
+def test_namespace_creation_convergence(apiserver: FakeApiServer) -> None:
+    runs = []
+    for seed in range(RUNS):
+        rng = random.Random(seed)
+        create_cluster(apiserver, rng)
+        harness = ConvergenceHarness(apiserver, rng, {"namespaces": "kube-system,team-new"})
+        # a few hooks before the namespace is created, e.g. after leadership changed
+        for _ in range(rng.randint(0, 3)):
+            harness.state = harness.ctx.run(harness.background_hook(), harness.state)
+
+        apiserver.create_namespace("team-new")
+        runs.append(harness.converge(CLUSTER_INFRA_BACKUP, includes_namespace("team-new")))
+
+    assert p95("namespace hooks", [run.hooks for run in runs]) <= NAMESPACE_HOOKS_P95_BUDGET
+    requests = p95("namespace requests", [run.requests for run in runs])
+    assert requests <= NAMESPACE_REQUESTS_P95_BUDGET
+
+
+def test_config_change_convergence(apiserver: FakeApiServer) -> None:
+    runs = []
+    for seed in range(RUNS):
+        rng = random.Random(seed)
+        create_cluster(apiserver, rng)
+        harness = ConvergenceHarness(apiserver, rng, {"namespaces": "kube-system"})
+
+        if rng.random() < 0.5:
+            namespace = rng.choice(apiserver.namespaces)
+            harness.configure(namespaces=f"kube-system,{namespace}")
+            endpoint, converged = CLUSTER_INFRA_BACKUP, includes_namespace(namespace)
+        else:
+            ttl = f"{rng.randint(1, 720)}h"
+            harness.configure(**{"namespaced-infra-backup-ttl": ttl})
+            endpoint, converged = NAMESPACED_INFRA_BACKUP, has_ttl(ttl)
+        runs.append(harness.converge(endpoint, converged, harness.ctx.on.config_changed))
+
+    assert p95("config hooks", [run.hooks for run in runs]) <= CONFIG_HOOKS_P95_BUDGET
+    requests = p95("config requests", [run.requests for run in runs])
+    assert requests <= CONFIG_REQUESTS_P95_BUDGET
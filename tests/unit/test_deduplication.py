@@ -0,0 +1,170 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+from typing import Optional
+from unittest.mock import MagicMock, call
+
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.core_v1 import ConfigMap, Secret
+
+from deduplication import (
+    REPLICA_ANNOTATION,
+    REPLICA_LABEL,
+    SOURCE_ANNOTATIONS,
+    TRUST_MANAGER_LABEL,
+    Deduplicator,
+    content_hash,
+    find_replicas,
+    replica_source,
+)
+
+SOURCE = "cert-manager/ca-bundle"
+
+
+def config_map(
+    namespace: str,
+    data: Optional[dict[str, str]],
+    source: Optional[str] = None,
+    replica_of: Optional[str] = None,
+    labels: Optional[dict[str, str]] = None,
+    name: str = "ca-bundle",
+) -> ConfigMap:
+    annotations = {}
+    if source:
+        annotations[SOURCE_ANNOTATIONS[0]] = source
+    if replica_of:
+        annotations[REPLICA_ANNOTATION] = replica_of
+    return ConfigMap(
+        metadata=ObjectMeta(
+            name=name, namespace=namespace, annotations=annotations, labels=labels
+        ),
+        data=data,
+    )
+
+
+def hashed(obj: ConfigMap) -> tuple[str, int]:
+    result = content_hash(obj)
+    assert result
+    return result
+
+
+def test_content_hash() -> None:
+    digest, size = hashed(config_map("a", {"ca.crt": "x", "b": "y"}))
+    assert (digest, size) == hashed(config_map("b", {"b": "y", "ca.crt": "x"}))
+    assert size > 0
+    assert hashed(config_map("a", {"ca.crt": "z"}))[0] != digest
+    assert content_hash(config_map("a", None)) is None
+
+
+def test_content_hash_secret_type() -> None:
+    opaque = Secret(metadata=ObjectMeta(name="s"), type="Opaque", data={"k": "dg=="})
+    tls = Secret(metadata=ObjectMeta(name="s"), type="kubernetes.io/tls", data={"k": "dg=="})
+    token = Secret(
+        metadata=ObjectMeta(name="s"),
+        type="kubernetes.io/service-account-token",
+        data={"k": "dg=="},
+    )
+    assert content_hash(opaque) != content_hash(tls)
+    assert content_hash(token) is None
+
+
+def test_replica_source() -> None:
+    pulled = ConfigMap(
+        metadata=ObjectMeta(name="ca-bundle", annotations={SOURCE_ANNOTATIONS[1]: SOURCE})
+    )
+
+    assert replica_source(config_map("team-a", {"ca.crt": "x"}, source=SOURCE)) == SOURCE
+    assert replica_source(pulled) == SOURCE
+    assert replica_source(config_map("team-a", {"ca.crt": "x"})) is None
+
+
+def test_find_replicas() -> None:
+    objects = [
+        config_map("cert-manager", {"ca.crt": "x"}),
+        config_map("team-a", {"ca.crt": "x"}, source=SOURCE),
+        # same content, but not marked by a replicator
+        config_map("team-b", {"ca.crt": "x"}),
+        # out of sync with its source
+        config_map("team-c", {"ca.crt": "other"}, source=SOURCE, replica_of=SOURCE),
+        config_map("team-d", {"ca.crt": "x"}, source="team-z/missing"),
+        config_map("team-e", {"ca.crt": "y"}, labels={TRUST_MANAGER_LABEL: "ca"}),
+    ]
+    replicas, labelled, bundle_targets = find_replicas(iter(objects))
+
+    assert {key: ref.source for key, ref in replicas.items()} == {"team-a/ca-bundle": SOURCE}
+    assert [ref.key for ref in labelled] == ["team-c/ca-bundle"]
+    assert [ref.key for ref in bundle_targets] == ["team-e/ca-bundle"]
+
+
+def test_find_replicas_source_not_backed_up() -> None:
+    objects = [
+        config_map("cert-manager", {"ca.crt": "x"}),
+        config_map("team-a", {"ca.crt": "x"}, source=SOURCE),
+    ]
+    replicas, _, _ = find_replicas(iter(objects), excluded_namespaces=["cert-manager"])
+
+    assert not replicas
+
+
+def test_deduplicate() -> None:
+    k8s_utils = MagicMock()
+    k8s_utils.iter_all_objects.return_value = iter(
+        [
+            config_map("cert-manager", {"ca.crt": "x"}),
+            config_map("team-a", {"ca.crt": "x"}, source=SOURCE),
+            config_map(
+                "team-b",
+                {"ca.crt": "x"},
+                source=SOURCE,
+                replica_of=SOURCE,
+                labels={REPLICA_LABEL: "true"},
+            ),
+            config_map("team-c", {"ca.crt": "changed"}, source=SOURCE, replica_of=SOURCE),
+            config_map("team-d", {"ca.crt": "x"}, labels={TRUST_MANAGER_LABEL: "ca"}),
+        ]
+    )
+    report = Deduplicator(k8s_utils).deduplicate(ConfigMap)
+
+    assert report.replicas == 3
+    assert report.bytes_saved == 3 * hashed(config_map("a", {"ca.crt": "x"}))[1]
+    assert report.excluded == 1
+    assert report.restored == 1
+    assert k8s_utils.patch_metadata.call_args_list == [
+        call(
+            ConfigMap,
+            "ca-bundle",
+            "team-c",
+            labels={REPLICA_LABEL: None},
+            annotations={REPLICA_ANNOTATION: None},
+        ),
+        call(
+            ConfigMap,
+            "ca-bundle",
+            "team-a",
+            labels={REPLICA_LABEL: "true"},
+            annotations={REPLICA_ANNOTATION: SOURCE},
+        ),
+    ]
+
+
+def test_restore() -> None:
+    k8s_utils = MagicMock()
+    k8s_utils.iter_all_objects.return_value = iter(
+        [
+            config_map("cert-manager", {"ca.crt": "x"}),
+            config_map(
+                "team-a",
+                {"ca.crt": "x"},
+                source=SOURCE,
+                replica_of=SOURCE,
+                labels={REPLICA_LABEL: "true"},
+            ),
+        ]
+    )
+    assert Deduplicator(k8s_utils).restore(ConfigMap) == 1
+    k8s_utils.patch_metadata.assert_called_once_with(
+        ConfigMap,
+        "ca-bundle",
+        "team-a",
+        labels={REPLICA_LABEL: None},
+        annotations={REPLICA_ANNOTATION: None},
+    )
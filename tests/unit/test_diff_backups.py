@@ -0,0 +1,98 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import json
+from pathlib import Path
+
+import pytest
+from fake_backups import velero_object, write_backup
+
+from diff_backups import Changes, diff_backups, main, object_digest
+from verify_backup import CLUSTER_SCOPE
+
+
+def with_content(item: tuple[str, dict], **content: object) -> tuple[str, dict]:
+    path, obj = item
+    metadata = {**obj["metadata"], **content.pop("metadata", {})}  # type: ignore[dict-item]
+    return path, {**obj, **content, "metadata": metadata}
+
+
+def test_object_digest_ignores_volatile_fields() -> None:
+    _, obj = velero_object("deployments.apps", "coredns", "kube-system")
+    _, written = with_content(
+        ("", obj),
+        metadata={"resourceVersion": "42", "managedFields": [{"manager": "kubectl"}]},
+        status={"replicas": 2},
+    )
+    _, recreated = with_content(
+        ("", obj),
+        metadata={
+            "uid": "6f1c1d0e-0b1e-4b8e-9d51-2f6a7c3e5b10",
+            "generation": 3,
+            "creationTimestamp": "2025-06-01T00:00:00Z",
+            "annotations": {"kubectl.kubernetes.io/last-applied-configuration": "{}"},
+        },
+    )
+    _, updated = with_content(("", obj), spec={"replicas": 3})
+    _, annotated = with_content(("", obj), metadata={"annotations": {"team": "infra"}})
+
+    digest = object_digest(json.dumps(obj).encode())
+    assert digest == object_digest(json.dumps(written).encode())
+    assert digest == object_digest(json.dumps(recreated).encode())
+    assert digest != object_digest(json.dumps(updated).encode())
+    assert digest != object_digest(json.dumps(annotated).encode())
+
+
+def make_backups(tmp_path: Path) -> tuple[Path, Path]:
+    old = write_backup(
+        tmp_path / "old.tar.gz",
+        with_content(velero_object("configmaps", "a", "kube-system"), data={"k": "1"}),
+        with_content(velero_object("configmaps", "b", "kube-system"), data={"k": "1"}),
+        velero_object("secrets", "c", "kube-system"),
+        velero_object("storageclasses.storage.k8s.io", "ceph"),
+    )
+    # written out of order, the objects are matched by name
+    new = write_backup(
+        tmp_path / "new.tar.gz",
+        velero_object("storageclasses.storage.k8s.io", "ceph"),
+        velero_object("secrets", "d", "kube-public"),
+        with_content(velero_object("configmaps", "b", "kube-system"), data={"k": "2"}),
+        with_content(
+            velero_object("configmaps", "a", "kube-system"),
+            data={"k": "1"},
+            metadata={"resourceVersion": "2"},
+        ),
+    )
+    return old, new
+
+
+def test_diff_backups(tmp_path: Path) -> None:
+    old, new = make_backups(tmp_path)
+
+    with old.open("rb") as old_file, new.open("rb") as new_file:
+        diff = diff_backups(old_file, new_file)
+
+    assert diff.kinds == {
+        "configmaps": Changes(modified=1, unchanged=1),
+        "secrets": Changes(added=1, removed=1),
+        "storageclasses.storage.k8s.io": Changes(unchanged=1),
+    }
+    assert diff.namespaces == {
+        "kube-system": Changes(removed=1, modified=1, unchanged=1),
+        "kube-public": Changes(added=1),
+        CLUSTER_SCOPE: Changes(unchanged=1),
+    }
+    assert diff.total == Changes(added=1, removed=1, modified=1, unchanged=2)
+    assert diff.total.changed == 3
+
+
+def test_main(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    old, new = make_backups(tmp_path)
+
+    assert main([str(old), str(new), "--json"]) == 0
+    diff = json.loads(capsys.readouterr().out)
+    assert diff["kinds"]["secrets"] == {"added": 1, "removed": 1, "modified": 0, "unchanged": 0}
+
+    assert main([str(old), str(new)]) == 0
+    assert "1 added, 1 removed, 1 modified, 2 unchanged objects" in capsys.readouterr().out
+
+    assert main([str(old), str(tmp_path / "missing.tar.gz")]) == 2
@@ -0,0 +1,84 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import pytest
+from fake_apiserver import FakeApiServer
+from lightkube.resources.flowcontrol_apiserver_v1 import FlowSchema, PriorityLevelConfiguration
+
+from flow_control import MATCHING_PRECEDENCE, flow_control_name, flow_schema, priority_level
+from k8s_utils import K8sUtils, K8sUtilsError
+
+API_PATH = "/apis/flowcontrol.apiserver.k8s.io/v1"
+
+
+def test_flow_control_name() -> None:
+    assert flow_control_name("infra-backup", "velero") == "velero-infra-backup-infra-backup"
+
+
+def test_matching_precedence() -> None:
+    # matched before the built-in flow schemas of the service accounts, e.g. Velero's
+    kube_system_service_accounts, service_accounts = 900, 9000
+    assert MATCHING_PRECEDENCE < kube_system_service_accounts < service_accounts
+    # but after the built-in ones of the system components, e.g. "kube-controller-manager"
+    assert MATCHING_PRECEDENCE > 800
+
+
+def test_apply_flow_control(apiserver: FakeApiServer) -> None:
+    utils = K8sUtils("infra-backup-operator")
+    utils.apply(priority_level("backup", 7))
+    utils.apply(flow_schema("backup", [("velero", "velero"), ("velero", "infra-backup")]))
+
+    assert all(
+        request.url.params["fieldManager"] == "infra-backup-operator"
+        and request.url.params["force"] == "true"
+        for request in apiserver.requests
+    )
+    limited = apiserver.objects[f"{API_PATH}/prioritylevelconfigurations/backup"]["spec"]
+    assert limited["type"] == "Limited"
+    assert limited["limited"]["nominalConcurrencyShares"] == 7
+    assert limited["limited"]["borrowingLimitPercent"] == 0
+
+    schema = apiserver.objects[f"{API_PATH}/flowschemas/backup"]["spec"]
+    assert schema["priorityLevelConfiguration"] == {"name": "backup"}
+    assert schema["matchingPrecedence"] == MATCHING_PRECEDENCE
+    (rule,) = schema["rules"]
+    assert [subject["serviceAccount"] for subject in rule["subjects"]] == [
+        {"namespace": "velero", "name": "velero"},
+        {"namespace": "velero", "name": "infra-backup"},
+    ]
+    assert rule["resourceRules"][0]["clusterScope"] is True
+
+
+def test_delete_flow_control(apiserver: FakeApiServer) -> None:
+    utils = K8sUtils("infra-backup-operator")
+    utils.apply(priority_level("backup", 7))
+
+    utils.delete(PriorityLevelConfiguration, "backup")
+    assert not apiserver.objects
+    # deleting objects that do not exist, e.g. removed by hand, is not an error
+    utils.delete(FlowSchema, "backup")
+
+
+def test_flow_control_exists(apiserver: FakeApiServer) -> None:
+    utils = K8sUtils("infra-backup-operator")
+    utils.apply(priority_level("backup", 7))
+
+    assert utils.exists(PriorityLevelConfiguration, "backup")
+    assert not utils.exists(FlowSchema, "backup")
+    apiserver.forbidden = True
+    with pytest.raises(K8sUtilsError, match="Failed to get flowschemas backup"):
+        utils.exists(FlowSchema, "backup")
+
+
+def test_flow_control_exists_api_not_served(apiserver: FakeApiServer) -> None:
+    # flowcontrol.apiserver.k8s.io/v1 is only served from Kubernetes 1.29
+    apiserver.missing_apis.add(API_PATH)
+    utils = K8sUtils("infra-backup-operator")
+
+    assert not utils.exists(FlowSchema, "backup")
+
+
+def test_apply_flow_control_error(apiserver: FakeApiServer) -> None:
+    apiserver.forbidden = True
+    utils = K8sUtils("infra-backup-operator")
+    with pytest.raises(K8sUtilsError, match="Failed to apply flowschemas backup"):
+        utils.apply(flow_schema("backup", []))
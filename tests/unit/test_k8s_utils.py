@@ -1,11 +1,17 @@
 # Copyright 2025 Canonical Ltd.
 # See LICENSE file for licensing details.
+from collections.abc import Callable
+from datetime import datetime, timezone
+from typing import Any, Optional
 from unittest.mock import MagicMock, patch
 
 import httpx
 import pytest
+from lightkube.core.generic_client import ListIterable
+from lightkube.resources.apps_v1 import Deployment
+from lightkube.resources.core_v1 import Node, Secret
 
-from k8s_utils import ApiError, K8sUtils, K8sUtilsError
+from k8s_utils import LIST_CHUNK_SIZE, ApiError, K8sUtils, K8sUtilsError, NamespaceInfo
 
 
 @pytest.fixture(autouse=True)
@@ -46,7 +52,7 @@ def test_get_namespaces(mock_lightkube_client: MagicMock) -> None:
     ns2 = MagicMock()
     ns2.metadata.name = "kube-system"
 
-    mock_lightkube_client.list.return_value = [ns1, ns2]
+    mock_lightkube_client.list.return_value = ListIterable(iter([("1", iter([ns1, ns2]))]))
     utils = K8sUtils("infra-backup-operator")
 
     assert utils.get_namespaces() == {"default", "kube-system"}
@@ -57,3 +63,227 @@ def test_get_namespaces_error(mock_lightkube_client: MagicMock) -> None:
     utils = K8sUtils("infra-backup-operator")
     with pytest.raises(K8sUtilsError):
         utils.get_namespaces()
+
+
+def test_list_namespaces(mock_lightkube_client: MagicMock) -> None:
+    created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    ns = MagicMock()
+    ns.metadata.name = "kube-system"
+    ns.metadata.creationTimestamp = created
+
+    mock_lightkube_client.list.return_value = ListIterable(iter([("42", iter([ns]))]))
+    utils = K8sUtils("infra-backup-operator")
+
+    assert utils.list_namespaces() == [NamespaceInfo(name="kube-system", created=created)]
+    assert utils.namespaces_resource_version == "42"
+
+
+DISCOVERY: dict[str, dict[str, Any]] = {
+    "/api/v1": {
+        "groupVersion": "v1",
+        "resources": [
+            {"name": "nodes", "kind": "Node", "namespaced": False, "verbs": ["list"]},
+            {"name": "nodes/status", "kind": "Node", "namespaced": False, "verbs": ["get"]},
+            {"name": "pods", "kind": "Pod", "namespaced": True, "verbs": ["list"]},
+            {"name": "bindings", "kind": "Binding", "namespaced": False, "verbs": ["create"]},
+        ],
+    },
+    "/apis": {
+        "groups": [
+            {"preferredVersion": {"groupVersion": "apiregistration.k8s.io/v1"}},
+            {"preferredVersion": {"groupVersion": "cert-manager.io/v1"}},
+            {"preferredVersion": {"groupVersion": "acme.example.com/v1alpha1"}},
+            {"preferredVersion": {"groupVersion": "metrics.k8s.io/v1beta1"}},
+        ]
+    },
+    "/apis/apiregistration.k8s.io/v1": {
+        "groupVersion": "apiregistration.k8s.io/v1",
+        "resources": [
+            {"name": "apiservices", "kind": "APIService", "namespaced": False, "verbs": ["list"]}
+        ],
+    },
+    "/apis/cert-manager.io/v1": {
+        "groupVersion": "cert-manager.io/v1",
+        "resources": [
+            {"name": "issuers", "kind": "ClusterIssuer", "namespaced": False, "verbs": ["list"]}
+        ],
+    },
+    "/apis/acme.example.com/v1alpha1": {
+        "groupVersion": "acme.example.com/v1alpha1",
+        "resources": [
+            {"name": "issuers", "kind": "AcmeIssuer", "namespaced": False, "verbs": ["list"]}
+        ],
+    },
+}
+
+
+def discovery_client(*_: object) -> httpx.Client:
+    def handle(request: httpx.Request) -> httpx.Response:
+        groups = DISCOVERY.get("/apis", {}).get("groups", [])
+        listed = {f"/apis/{group['preferredVersion']['groupVersion']}" for group in groups}
+        if request.url.path not in listed | DISCOVERY.keys():
+            return httpx.Response(404, text="404 page not found")
+        if request.url.path not in DISCOVERY:
+            # e.g. an aggregated API whose backend is down
+            return httpx.Response(503, json={"kind": "Status", "code": 503})
+        return httpx.Response(200, json=DISCOVERY[request.url.path])
+
+    return httpx.Client(base_url="https://apiserver.local", transport=httpx.MockTransport(handle))
+
+
+def test_get_cluster_scoped_resources() -> None:
+    utils = K8sUtils("infra-backup-operator")
+
+    with patch("k8s_utils.client_adapter.Client", discovery_client):
+        resources = utils.get_cluster_scoped_resources()
+
+    # the plurals shared by several groups are kept apart
+    assert list(resources) == [
+        "nodes",
+        "apiservices.apiregistration.k8s.io",
+        "issuers.cert-manager.io",
+        "issuers.acme.example.com",
+    ]
+    assert resources["nodes"] is Node
+    assert resources["issuers.acme.example.com"]._api_info.resource.version == "v1alpha1"
+
+
+def test_get_cluster_scoped_resources_error() -> None:
+    utils = K8sUtils("infra-backup-operator")
+
+    with (
+        patch("k8s_utils.client_adapter.Client", discovery_client),
+        patch.dict(DISCOVERY, clear=True),
+        pytest.raises(K8sUtilsError, match="Failed to discover /apis"),
+    ):
+        utils.get_cluster_scoped_resources()
+
+
+def test_has_api() -> None:
+    utils = K8sUtils("infra-backup-operator")
+
+    with patch("k8s_utils.client_adapter.Client", discovery_client):
+        assert utils.has_api("apiregistration.k8s.io/v1")
+        # e.g. flowcontrol.apiserver.k8s.io/v1 before Kubernetes 1.29
+        assert not utils.has_api("flowcontrol.apiserver.k8s.io/v1")
+        with pytest.raises(K8sUtilsError, match="Failed to discover /apis/metrics.k8s.io"):
+            utils.has_api("metrics.k8s.io/v1beta1")
+
+
+def test_get_namespaced_resources(mock_lightkube_client: MagicMock) -> None:
+    crd = MagicMock()
+    crd.spec.scope = "Namespaced"
+    crd.spec.group = "cilium.io"
+    crd.spec.names.kind = "CiliumNetworkPolicy"
+    crd.spec.names.plural = "ciliumnetworkpolicies"
+    crd.spec.versions = [MagicMock(storage=True)]
+    crd.spec.versions[0].name = "v2"
+
+    mock_lightkube_client.list.return_value = [crd]
+    utils = K8sUtils("infra-backup-operator")
+
+    resources = utils.get_namespaced_resources()
+
+    assert {"deployments", "services", "ciliumnetworkpolicies"} <= resources.keys()
+    assert "pods" not in resources
+
+
+def list_client(
+    pages: dict[str, dict[str, Any]], requests: Optional[list[httpx.Request]] = None
+) -> Callable[..., httpx.Client]:
+    """Serve a first list page for the paths of `pages`, and 403 otherwise."""
+    requests = [] if requests is None else requests
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path not in pages:
+            return httpx.Response(403, json={"kind": "Status", "code": 403})
+        return httpx.Response(200, json=pages[request.url.path])
+
+    def client(*_: object) -> httpx.Client:
+        return httpx.Client(
+            base_url="https://apiserver.local", transport=httpx.MockTransport(handle)
+        )
+
+    return client
+
+
+def test_count_namespaced_objects(mock_lightkube_client: MagicMock) -> None:
+    path = "/apis/apps/v1/namespaces/kube-system/deployments"
+    page = {"metadata": {"continue": "x", "remainingItemCount": 1}, "items": [{}]}
+    requests: list[httpx.Request] = []
+    utils = K8sUtils("infra-backup-operator")
+
+    with patch("k8s_utils.client_adapter.Client", list_client({path: page}, requests)):
+        assert utils.count_objects(Deployment, "kube-system") == 2
+
+    # a single object is listed, with its metadata only
+    [request] = requests
+    assert request.url.params["limit"] == "1"
+    assert "as=PartialObjectMetadataList" in request.headers["accept"]
+    mock_lightkube_client.list.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "page, count",
+    [({"metadata": {}, "items": [{}]}, 1), ({"metadata": {}, "items": []}, 0)],
+    ids=["single page", "empty"],
+)
+def test_count_objects(mock_lightkube_client: MagicMock, page: dict[str, Any], count: int) -> None:
+    utils = K8sUtils("infra-backup-operator")
+
+    with patch("k8s_utils.client_adapter.Client", list_client({"/api/v1/nodes": page})):
+        assert utils.count_objects(Node) == count
+
+    mock_lightkube_client.list.assert_not_called()
+
+
+def test_count_objects_without_remaining_count(mock_lightkube_client: MagicMock) -> None:
+    # e.g. an aggregated API that does not tell the remaining count
+    page = {"metadata": {"continue": "x"}, "items": [{}]}
+    mock_lightkube_client.list.return_value = iter([object()] * 3)
+    utils = K8sUtils("infra-backup-operator")
+
+    with patch("k8s_utils.client_adapter.Client", list_client({"/api/v1/nodes": page})):
+        assert utils.count_objects(Node) == 3
+
+    mock_lightkube_client.list.assert_called_once_with(Node, chunk_size=LIST_CHUNK_SIZE)
+
+
+def test_count_objects_error() -> None:
+    utils = K8sUtils("infra-backup-operator")
+    with (
+        patch("k8s_utils.client_adapter.Client", list_client({})),
+        pytest.raises(K8sUtilsError, match="Failed to list nodes"),
+    ):
+        utils.count_objects(Node)
+
+
+def test_iter_all_objects(mock_lightkube_client: MagicMock) -> None:
+    secrets = [object(), object()]
+    mock_lightkube_client.list.return_value = iter(secrets)
+    utils = K8sUtils("infra-backup-operator")
+
+    assert list(utils.iter_all_objects(Secret)) == secrets
+    mock_lightkube_client.list.assert_called_once_with(
+        Secret, namespace="*", chunk_size=LIST_CHUNK_SIZE
+    )
+
+
+def test_patch_metadata(mock_lightkube_client: MagicMock) -> None:
+    utils = K8sUtils("infra-backup-operator")
+    utils.patch_metadata(Secret, "tls", "team-a", labels={"a": "b"}, annotations={"c": None})
+
+    mock_lightkube_client.patch.assert_called_once_with(
+        Secret,
+        "tls",
+        {"metadata": {"labels": {"a": "b"}, "annotations": {"c": None}}},
+        namespace="team-a",
+    )
+
+
+def test_patch_metadata_error(mock_lightkube_client: MagicMock) -> None:
+    mock_lightkube_client.patch.side_effect = make_api_error()
+    utils = K8sUtils("infra-backup-operator")
+    with pytest.raises(K8sUtilsError, match="Failed to patch secrets team-a/tls"):
+        utils.patch_metadata(Secret, "tls", "team-a", labels={}, annotations={})
@@ -0,0 +1,57 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import dataclasses
+
+import pytest
+
+from leader_snapshot import LeaderSnapshot, digest, to_plain
+
+
+def snapshot(**kwargs: object) -> LeaderSnapshot:
+    fields = {
+        "taken_at": 1000.0,
+        "resource_version": "42",
+        "config_digest": digest("{}"),
+        "selected_namespaces": ["kube-system"],
+        "excluded_namespaces": None,
+        "spec_digests": {"cluster-infra-backup": digest("{}")},
+        "namespace_selection": {"published": ["kube-system"]},
+    }
+    return LeaderSnapshot(**{**fields, **kwargs})  # type: ignore[arg-type]
+
+
+def test_json_round_trip() -> None:
+    assert LeaderSnapshot.from_json(snapshot().to_json()) == snapshot()
+
+
+@pytest.mark.parametrize("raw", ["not json", '{"taken_at": 1}', '{"unknown": 1}'])
+def test_from_json_invalid(raw: str) -> None:
+    with pytest.raises(ValueError):
+        LeaderSnapshot.from_json(raw)
+
+
+def test_is_fresh() -> None:
+    assert snapshot().is_fresh(1599, max_age=600)
+    assert not snapshot().is_fresh(1600, max_age=600)
+    # a snapshot from the future, e.g. clock skew between units, is not trusted
+    assert not snapshot().is_fresh(999, max_age=600)
+
+
+def test_same_state() -> None:
+    assert snapshot().same_state(snapshot(taken_at=2000.0, resource_version="43"))
+    assert not snapshot().same_state(snapshot(selected_namespaces=[]))
+    assert not snapshot().same_state(None)
+
+
+def test_same_state_checked_at() -> None:
+    counted = snapshot(namespace_objects={"kube-system": {"count": 0, "checked_at": 1000.0}})
+    recounted = snapshot(namespace_objects={"kube-system": {"count": 0, "checked_at": 1060.0}})
+    assert counted.same_state(recounted)
+    grown = snapshot(namespace_objects={"kube-system": {"count": 3, "checked_at": 1060.0}})
+    assert not counted.same_state(grown)
+
+
+def test_to_plain() -> None:
+    value = {"published": ("a", "b"), "missing_since": {"c": 1.0}, "name": "abc"}
+    assert to_plain(value) == {"published": ["a", "b"], "missing_since": {"c": 1.0}, "name": "abc"}
+    assert dataclasses.asdict(snapshot(namespace_selection=to_plain(value)))
@@ -0,0 +1,49 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+from pathlib import Path
+
+from metrics import CharmMetrics
+
+
+def test_render() -> None:
+    metrics = CharmMetrics({})
+    metrics.set("infra_backup_cluster_namespaces", 3)
+    metrics.inc("infra_backup_k8s_api_errors_total", operation="list_namespaces")
+    metrics.inc("infra_backup_k8s_api_errors_total", operation="list_namespaces")
+    metrics.observe("infra_backup_hook_duration_seconds", 0.5, event="update-status")
+    metrics.observe("infra_backup_hook_duration_seconds", 1.5, event="update-status")
+
+    assert metrics.render() == (
+        "# HELP infra_backup_hook_duration_seconds Time spent handling a Juju hook, by event.\n"
+        "# TYPE infra_backup_hook_duration_seconds summary\n"
+        'infra_backup_hook_duration_seconds_count{event="update-status"} 2\n'
+        'infra_backup_hook_duration_seconds_sum{event="update-status"} 2\n'
+        "# HELP infra_backup_cluster_namespaces Number of namespaces in the cluster.\n"
+        "# TYPE infra_backup_cluster_namespaces gauge\n"
+        "infra_backup_cluster_namespaces 3\n"
+        "# HELP infra_backup_k8s_api_errors_total Failed K8s API calls, by operation.\n"
+        "# TYPE infra_backup_k8s_api_errors_total counter\n"
+        'infra_backup_k8s_api_errors_total{operation="list_namespaces"} 2\n'
+    )
+
+
+def test_render_precision() -> None:
+    metrics = CharmMetrics({})
+    metrics.set("infra_backup_estimated_min_bytes", 123456789)
+    metrics.set("infra_backup_namespace_list_duration_seconds", 0.123456789)
+
+    rendered = metrics.render()
+
+    assert "infra_backup_estimated_min_bytes 123456789\n" in rendered
+    assert "infra_backup_namespace_list_duration_seconds 0.123456789\n" in rendered
+
+
+def test_write(tmp_path: Path) -> None:
+    metrics = CharmMetrics({})
+    metrics.set("infra_backup_selected_namespaces", 2)
+    path = tmp_path / "collector" / "infra-backup.prom"
+
+    metrics.write(path)
+
+    assert "infra_backup_selected_namespaces 2\n" in path.read_text()
+    assert [p.name for p in path.parent.iterdir()] == ["infra-backup.prom"]
@@ -0,0 +1,148 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+from datetime import datetime, timedelta, timezone
+
+from k8s_utils import NamespaceInfo
+from namespace_selection import (
+    ExclusionDebouncer,
+    NamespaceContentCache,
+    NamespaceSelector,
+    cap_namespaces,
+    match_namespaces,
+)
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+CONFIGURED = {"kube-system", "ci"}
+
+
+def minutes(value: int) -> datetime:
+    return START + timedelta(minutes=value)
+
+
+def cluster(**created: int) -> list[NamespaceInfo]:
+    return [NamespaceInfo(name=name, created=minutes(at)) for name, at in created.items()]
+
+
+def test_select_without_policy() -> None:
+    selector = NamespaceSelector({})
+
+    assert selector.select(cluster(kube_system=0), {"kube_system"}, minutes(0)) == {"kube_system"}
+    assert selector.select(cluster(), {"kube_system"}, minutes(1)) == set()
+
+
+def test_min_age() -> None:
+    selector = NamespaceSelector({}, min_age=600)
+
+    assert selector.select(cluster(a=0, b=5), {"a", "b"}, minutes(11)) == {"a"}
+    assert selector.select(cluster(a=0, b=5), {"a", "b"}, minutes(15)) == {"a", "b"}
+
+
+def test_removal_grace() -> None:
+    selector = NamespaceSelector({}, removal_grace=600)
+    selector.select(cluster(a=0, b=0), {"a", "b"}, minutes(0))
+
+    assert selector.select(cluster(a=0), {"a", "b"}, minutes(1)) == {"a", "b"}
+    # recreated during the grace period, it is kept without waiting for min-age
+    assert selector.select(cluster(a=0, b=5), {"a", "b"}, minutes(5)) == {"a", "b"}
+    assert selector.select(cluster(a=0), {"a", "b"}, minutes(6)) == {"a", "b"}
+    assert selector.select(cluster(a=0), {"a", "b"}, minutes(16)) == {"a"}
+
+
+def test_removal_from_config_ignores_grace() -> None:
+    selector = NamespaceSelector({}, removal_grace=600)
+    selector.select(cluster(a=0, b=0), {"a", "b"}, minutes(0))
+
+    assert selector.select(cluster(a=0, b=0), {"a"}, minutes(1)) == {"a"}
+
+
+def test_debounce() -> None:
+    selector = NamespaceSelector({}, debounce=1800)
+    assert selector.select(cluster(a=0), {"a", "b", "c"}, minutes(0)) == {"a"}
+
+    # churn inside the window is not published
+    assert selector.select(cluster(a=0, b=1), {"a", "b", "c"}, minutes(1)) == {"a"}
+    assert selector.select(cluster(a=0, c=2), {"a", "b", "c"}, minutes(2)) == {"a"}
+    # after the window, the current selection is published once
+    assert selector.select(cluster(a=0, c=2), {"a", "b", "c"}, minutes(31)) == {"a", "c"}
+    assert selector.select(cluster(a=0), {"a", "b", "c"}, minutes(32)) == {"a", "c"}
+    # config changes are applied at once
+    assert selector.select(cluster(a=0), {"a"}, minutes(33)) == {"a"}
+
+
+def test_bounded_spec_changes() -> None:
+    selector = NamespaceSelector({}, min_age=300, removal_grace=600, debounce=1800)
+    published = []
+    # a short-lived "ci" namespace is created and deleted every 2 minutes for 2 hours
+    for minute in range(120):
+        namespaces = (
+            cluster(kube_system=-60, ci=minute) if minute % 2 else cluster(kube_system=-60)
+        )
+        published.append(selector.select(namespaces, {"kube_system", "ci"}, minutes(minute)))
+
+    changes = sum(1 for before, after in zip(published, published[1:]) if before != after)
+    assert changes == 0
+    assert published[-1] == {"kube_system"}
+
+
+def test_exclusion_debouncer() -> None:
+    debouncer = ExclusionDebouncer({}, debounce=1800)
+    assert debouncer.resolve(["ci-1"], "ci-*", minutes(0)) == ["ci-1"]
+
+    # CI namespaces created and deleted inside the window are not published
+    assert debouncer.resolve(["ci-1", "ci-2"], "ci-*", minutes(1)) == ["ci-1"]
+    assert debouncer.resolve([], "ci-*", minutes(2)) == ["ci-1"]
+    # after the window, the current exclusions are published once
+    assert debouncer.resolve(["ci-3"], "ci-*", minutes(31)) == ["ci-3"]
+    assert debouncer.resolve(["ci-3", "ci-4"], "ci-*", minutes(32)) == ["ci-3"]
+    # config changes are applied at once
+    assert debouncer.resolve(["pr-1"], "pr-*", minutes(33)) == ["pr-1"]
+
+
+def test_match_namespaces() -> None:
+    namespaces = [
+        NamespaceInfo(name="kube-system", created=START),
+        NamespaceInfo(name="ci-1234", created=START),
+        NamespaceInfo(name="preview-a", created=START, labels={"env": "preview", "team": "a"}),
+        NamespaceInfo(name="team-b", created=START, labels={"env": "preview"}),
+        NamespaceInfo(name="default", created=START),
+    ]
+
+    assert match_namespaces(namespaces, set(), {}) == []
+    assert match_namespaces(namespaces, {"default", "ci-*"}, {}) == ["ci-1234", "default"]
+    assert match_namespaces(namespaces, {"ci-[0-9]*"}, {"env": "preview", "team": "a"}) == [
+        "ci-1234",
+        "preview-a",
+    ]
+    assert match_namespaces(namespaces, set(), {"env": "preview"}) == ["preview-a", "team-b"]
+
+
+def test_namespace_content_cache() -> None:
+    objects = {"a": 3, "b": 0}
+    counted: list[str] = []
+
+    def counter(namespace: str) -> int:
+        counted.append(namespace)
+        return objects[namespace]
+
+    state: dict = {}
+    cache = NamespaceContentCache(state, counter, max_age=3600)
+
+    assert cache.counts(["a", "b"], minutes(0)) == {"a": 3, "b": 0}
+    # the empty namespace is cached too, until its count expires
+    objects["b"] = 1
+    assert cache.counts(["a", "b"], minutes(1)) == {"a": 3, "b": 0}
+    assert counted == ["a", "b"]
+    # the cached counts expire and unselected namespaces are forgotten
+    objects["a"] = 0
+    assert cache.counts(["a"], minutes(61)) == {"a": 0}
+    assert set(state) == {"a"}
+
+
+def test_cap_namespaces() -> None:
+    counts = {"kube-system": 40, "team-a": 25, "team-b": 25, "empty": 0, "huge": 1000}
+
+    assert cap_namespaces(counts, 1000) == {"kube-system", "team-a", "team-b", "empty"}
+    # the smallest namespaces are kept first, ties broken by name
+    assert cap_namespaces(counts, 60) == {"empty", "team-a", "team-b"}
+    assert cap_namespaces(counts, 30) == {"empty", "team-a"}
+    assert cap_namespaces(counts, 0) == {"empty"}
@@ -0,0 +1,53 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import time
+
+from fake_hook_tools import FakeHookTools
+from ops import hookcmds
+
+from profiling import HOOK_TOOL_CALL, CallStats, call_stats, hot_functions, profile
+
+FAKE_API_CALL = ("unit/test_profiling.py", "fake_api_call")
+
+
+def fake_api_call() -> None:
+    time.sleep(0.001)
+
+
+def reconcile() -> None:
+    for _ in range(3):
+        fake_api_call()
+
+
+def test_call_stats() -> None:
+    stats = call_stats(profile(reconcile), FAKE_API_CALL)
+
+    assert stats.calls == 3
+    assert stats.seconds >= 0.003
+    assert call_stats(profile(reconcile), ("other.py", "fake_api_call")) == CallStats()
+
+
+def test_call_stats_hook_tools(hook_tools: FakeHookTools) -> None:
+    relation_id = hook_tools.add_relation("backup", "velero", {"spec": "{}"})
+
+    def read_relation() -> None:
+        hookcmds.relation_ids("backup")
+        hookcmds.relation_get(relation_id, unit="velero", app=True)
+
+    assert call_stats(profile(read_relation), HOOK_TOOL_CALL).calls == 2
+
+
+def test_call_stats_as_results() -> None:
+    assert CallStats(4, 2.0).as_results() == {
+        "calls": "4",
+        "total-seconds": "2.000000",
+        "mean-seconds": "0.500000",
+    }
+    assert CallStats().as_results()["mean-seconds"] == "0.000000"
+
+
+def test_hot_functions() -> None:
+    table = hot_functions(profile(reconcile), top=1)
+
+    assert "sleep" in table
+    assert "fake_api_call" not in table
@@ -0,0 +1,147 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from literals import (
+    CLUSTER_INFRA_BACKUP,
+    NAMESPACED_INFRA_BACKUP,
+    TTL_TIER_ENDPOINTS,
+    VOLATILE_INFRA_BACKUP,
+)
+from render_specs import load_config, main, render_fleet
+
+
+def namespace_list(*names: str, **extra: str) -> dict:
+    return {
+        "kind": "NamespaceList",
+        "items": [{"kind": "Namespace", "metadata": {"name": name}} for name in names],
+        **extra,
+    }
+
+
+def test_load_config(tmp_path: Path) -> None:
+    config_file = tmp_path / "config.json"
+    config_file.write_text(
+        json.dumps(
+            {
+                "namespaces": "kube-system",
+                "volatile-infra-backup-ttl": "24h",
+                "prune-empty-namespaces": False,
+            }
+        )
+    )
+
+    config = load_config(config_file)
+
+    assert config.backup_namespaces == {"kube-system"}
+    assert config.volatile_infra_backup_ttl == "24h"
+
+
+@pytest.mark.parametrize(
+    "options, exp_msg",
+    [
+        ({"namespace": "kube-system"}, "Unknown option: 'namespace'"),
+        ({"namespace-min-age": "1h"}, "Unsupported option: 'namespace-min-age'"),
+        ({"spec-debounce": "10m"}, "Unsupported option: 'spec-debounce'"),
+        ({"prune-empty-namespaces": True}, "Unsupported option: 'prune-empty-namespaces'"),
+        ({"backup-budget-objects": 100}, "Unsupported option: 'backup-budget-objects'"),
+    ],
+)
+def test_load_config_rejected(tmp_path: Path, options: dict, exp_msg: str) -> None:
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps(options))
+
+    with pytest.raises(ValueError, match=exp_msg):
+        load_config(config_file)
+
+
+def test_render_fleet_exclude_namespaces(tmp_path: Path) -> None:
+    snapshot = namespace_list("kube-system", "ci-1")
+    snapshot["items"].append(
+        {
+            "metadata": {
+                "name": "pr-1",
+                "creationTimestamp": "2025-01-01T00:00:00Z",
+                "labels": {"env": "preview"},
+            }
+        }
+    )
+    (tmp_path / "prod.json").write_text(json.dumps(snapshot))
+    config_file = tmp_path / "config.json"
+    config_file.write_text(
+        json.dumps(
+            {"namespaced-exclude-namespaces": "ci-*", "namespaced-exclude-selector": "env=preview"}
+        )
+    )
+    output = io.StringIO()
+
+    render_fleet([tmp_path / "prod.json"], load_config(config_file), False, output, workers=1)
+
+    specs = json.loads(output.getvalue())["specs"]
+    assert specs[NAMESPACED_INFRA_BACKUP]["exclude_namespaces"] == ["ci-1", "pr-1"]
+
+
+def test_render_fleet(tmp_path: Path) -> None:
+    (tmp_path / "prod.json").write_text(json.dumps(namespace_list("kube-system", "default")))
+    (tmp_path / "fleet.ndjson").write_text(
+        json.dumps(namespace_list("kube-public", cluster="dev"))
+        + "\n\n"
+        + "not json\n"
+        + json.dumps(namespace_list("metallb-system", "kube-system"))
+        + "\n"
+    )
+    output = io.StringIO()
+
+    failures = render_fleet(
+        [tmp_path / "prod.json", tmp_path / "fleet.ndjson"],
+        load_config(None),
+        volatile_split=True,
+        output=output,
+        workers=2,
+    )
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert failures == 1
+    assert [result["cluster"] for result in results] == ["prod", "dev", "fleet:2", "fleet:3"]
+    assert "error" in results[2]
+    assert results[0]["specs"][CLUSTER_INFRA_BACKUP]["include_namespaces"] == ["kube-system"]
+    assert results[3]["specs"][CLUSTER_INFRA_BACKUP]["include_namespaces"] == [
+        "kube-system",
+        "metallb-system",
+    ]
+    assert set(results[1]["specs"]) == {
+        CLUSTER_INFRA_BACKUP,
+        NAMESPACED_INFRA_BACKUP,
+        VOLATILE_INFRA_BACKUP,
+    }
+
+
+def test_main_invalid_config(tmp_path: Path) -> None:
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"namespaces": "Kube-System"}))
+
+    with pytest.raises(SystemExit):
+        main(["--config", str(config_file), str(tmp_path / "prod.json")])
+
+
+def test_main_related_tiers(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    (tmp_path / "prod.json").write_text(
+        json.dumps(namespace_list("kube-system", "metallb-system"))
+    )
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"namespace-ttl-tiers": "metallb-*=72h"}))
+    args = ["--config", str(config_file), str(tmp_path / "prod.json"), "--workers", "1"]
+
+    assert main(args) == 0
+    specs = json.loads(capsys.readouterr().out)["specs"]
+    assert specs[CLUSTER_INFRA_BACKUP]["include_namespaces"] == ["kube-system", "metallb-system"]
+
+    assert main([*args, "--related-tier", TTL_TIER_ENDPOINTS[0]]) == 0
+    specs = json.loads(capsys.readouterr().out)["specs"]
+    assert specs[CLUSTER_INFRA_BACKUP]["include_namespaces"] == ["kube-system"]
+    assert specs[TTL_TIER_ENDPOINTS[0]]["include_namespaces"] == ["metallb-system"]
+    assert specs[TTL_TIER_ENDPOINTS[0]]["ttl"] == "72h"
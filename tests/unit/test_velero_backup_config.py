@@ -0,0 +1,445 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import subprocess
+import timeit
+from collections import Counter
+from typing import Optional
+
+import ops
+import pytest
+from charms.velero_libs.v0.velero_backup_config import (
+    LIBPATCH,
+    LIBPATCH_FIELD,
+    ScopeSet,
+    VeleroBackupProvider,
+    VeleroBackupRequier,
+    VeleroBackupSpec,
+    coalesce_specs,
+    compute_spec_overlaps,
+)
+from fake_hook_tools import FakeHookTools
+from ops import testing
+from pydantic import ValidationError
+from pytest_mock import MockerFixture
+
+from literals import RESOURCES_BACKUP
+
+ENDPOINT = "backup"
+SPEC_KWARGS = {
+    "include_namespaces": ["kube-system"],
+    "exclude_resources": RESOURCES_BACKUP + ["persistentvolumes", "pods"],
+    "include_cluster_resources": True,
+    "ttl": "720h",
+}
+
+
+class ProviderCharm(ops.CharmBase):
+    def __init__(self, framework: ops.Framework) -> None:
+        super().__init__(framework)
+        self.provider = VeleroBackupProvider(
+            self, ENDPOINT, VeleroBackupSpec(**SPEC_KWARGS), [self.on.update_status]
+        )
+
+
+class RequirerCharm(ops.CharmBase):
+    def __init__(self, framework: ops.Framework) -> None:
+        super().__init__(framework)
+        self.requirer = VeleroBackupRequier(self, ENDPOINT)
+
+
+def provider_context() -> testing.Context:
+    return testing.Context(
+        ProviderCharm, meta={"name": "provider", "provides": {ENDPOINT: {"interface": "i"}}}
+    )
+
+
+def requirer_context() -> testing.Context:
+    return testing.Context(
+        RequirerCharm, meta={"name": "requirer", "requires": {ENDPOINT: {"interface": "i"}}}
+    )
+
+
+def published_relations(count: int) -> list[testing.Relation]:
+    spec = VeleroBackupSpec(**SPEC_KWARGS).model_dump_json()
+    return [
+        testing.Relation(
+            ENDPOINT,
+            remote_app_name=f"app{i}",
+            remote_app_data={"app": f"app{i}", "model": "m", "relation_name": "e", "spec": spec},
+        )
+        for i in range(count)
+    ]
+
+
+ALL = ScopeSet(complement=True)
+
+
+@pytest.mark.parametrize(
+    "include, exclude, expected",
+    [
+        (None, None, ALL),
+        (["*"], ["a"], ScopeSet(frozenset({"a"}), complement=True)),
+        (["a", "B"], ["b"], ScopeSet(frozenset({"a"}))),
+        (["a"], ["*"], ScopeSet()),
+    ],
+    ids=["everything", "everything except", "finite", "exclude everything"],
+)
+def test_scope_set_from_spec(
+    include: list[str] | None, exclude: list[str] | None, expected: ScopeSet
+) -> None:
+    assert ScopeSet.from_spec(include, exclude) == expected
+
+
+@pytest.mark.parametrize(
+    "first, second, expected",
+    [
+        (ScopeSet(frozenset("ab")), ScopeSet(frozenset("bc")), ScopeSet(frozenset("b"))),
+        (ScopeSet(frozenset("ab")), ScopeSet(frozenset("b"), True), ScopeSet(frozenset("a"))),
+        (ScopeSet(frozenset("b"), True), ScopeSet(frozenset("ab")), ScopeSet(frozenset("a"))),
+        (
+            ScopeSet(frozenset("a"), True),
+            ScopeSet(frozenset("b"), True),
+            ScopeSet(frozenset("ab"), True),
+        ),
+    ],
+    ids=["finite & finite", "finite & co-finite", "co-finite & finite", "co-finite & co-finite"],
+)
+def test_scope_set_intersection(first: ScopeSet, second: ScopeSet, expected: ScopeSet) -> None:
+    assert first & second == expected
+
+
+def test_compute_spec_overlaps_infra_specs_are_disjoint() -> None:
+    specs = {
+        "cluster": VeleroBackupSpec(
+            include_namespaces=["kube-system"],
+            exclude_resources=RESOURCES_BACKUP + ["persistentvolumes", "pods"],
+            include_cluster_resources=True,
+        ),
+        "namespaced": VeleroBackupSpec(include_resources=RESOURCES_BACKUP),
+    }
+    assert compute_spec_overlaps(specs) == []
+
+
+def test_compute_spec_overlaps() -> None:
+    specs = {
+        "cluster": VeleroBackupSpec(
+            include_namespaces=["kube-system"],
+            exclude_resources=["pods"],
+            include_cluster_resources=True,
+        ),
+        "workload": VeleroBackupSpec(
+            include_namespaces=["kube-system", "user"],
+            include_resources=["deployments", "pods"],
+        ),
+        "everything": VeleroBackupSpec(exclude_namespaces=["user"]),
+    }
+
+    overlaps = {(o.first, o.second): o for o in compute_spec_overlaps(specs)}
+
+    assert set(overlaps) == {
+        ("cluster", "workload"),
+        ("cluster", "everything"),
+        ("workload", "everything"),
+    }
+    assert overlaps["cluster", "workload"].namespaces == ScopeSet(frozenset({"kube-system"}))
+    assert overlaps["cluster", "workload"].resources == ScopeSet(frozenset({"deployments"}))
+    assert not overlaps["cluster", "workload"].cluster_resources
+    assert overlaps["cluster", "everything"].cluster_resources is False
+    assert overlaps["cluster", "everything"].resources == ScopeSet(frozenset({"pods"}), True)
+    assert overlaps["workload", "everything"].namespaces == ScopeSet(frozenset({"kube-system"}))
+
+
+def test_compute_spec_overlaps_label_selectors() -> None:
+    specs = {
+        "a": VeleroBackupSpec(label_selector={"app": "a"}),
+        "b": VeleroBackupSpec(label_selector={"app": "b"}),
+        "c": VeleroBackupSpec(label_selector={"tier": "infra"}),
+        "d": VeleroBackupSpec(exclude_labels=["tier"]),
+    }
+
+    overlaps = {(o.first, o.second) for o in compute_spec_overlaps(specs)}
+
+    assert overlaps == {("a", "c"), ("b", "c"), ("a", "d"), ("b", "d")}
+
+
+@pytest.mark.parametrize(
+    "first, second, union, subset",
+    [
+        (ScopeSet(frozenset("ab")), ScopeSet(frozenset("bc")), ScopeSet(frozenset("abc")), False),
+        (
+            ScopeSet(frozenset("a")),
+            ScopeSet(frozenset("ab"), True),
+            ScopeSet(frozenset("b"), True),
+            False,
+        ),
+        (
+            ScopeSet(frozenset("a")),
+            ScopeSet(frozenset("b"), True),
+            ScopeSet(frozenset("b"), True),
+            True,
+        ),
+        (
+            ScopeSet(frozenset("ab"), True),
+            ScopeSet(frozenset("a"), True),
+            ScopeSet(frozenset("a"), True),
+            True,
+        ),
+    ],
+    ids=["finite | finite", "finite | co-finite", "subset", "co-finite | co-finite"],
+)
+def test_scope_set_union(first: ScopeSet, second: ScopeSet, union: ScopeSet, subset: bool) -> None:
+    assert first | second == second | first == union
+    assert (first <= second) is subset
+    assert first <= union and second <= union
+
+
+@pytest.mark.parametrize(
+    "scope",
+    [
+        ScopeSet(frozenset("ab")),
+        ScopeSet(complement=True),
+        ScopeSet(frozenset("a"), True),
+    ],
+    ids=["finite", "everything", "co-finite"],
+)
+def test_scope_set_to_spec(scope: ScopeSet) -> None:
+    assert ScopeSet.from_spec(*scope.to_spec()) == scope
+
+
+def test_scope_set_to_spec_empty() -> None:
+    # no include list means everything, and Velero rejects "*" in the exclude lists
+    with pytest.raises(ValueError, match="empty set"):
+        ScopeSet().to_spec()
+
+
+def test_coalesce_specs() -> None:
+    specs = {
+        "rbac": VeleroBackupSpec(include_resources=["roles", "rolebindings"], ttl="24h"),
+        "policies": VeleroBackupSpec(include_resources=["networkpolicies"], ttl="24h"),
+        "kube-system": VeleroBackupSpec(
+            include_namespaces=["kube-system"],
+            include_resources=["roles"],
+            include_cluster_resources=True,
+            ttl="24h",
+        ),
+        "other-ttl": VeleroBackupSpec(include_resources=["secrets"], ttl="1h"),
+        "app": VeleroBackupSpec(
+            include_namespaces=["app"], include_resources=["deployments"], ttl="24h"
+        ),
+        "app-db": VeleroBackupSpec(
+            include_namespaces=["app-db"], include_resources=["deployments"], ttl="24h"
+        ),
+    }
+
+    coalesced = {tuple(c.keys): c.spec for c in coalesce_specs(specs)}
+
+    assert coalesced == {
+        # all namespaces, merged resources, kube-system roles are already covered
+        ("rbac", "policies", "kube-system"): VeleroBackupSpec(
+            include_namespaces=["*"],
+            include_resources=["networkpolicies", "rolebindings", "roles"],
+            include_cluster_resources=True,
+            ttl="24h",
+        ),
+        ("other-ttl",): specs["other-ttl"],
+        # same resources, merged namespaces
+        ("app", "app-db"): VeleroBackupSpec(
+            include_namespaces=["app", "app-db"],
+            include_resources=["deployments"],
+            include_cluster_resources=False,
+            ttl="24h",
+        ),
+    }
+
+
+def test_coalesce_specs_keeps_exact_scopes() -> None:
+    specs = {
+        # the union would also back up the deployments of kube-system
+        "cluster": VeleroBackupSpec(
+            include_namespaces=["kube-system"], include_resources=["roles"]
+        ),
+        "app": VeleroBackupSpec(include_namespaces=["app"], include_resources=["deployments"]),
+        "selected": VeleroBackupSpec(include_resources=["roles"], label_selector={"a": "b"}),
+        # backed up with all the namespaces, unlike the "cluster" roles
+        "cluster-scoped": VeleroBackupSpec(
+            include_namespaces=["kube-system"],
+            include_resources=["nodes"],
+            include_cluster_resources=True,
+        ),
+        "infra": VeleroBackupSpec(include_resources=RESOURCES_BACKUP),
+        "infra-cluster": VeleroBackupSpec(**SPEC_KWARGS),
+        # the cluster-scoped resources only, Velero cannot select no namespace
+        "nodes": VeleroBackupSpec(
+            include_namespaces=["a"],
+            exclude_namespaces=["a"],
+            include_resources=["nodes"],
+            include_cluster_resources=True,
+        ),
+        "storageclasses": VeleroBackupSpec(
+            include_namespaces=["a"],
+            exclude_namespaces=["a"],
+            include_resources=["storageclasses"],
+            include_cluster_resources=True,
+        ),
+    }
+
+    coalesced = coalesce_specs(specs)
+
+    assert [c.keys for c in coalesced] == [[key] for key in specs]
+    assert [c.spec for c in coalesced] == list(specs.values())
+
+
+def test_coalesce_specs_skips_empty_scopes() -> None:
+    specs = {
+        "nothing": VeleroBackupSpec(include_resources=["roles"], exclude_resources=["*"]),
+        "no-namespace": VeleroBackupSpec(
+            include_namespaces=["a"], exclude_namespaces=["a"], include_cluster_resources=False
+        ),
+        "infra": VeleroBackupSpec(**SPEC_KWARGS),
+    }
+
+    coalesced = coalesce_specs(specs)
+
+    assert [c.keys for c in coalesced] == [["infra"]]
+
+
+def test_requirer_coalesced_specs() -> None:
+    ctx = requirer_context()
+
+    with ctx(ctx.on.update_status(), testing.State(relations=published_relations(3))) as manager:
+        coalesced = manager.charm.requirer.get_coalesced_backup_specs()
+
+    assert len(coalesced) == 1
+    assert sorted(coalesced[0].keys) == ["m/app0/e", "m/app1/e", "m/app2/e"]
+    assert coalesced[0].spec == VeleroBackupSpec(**SPEC_KWARGS)
+
+
+@pytest.mark.parametrize("ttl", ["1d", "h", "10s10m"])
+def test_spec_invalid_ttl(ttl: str) -> None:
+    with pytest.raises(ValidationError, match="Invalid TTL format"):
+        VeleroBackupSpec(ttl=ttl)
+
+
+def test_provider_serializes_once_per_dispatch(mocker: MockerFixture) -> None:
+    dump = mocker.spy(VeleroBackupSpec, "model_dump_json")
+    ctx = provider_context()
+    relations = [testing.Relation(ENDPOINT) for _ in range(5)]
+
+    with ctx(ctx.on.update_status(), testing.State(leader=True, relations=relations)) as manager:
+        state_out = manager.run()
+        spec_bytes = len(manager.charm.provider.spec_json)
+
+    assert dump.call_count == 1
+    assert manager.charm.provider.writes_performed == 5
+    assert spec_bytes == len(state_out.get_relation(relations[0].id).local_app_data["spec"])
+
+
+def test_provider_skips_unchanged_data() -> None:
+    ctx = provider_context()
+    state = testing.State(leader=True, relations=[testing.Relation(ENDPOINT)])
+    state = ctx.run(ctx.on.update_status(), state)
+
+    with ctx(ctx.on.update_status(), state) as manager:
+        manager.run()
+
+    assert manager.charm.provider.writes_performed == 0
+    assert manager.charm.provider.writes_skipped == 1
+
+
+def test_requirer_advertises_libpatch() -> None:
+    ctx = requirer_context()
+    relation = testing.Relation(ENDPOINT)
+
+    state_out = ctx.run(
+        ctx.on.relation_created(relation), testing.State(leader=True, relations=[relation])
+    )
+
+    assert state_out.get_relation(relation.id).local_app_data == {LIBPATCH_FIELD: str(LIBPATCH)}
+
+
+@pytest.mark.parametrize(
+    "advertised, expected",
+    [([], None), ([None], 0), (["8", "7"], 7), (["8", "9"], 8), (["x"], 0)],
+    ids=["no relation", "not advertised", "oldest", "newer", "invalid"],
+)
+def test_provider_requirers_libpatch(
+    advertised: list[Optional[str]], expected: Optional[int]
+) -> None:
+    ctx = provider_context()
+    relations = [
+        testing.Relation(ENDPOINT, remote_app_data={LIBPATCH_FIELD: libpatch} if libpatch else {})
+        for libpatch in advertised
+    ]
+
+    with ctx(ctx.on.update_status(), testing.State(relations=relations)) as manager:
+        assert manager.charm.provider.requirers_libpatch() == expected
+
+
+def test_requirer_validates_once_per_dispatch(mocker: MockerFixture) -> None:
+    validate = mocker.spy(VeleroBackupSpec, "model_validate_json")
+    ctx = requirer_context()
+
+    with ctx(ctx.on.update_status(), testing.State(relations=published_relations(5))) as manager:
+        specs = manager.charm.requirer.get_all_backup_specs()
+        spec = manager.charm.requirer.get_backup_spec("app3", "e", "m")
+
+    assert specs == [VeleroBackupSpec(**SPEC_KWARGS)] * 5
+    assert spec == specs[0]
+    assert validate.call_count == 1
+
+
+def test_requirer_reads_each_databag_once(
+    hook_tools: FakeHookTools, mocker: MockerFixture
+) -> None:
+    for relation in published_relations(5):
+        hook_tools.add_relation(ENDPOINT, relation.remote_app_name, relation.remote_app_data)
+    meta = {"name": "requirer", "requires": {ENDPOINT: {"interface": "i"}}}
+    requirer = hook_tools.charm(RequirerCharm, meta).requirer
+    run = mocker.spy(subprocess, "run")
+
+    for _ in range(3):
+        specs = requirer.get_all_backup_specs()
+        for i in range(5):
+            requirer.get_backup_spec(f"app{i}", "e", "m")
+        requirer.get_backup_spec_overlaps()
+
+    assert specs == [VeleroBackupSpec(**SPEC_KWARGS)] * 5
+    calls = Counter(call.args[0][0] for call in run.call_args_list)
+    # a single relation-get per related app, whatever the number of fields and specs read
+    assert calls["relation-get"] == len(hook_tools.relations)
+    assert calls["relation-ids"] == 1
+
+
+def test_provider_spec_json_cached(mocker: MockerFixture) -> None:
+    dump = mocker.spy(VeleroBackupSpec, "model_dump_json")
+    ctx = provider_context()
+    relations = [testing.Relation(ENDPOINT) for _ in range(3)]
+
+    with ctx(ctx.on.update_status(), testing.State(leader=True, relations=relations)) as manager:
+        manager.run()
+        provider = manager.charm.provider
+        spec_json = provider.spec_json
+        provider.publish()
+
+        assert provider.spec_json is spec_json
+    assert dump.call_count == 1
+    assert VeleroBackupSpec.model_validate_json(spec_json) == VeleroBackupSpec(**SPEC_KWARGS)
+
+
+@pytest.mark.benchmark
+def test_benchmark_spec_caches() -> None:
+    """Time the per-dispatch caches against the work they replace, without gating on it."""
+    spec = VeleroBackupSpec(**SPEC_KWARGS)
+    spec_json = spec.model_dump_json()
+    relations, number = 10, 200
+    timings = {
+        "dump per relation": lambda: [spec.model_dump_json() for _ in range(relations)],
+        "dump once": lambda: [spec.model_dump_json()] * relations,
+        "validate per relation": lambda: [
+            VeleroBackupSpec.model_validate_json(spec_json) for _ in range(relations)
+        ],
+        "validate once": lambda: [VeleroBackupSpec.model_validate_json(spec_json)] * relations,
+    }
+    for name, func in timings.items():
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name} ({relations} relations): {best * 1e6 / number:.1f}us")
@@ -0,0 +1,209 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+import io
+import json
+import tarfile
+from pathlib import Path
+from typing import Literal, Optional
+
+import pytest
+from charms.velero_libs.v0.velero_backup_config import VeleroBackupSpec
+from fake_backups import velero_object, write_backup
+
+from verify_backup import (
+    CLUSTER_SCOPE,
+    BackupItem,
+    iter_tar_files,
+    main,
+    parse_item_path,
+    verify_backup,
+)
+
+
+@pytest.mark.parametrize(
+    "tar_format", [tarfile.USTAR_FORMAT, tarfile.GNU_FORMAT, tarfile.PAX_FORMAT]
+)
+@pytest.mark.parametrize("mode", ["w:gz", "w"])
+def test_iter_tar_files(tmp_path: Path, tar_format: int, mode: Literal["w", "w:gz"]) -> None:
+    # long enough to need the USTAR prefix, or a PAX/GNU long name
+    namespace = "n" * 60
+    objects = [
+        velero_object("configmaps", "short", "kube-system"),
+        velero_object("configmaps", "c" * 60, namespace),
+    ]
+    backup = write_backup(
+        tmp_path / "backup.tar", *objects, preferred_copy=False, mode=mode, tar_format=tar_format
+    )
+
+    with backup.open("rb") as f:
+        files = list(iter_tar_files(f))
+
+    assert files == [("metadata/version", b"1.1.0")] + [
+        (path, json.dumps(obj).encode()) for path, obj in objects
+    ]
+
+
+def test_iter_tar_files_truncated(tmp_path: Path) -> None:
+    backup = write_backup(
+        tmp_path / "backup.tar", velero_object("configmaps", "a", "kube-system"), mode="w"
+    )
+    truncated = io.BytesIO(backup.read_bytes()[:1100])
+
+    with pytest.raises(tarfile.ReadError):
+        list(iter_tar_files(truncated))
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        (
+            "resources/roles.rbac.authorization.k8s.io/namespaces/kube-system/admin.json",
+            BackupItem(
+                "resources/roles.rbac.authorization.k8s.io/namespaces/kube-system/admin.json",
+                "roles.rbac.authorization.k8s.io",
+                "kube-system",
+                "admin",
+                10,
+            ),
+        ),
+        (
+            "./resources/storageclasses.storage.k8s.io/v1-preferredversion/cluster/ceph.xfs.json",
+            BackupItem(
+                "./resources/storageclasses.storage.k8s.io/v1-preferredversion/cluster/ceph.xfs.json",
+                "storageclasses.storage.k8s.io",
+                None,
+                "ceph.xfs",
+                10,
+                versioned=True,
+            ),
+        ),
+        ("metadata/version", None),
+        ("resources/secrets/namespaces/kube-system", None),
+    ],
+)
+def test_parse_item_path(path: str, expected: Optional[BackupItem]) -> None:
+    assert parse_item_path(path, 10) == expected
+
+
+def test_verify_backup_breakdown(tmp_path: Path) -> None:
+    backup = write_backup(
+        tmp_path / "backup.tar.gz",
+        velero_object("configmaps", "a", "kube-system"),
+        velero_object("configmaps", "b", "kube-public"),
+        velero_object("secrets", "c", "kube-system"),
+        velero_object("storageclasses.storage.k8s.io", "ceph"),
+        velero_object("namespaces", "kube-system"),
+    )
+    spec = VeleroBackupSpec(
+        include_namespaces=["kube-system", "kube-public"],
+        exclude_resources=["pods", "persistentvolumes"],
+        include_cluster_resources=True,
+    )
+
+    with backup.open("rb") as f:
+        report = verify_backup(f, spec)
+
+    # the preferred-version copies are counted in bytes only
+    assert {kind: usage.objects for kind, usage in report.kinds.items()} == {
+        "configmaps": 2,
+        "secrets": 1,
+        "storageclasses.storage.k8s.io": 1,
+        "namespaces": 1,
+    }
+    assert report.namespaces["kube-system"].objects == 2
+    assert report.namespaces[CLUSTER_SCOPE].objects == 2
+    configmap_size = len(json.dumps(velero_object("configmaps", "a", "kube-system")[1]))
+    assert report.kinds["configmaps"].bytes == 4 * configmap_size
+    assert report.total.objects == 5
+    assert not report.violations
+    assert not report.missing
+
+
+def test_verify_backup_out_of_spec(tmp_path: Path) -> None:
+    backup = write_backup(
+        tmp_path / "backup.tar.gz",
+        velero_object("roles.rbac.authorization.k8s.io", "admin", "kube-system"),
+        velero_object("pods", "coredns", "kube-system"),
+        velero_object("jobs.batch", "backup", "kube-system"),
+        velero_object("roles.rbac.authorization.k8s.io", "admin", "ci-1"),
+        velero_object("persistentvolumes", "pv-1"),
+        velero_object("namespaces", "kube-system"),
+        velero_object("namespaces", "ci-1"),
+        preferred_copy=False,
+    )
+    spec = VeleroBackupSpec(
+        include_resources=["roles", "ingresses"],
+        exclude_namespaces=["ci-1"],
+    )
+
+    with backup.open("rb") as f:
+        report = verify_backup(f, spec)
+
+    assert {reason: usage.objects for reason, usage in report.violations.items()} == {
+        "pods: resource not selected": 1,
+        "jobs.batch: resource not selected": 1,
+        "roles.rbac.authorization.k8s.io: namespace not selected": 1,
+        "persistentvolumes: cluster-scoped resource not selected": 1,
+        "namespaces: namespace not selected": 1,
+    }
+    assert "resources/pods/namespaces/kube-system/coredns.json" in report.samples
+    assert report.missing == ["ingresses"]
+
+
+def test_verify_backup_label_selector(tmp_path: Path) -> None:
+    backup = write_backup(
+        tmp_path / "backup.tar.gz",
+        velero_object("secrets", "a", "kube-system", labels={"backup": "infra"}),
+        velero_object("secrets", "b", "kube-system"),
+    )
+    spec = VeleroBackupSpec(label_selector={"backup": "infra"})
+
+    with backup.open("rb") as f:
+        report = verify_backup(f, spec)
+
+    assert report.violations["secrets: labels not selected"].objects == 1
+    assert report.samples == ["resources/secrets/namespaces/kube-system/b.json"]
+
+
+def test_verify_backup_exclude_labels(tmp_path: Path) -> None:
+    replica = "infra-backup-operator.charm.canonical.com/replica"
+    backup = write_backup(
+        tmp_path / "backup.tar.gz",
+        velero_object("configmaps", "ca", "cert-manager"),
+        velero_object("configmaps", "ca", "team-a", labels={replica: "true"}),
+    )
+    spec = VeleroBackupSpec(exclude_labels=[replica])
+
+    with backup.open("rb") as f:
+        report = verify_backup(f, spec)
+
+    assert report.violations["configmaps: label excluded"].objects == 1
+    assert report.samples == ["resources/configmaps/namespaces/team-a/ca.json"]
+
+
+def test_main(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    backup = write_backup(
+        tmp_path / "backup.tar.gz",
+        velero_object("secrets", "a", "kube-system"),
+        velero_object("pods", "b", "kube-system"),
+    )
+    spec_file = tmp_path / "spec.json"
+    spec_file.write_text(json.dumps({"exclude_resources": ["pods"]}))
+
+    assert main(["--spec", str(spec_file), "--json", str(backup)]) == 1
+
+    report = json.loads(capsys.readouterr().out)
+    assert report["kinds"]["secrets"]["objects"] == 1
+    assert report["violations"]["pods: resource not selected"]["objects"] == 1
+
+    spec_file.write_text(json.dumps({"exclude_resources": ["pods"], "include_namespaces": ["x"]}))
+    assert main(["--spec", str(spec_file), str(backup)]) == 1
+    assert "namespace not selected" in capsys.readouterr().out
+
+
+def test_main_invalid_backup(tmp_path: Path) -> None:
+    spec_file = tmp_path / "spec.json"
+    spec_file.write_text("{}")
+    (tmp_path / "backup.tar.gz").write_bytes(b"not a tarball")
+
+    assert main(["--spec", str(spec_file), str(tmp_path / "backup.tar.gz")]) == 2